@@ -5,18 +5,20 @@ from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
 import os
+from utils.db_routing import RoutingSession
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 jwt = JWTManager()
 
-def create_app(config_name='development'):
+def create_app(config_name='development', config_overrides=None):
     app = Flask(__name__)
     
     # Load configuration
     from config import config
     app.config.from_object(config[config_name])
+    app.config.update(config_overrides or {})
     
     # Initialize extensions
     CORS(app, resources={
@@ -37,20 +39,41 @@ def create_app(config_name='development'):
     bcrypt.init_app(app)
     jwt.init_app(app)
     
+    # Revoked tokens are checked against an in-memory filter
+    from utils.revocation import init_revocation
+    init_revocation(jwt)
+    
     # Register blueprints
-    from routes import auth_routes, user_routes, wallet_routes, transaction_routes, beneficiary_routes, admin_routes
+    from routes import (
+        auth_routes, user_routes, wallet_routes, transaction_routes, beneficiary_routes,
+        scheduled_transfer_routes, admin_routes
+    )
     
     app.register_blueprint(auth_routes.bp)
     app.register_blueprint(user_routes.bp)
     app.register_blueprint(wallet_routes.bp)
     app.register_blueprint(transaction_routes.bp)
     app.register_blueprint(beneficiary_routes.bp)
+    app.register_blueprint(scheduled_transfer_routes.bp)
     app.register_blueprint(admin_routes.bp)
     
-    # Create tables
+    # Compress responses for clients that accept it
+    from utils.compression import init_compression
+    init_compression(app)
+    
+    # Profile requests on demand (registered last so compression is not profiled)
+    from utils.profiling import init_profiling
+    init_profiling(app)
+    
+    # Register CLI commands
+    from utils.commands import register_commands
+    register_commands(app)
+    
+    # Create or migrate tables
     with app.app_context():
-        db.create_all()
-        from utils.seed import create_default_admin
-        create_default_admin()
+        from utils.migrations import init_schema
+        if not init_schema(app, db):
+            from utils.seed import create_default_admin
+            create_default_admin()
     
     return app
\ No newline at end of file
@@ -13,9 +13,15 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(os.environ.get('JWT_ACCESS_TOKEN_MINUTES', 15)))
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     
+    # Token revocation (see utils/revocation.py)
+    JWT_REVOCATION_SYNC_SECONDS = int(os.environ.get('JWT_REVOCATION_SYNC_SECONDS', 10))
+    JWT_REVOCATION_RELOAD_SECONDS = 3600
+    JWT_REVOCATION_COMMIT_LAG_SECONDS = 60  # each sync rereads revocations this recent
+    JWT_REVOCATION_BLOOM_CAPACITY = 100000
+    
     # CORS Configuration
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:5173').split(',')
     
@@ -23,9 +29,93 @@ class Config:
     TRANSACTION_FEE_RATE = 0.015  # 1.5%
     MIN_TRANSACTION_AMOUNT = 1.0
     MAX_TRANSACTION_AMOUNT = 10000.0
+    FEE_SCHEDULE_PATH = os.environ.get('FEE_SCHEDULE_PATH')  # JSON fee rules, see utils/fees.py
+    FEE_REFRESH_SECONDS = int(os.environ.get('FEE_REFRESH_SECONDS', 60))  # how often workers check it for changes
+    QUOTE_MAX_ITEMS = 500
+    
+    # Exchange rates (see utils/fx.py)
+    FX_PIVOT_CURRENCY = os.environ.get('FX_PIVOT_CURRENCY', 'USD')  # fx_rates are quoted against it
+    FX_REFRESH_SECONDS = int(os.environ.get('FX_REFRESH_SECONDS', 60))
+    FX_REPORTING_CURRENCY = os.environ.get('FX_REPORTING_CURRENCY', 'KSh')  # admin stats totals
+    
+    # Response compression
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 1024  # bytes; smaller buffered responses are sent as-is
+    COMPRESS_LEVEL = 6  # gzip
+    COMPRESS_BR_QUALITY = 4  # brotli
+    
+    # On-demand request profiling (admins send PROFILE_HEADER)
+    PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', 'true').lower() == 'true'
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    PROFILE_MAX_ENTRIES = int(os.environ.get('PROFILE_MAX_ENTRIES', 50))
+    PROFILE_MAX_SQL = 500  # statements recorded per profile
+    
+    # Scheduled transfers (see utils/scheduled_transfers.py)
+    SCHEDULED_TRANSFER_BATCH_SIZE = int(os.environ.get('SCHEDULED_TRANSFER_BATCH_SIZE', 100))
+    SCHEDULED_TRANSFER_SPREAD_SECONDS = int(os.environ.get('SCHEDULED_TRANSFER_SPREAD_SECONDS', 1800))
+    SCHEDULED_TRANSFER_CATCH_UP_HOURS = int(os.environ.get('SCHEDULED_TRANSFER_CATCH_UP_HOURS', 72))
+    SCHEDULED_TRANSFER_RETRY_SECONDS = 300
+    SCHEDULED_TRANSFER_POLL_SECONDS = int(os.environ.get('SCHEDULED_TRANSFER_POLL_SECONDS', 30))
+    
+    # Background purge of deleted users (see utils/user_deletion.py)
+    USER_PURGE_CHUNK_SIZE = int(os.environ.get('USER_PURGE_CHUNK_SIZE', 500))
+    USER_PURGE_CHUNK_PAUSE_SECONDS = float(os.environ.get('USER_PURGE_CHUNK_PAUSE_SECONDS', 0.05))
+    USER_PURGE_LEASE_SECONDS = 300
+    USER_PURGE_POLL_SECONDS = int(os.environ.get('USER_PURGE_POLL_SECONDS', 30))
+    
+    # Per-worker cache of each user's newest transactions (see utils/recent_history.py)
+    RECENT_HISTORY_SIZE = int(os.environ.get('RECENT_HISTORY_SIZE', 50))  # entries per user; 0 disables
+    RECENT_HISTORY_USERS = int(os.environ.get('RECENT_HISTORY_USERS', 1000))
+    RECENT_HISTORY_TTL_SECONDS = int(os.environ.get('RECENT_HISTORY_TTL_SECONDS', 300))
+    
+    # Frequent-counterparty suggestions
+    COUNTERPARTY_HALF_LIFE_DAYS = 30
     
     # Pagination
     ITEMS_PER_PAGE = 20
+    
+    # Bulk wallet adjustments
+    ADJUST_BATCH_MAX_ITEMS = 50000
+    ADJUST_BATCH_CHUNK_SIZE = 500
+    
+    # Bulk user import
+    IMPORT_CHUNK_SIZE = 500
+    IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', 0)) or None  # default: CPU count
+    
+    # Read replicas (comma-separated URLs, bound as replica_0, replica_1, ...)
+    SQLALCHEMY_BINDS = {
+        f'replica_{i}': url.strip()
+        for i, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(','))
+        if url.strip()
+    }
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    REPLICA_HEALTH_CHECK_INTERVAL = int(os.environ.get('REPLICA_HEALTH_CHECK_INTERVAL', 10))
+    
+    # Transaction archive (cold storage)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    ARCHIVE_INDEX_CACHE_SIZE = 24  # member indexes of monthly segments kept in memory per worker
+    
+    # Cached monthly statements
+    STATEMENT_CACHE_DIR = os.environ.get('STATEMENT_CACHE_DIR', 'statements')
+    
+    # Wallet reconciliation state (expected balances + watermark)
+    RECONCILE_STATE_PATH = os.environ.get('RECONCILE_STATE_PATH', 'reconcile_state.npz')
+    RECONCILE_COMMIT_LAG_SECONDS = 300  # rows this recent are read again by the next run
+    
+    # Schema migrations (see migrations/); otherwise run `flask db-upgrade`
+    MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', 'false').lower() == 'true'
+    
+    # Handlers over their @query_budget raise instead of logging a warning (see utils/query_budget.py)
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE', 'false').lower() == 'true'
+    
+    # Query plan snapshot checked by `flask plan-snapshot`
+    QUERY_PLAN_SNAPSHOT_PATH = os.environ.get(
+        'QUERY_PLAN_SNAPSHOT_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', 'query_plans.json')
+    )
 
 
 class DevelopmentConfig(Config):
@@ -33,6 +123,7 @@ class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///money_transfer.db')
     SQLALCHEMY_ECHO = True
+    MIGRATE_ON_STARTUP = True
 
 
 class ProductionConfig(Config):
@@ -52,6 +143,8 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test_money_transfer.db'
     WTF_CSRF_ENABLED = False
+    MIGRATE_ON_STARTUP = True
+    QUERY_BUDGET_ENFORCE = True
 
 
 config = {
@@ -0,0 +1,76 @@
+"""
+Gunicorn production profile
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is imported and built once in the master (`preload_app`) and
+shared copy-on-write with the workers; each worker then drops the
+database connections and routing state it inherited, so no socket is
+ever shared between processes.
+
+Environment:
+    GUNICORN_WORKER_CLASS   sync (default), gthread or gevent
+    GUNICORN_WORKERS        Worker processes (default: 2 * CPUs + 1, CPUs for gevent)
+    GUNICORN_THREADS        Threads per gthread worker (default: 4)
+    GUNICORN_CONNECTIONS    Concurrent greenlets per gevent worker (default: 1000)
+    GUNICORN_PRELOAD        Build the app in the master (default: true)
+    GUNICORN_MAX_REQUESTS   Recycle a worker after this many requests (default: 1000, 0 = never)
+    GUNICORN_MAX_REQUESTS_JITTER  Random spread on max_requests (default: 10%)
+    GUNICORN_TIMEOUT        Worker timeout in seconds (default: 30)
+    PORT                    Port to bind (default: 5000)
+"""
+import gc
+import multiprocessing
+import os
+
+WORKER_CLASSES = {'sync': 'sync', 'gthread': 'gthread', 'gevent': 'gevent'}
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync').lower()
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}")
+worker_class = WORKER_CLASSES[worker_class]
+
+_cpus = multiprocessing.cpu_count()
+workers = int(os.environ.get('GUNICORN_WORKERS', _cpus if worker_class == 'gevent' else 2 * _cpus + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 1000))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+
+# Recycle workers to bound slow leaks; jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    """Move everything the master built into the permanent GC generation"""
+    # Collection would otherwise touch (and copy) every shared object in each worker
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Log once the worker has loaded the app (scripts/measure_workers.py waits for this)"""
+    worker.log.info('Worker ready (pid: %s)', worker.pid)
+
+
+def post_fork(server, worker):
+    """Give each worker its own connections"""
+    from __init__ import db
+    from utils.db_routing import reset_after_fork
+
+    reset_after_fork()
+    if preload_app:
+        app = server.app.wsgi()
+        with app.app_context():
+            # close=False leaves the parent's sockets alone
+            for engine in db.engines.values():
+                engine.dispose(close=False)
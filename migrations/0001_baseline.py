@@ -0,0 +1,12 @@
+"""
+Baseline schema: users, wallets, transactions and beneficiaries
+
+Databases created before migrations existed already have these tables.
+"""
+
+
+def upgrade(op):
+    from models import User, Wallet, Transaction, Beneficiary
+
+    for model in (User, Wallet, Transaction, Beneficiary):
+        op.create_table(model.__table__)
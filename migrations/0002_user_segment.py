@@ -0,0 +1,8 @@
+"""
+Customer segment on users, used for fee pricing
+"""
+from sqlalchemy import Column, String
+
+
+def upgrade(op):
+    op.add_column('users', Column('segment', String(50), server_default='standard'))
@@ -0,0 +1,39 @@
+"""
+Normalized name/phone keys and per-user lookup indexes on beneficiaries
+"""
+import re
+
+from sqlalchemy import Column, String
+
+ONLINE = True
+BATCH_SIZE = 1000
+
+
+def upgrade(op):
+    op.add_column('beneficiaries', Column('name_key', String(200)))
+    op.add_column('beneficiaries', Column('phone_key', String(20)))
+
+    # Backfill the keys the model computes on write
+    last_id = 0
+    while True:
+        rows = op.execute(
+            'SELECT id, name, phone FROM beneficiaries WHERE id > :last_id AND name_key IS NULL '
+            'ORDER BY id LIMIT :limit',
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        for id_, name, phone in rows:
+            op.execute(
+                'UPDATE beneficiaries SET name_key = :name_key, phone_key = :phone_key WHERE id = :id',
+                {
+                    'id': id_,
+                    'name_key': (name or '').strip().lower(),
+                    'phone_key': re.sub(r'\D', '', phone) if phone else None
+                }
+            )
+        last_id = rows[-1][0]
+
+    op.create_index('ix_beneficiaries_user_name_key', 'beneficiaries', ['user_id', 'name_key'])
+    op.create_index('ix_beneficiaries_user_email', 'beneficiaries', ['user_id', 'email'])
+    op.create_index('ix_beneficiaries_user_phone_key', 'beneficiaries', ['user_id', 'phone_key'])
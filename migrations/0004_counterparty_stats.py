@@ -0,0 +1,11 @@
+"""
+Frequent-counterparty statistics
+
+Run `flask backfill-counterparties` afterwards to build them from history.
+"""
+
+
+def upgrade(op):
+    from models import CounterpartyStat
+
+    op.create_table(CounterpartyStat.__table__)
@@ -0,0 +1,14 @@
+"""
+Indexes for transaction history and admin transaction search
+"""
+
+ONLINE = True
+
+
+def upgrade(op):
+    op.create_index('ix_transactions_created_at_id', 'transactions', ['created_at', 'id'])
+    op.create_index('ix_transactions_sender_created', 'transactions', ['sender_id', 'created_at', 'id'])
+    op.create_index('ix_transactions_receiver_created', 'transactions', ['receiver_id', 'created_at', 'id'])
+    op.create_index('ix_transactions_type_created', 'transactions', ['type', 'created_at', 'id'])
+    op.create_index('ix_transactions_status_created', 'transactions', ['status', 'created_at', 'id'])
+    op.create_index('ix_transactions_amount', 'transactions', ['amount'])
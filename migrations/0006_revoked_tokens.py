@@ -0,0 +1,9 @@
+"""
+Revoked JWTs for refresh/logout/revoke-all
+"""
+
+
+def upgrade(op):
+    from models import RevokedToken
+
+    op.create_table(RevokedToken.__table__)
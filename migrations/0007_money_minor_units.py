@@ -0,0 +1,24 @@
+"""
+Store money as integer minor units instead of floats
+
+Every existing wallet and transaction is in KSh (exponent 2), so values are
+multiplied by 100 and rounded. Missing balances and fees become 0.
+"""
+from sqlalchemy import BigInteger
+
+
+def _minor(op, column):
+    if op.dialect == 'postgresql':
+        # round() on double precision rounds ties to even; numeric rounds them away from zero
+        return f'ROUND(CAST(COALESCE({column}, 0) AS NUMERIC) * 100)'
+    return f'ROUND(COALESCE({column}, 0) * 100)'
+
+
+def upgrade(op):
+    op.alter_column_types('wallets', {
+        'balance': (BigInteger(), _minor(op, 'balance'))
+    }, nullable=False)
+    op.alter_column_types('transactions', {
+        column: (BigInteger(), _minor(op, column))
+        for column in ('amount', 'fee', 'total_amount')
+    }, nullable=False)
@@ -0,0 +1,9 @@
+"""
+Scheduled and recurring transfers
+"""
+
+
+def upgrade(op):
+    from models import ScheduledTransfer
+
+    op.create_table(ScheduledTransfer.__table__)
@@ -0,0 +1,29 @@
+"""
+Exchange rates, and the currency of each transaction and schedule
+
+Existing rows are backfilled with their sending wallet's currency; before
+this migration every transfer moved the same units on both sides.
+"""
+from sqlalchemy import BigInteger, Column, String
+
+
+def upgrade(op):
+    from models import FxRate
+
+    op.create_table(FxRate.__table__)
+
+    op.add_column('transactions', Column('currency', String(10), nullable=False, server_default='KSh'))
+    op.add_column('transactions', Column('receiver_amount', BigInteger))
+    op.add_column('transactions', Column('receiver_currency', String(10)))
+    op.add_column('transactions', Column('fx_rate', BigInteger))
+    op.add_column('scheduled_transfers', Column('currency', String(10), nullable=False, server_default='KSh'))
+
+    op.execute(
+        "UPDATE transactions SET currency = COALESCE("
+        "(SELECT w.currency FROM wallets w WHERE w.user_id = COALESCE(transactions.sender_id, transactions.receiver_id)), "
+        "'KSh')"
+    )
+    op.execute(
+        "UPDATE scheduled_transfers SET currency = COALESCE("
+        "(SELECT w.currency FROM wallets w WHERE w.user_id = scheduled_transfers.user_id), 'KSh')"
+    )
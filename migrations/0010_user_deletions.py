@@ -0,0 +1,11 @@
+"""
+User tombstones, and progress of the background purge of deleted users
+"""
+from sqlalchemy import Column, DateTime
+
+
+def upgrade(op):
+    from models import UserDeletion
+
+    op.add_column('users', Column('deleted_at', DateTime))
+    op.create_table(UserDeletion.__table__)
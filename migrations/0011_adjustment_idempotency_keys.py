@@ -0,0 +1,11 @@
+"""
+Idempotency keys of admin wallet adjustments
+"""
+from sqlalchemy import Column, String
+
+ONLINE = True
+
+
+def upgrade(op):
+    op.add_column('transactions', Column('idempotency_key', String(100)))
+    op.create_index('ix_transactions_idempotency_key', 'transactions', ['idempotency_key'], unique=True)
@@ -0,0 +1,9 @@
+"""
+Index for the revocation sync, which reads rows by revoked_at
+"""
+
+ONLINE = True
+
+
+def upgrade(op):
+    op.create_index('ix_revoked_tokens_revoked_at', 'revoked_tokens', ['revoked_at'])
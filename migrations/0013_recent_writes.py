@@ -0,0 +1,9 @@
+"""
+Read-your-writes markers shared by every worker
+"""
+
+
+def upgrade(op):
+    from models import RecentWrite
+
+    op.create_table(RecentWrite.__table__)
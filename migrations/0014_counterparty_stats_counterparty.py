@@ -0,0 +1,9 @@
+"""
+Index for purging other users' counterparty stats of a deleted user
+"""
+
+ONLINE = True
+
+
+def upgrade(op):
+    op.create_index('ix_counterparty_stats_counterparty', 'counterparty_stats', ['counterparty_id'])
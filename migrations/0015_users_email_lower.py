@@ -0,0 +1,11 @@
+"""
+Case-insensitive email lookups (login, registration, transfers by email and
+beneficiary resolution compare lower(email))
+"""
+from sqlalchemy import func
+
+ONLINE = True
+
+
+def upgrade(op):
+    op.create_index('ix_users_email_lower', 'users', [lambda t: func.lower(t.c.email)])
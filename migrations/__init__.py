@@ -0,0 +1,3 @@
+"""
+Versioned schema migrations, applied in order by utils.migrations
+"""
@@ -2,5 +2,11 @@ from models.user import User
 from models.wallet import Wallet
 from models.transaction import Transaction
 from models.beneficiary import Beneficiary
+from models.counterparty_stat import CounterpartyStat
+from models.revoked_token import RevokedToken
+from models.scheduled_transfer import ScheduledTransfer
+from models.fx_rate import FxRate
+from models.user_deletion import UserDeletion
+from models.recent_write import RecentWrite
 
-__all__ = ['User', 'Wallet', 'Transaction', 'Beneficiary']
\ No newline at end of file
+__all__ = ['User', 'Wallet', 'Transaction', 'Beneficiary', 'CounterpartyStat', 'RevokedToken', 'ScheduledTransfer', 'FxRate', 'UserDeletion', 'RecentWrite']
\ No newline at end of file
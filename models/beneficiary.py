@@ -1,7 +1,10 @@
 from __init__ import db
+from models.serializer import SerializableMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
+import re
 
-class Beneficiary(db.Model):
+class Beneficiary(SerializableMixin, db.Model):
     __tablename__ = 'beneficiaries'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -12,13 +15,32 @@ class Beneficiary(db.Model):
     relationship = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'name': self.name,
-            'email': self.email,
-            'phone': self.phone,
-            'relationship': self.relationship,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+    # Normalized search keys, kept in sync with name/phone
+    name_key = db.Column(db.String(200))
+    phone_key = db.Column(db.String(20))
+    
+    __table_args__ = (
+        db.Index('ix_beneficiaries_user_name_key', 'user_id', 'name_key'),
+        db.Index('ix_beneficiaries_user_email', 'user_id', 'email'),
+        db.Index('ix_beneficiaries_user_phone_key', 'user_id', 'phone_key'),
+    )
+    
+    @validates('name')
+    def _set_name_key(self, key, value):
+        self.name_key = (value or '').strip().lower()
+        return value
+    
+    @validates('phone')
+    def _set_phone_key(self, key, value):
+        self.phone_key = re.sub(r'\D', '', value) if value else None
+        return value
+    
+    serializers = {
+        'id': lambda o: o.id,
+        'user_id': lambda o: o.user_id,
+        'name': lambda o: o.name,
+        'email': lambda o: o.email,
+        'phone': lambda o: o.phone,
+        'relationship': lambda o: o.relationship,
+        'created_at': lambda o: o.created_at.isoformat() if o.created_at else None
+    }
\ No newline at end of file
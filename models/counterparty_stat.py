@@ -0,0 +1,19 @@
+from __init__ import db
+from datetime import datetime
+
+class CounterpartyStat(db.Model):
+    __tablename__ = 'counterparty_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    counterparty_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    transfer_count = db.Column(db.Integer, nullable=False, default=0)
+    # Forward-decayed frequency: sum of 2 ** (age_since_epoch / half_life) per
+    # transfer, so rows stay comparable without rewriting them as time passes
+    frequency_score = db.Column(db.Float, nullable=False, default=0.0)
+    last_sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_counterparty_stats_user_frequency', 'user_id', 'frequency_score'),
+        db.Index('ix_counterparty_stats_user_recency', 'user_id', 'last_sent_at'),
+        db.Index('ix_counterparty_stats_counterparty', 'counterparty_id'),  # purge of a deleted user
+    )
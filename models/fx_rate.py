@@ -0,0 +1,10 @@
+from __init__ import db
+from datetime import datetime
+
+class FxRate(db.Model):
+    __tablename__ = 'fx_rates'
+    
+    currency = db.Column(db.String(10), primary_key=True)
+    # Amount of `currency` worth one FX_PIVOT_CURRENCY, scaled by utils.money.RATE_SCALE
+    rate = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
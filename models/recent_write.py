@@ -0,0 +1,10 @@
+from __init__ import db
+
+class RecentWrite(db.Model):
+    __tablename__ = 'recent_writes'
+    
+    # Last commit that changed a user's data, so every worker can keep their
+    # reads on the primary for REPLICA_STICKY_SECONDS (see utils.db_routing).
+    # No foreign key: it is only a routing hint and is written on every commit.
+    user_id = db.Column(db.Integer, primary_key=True)
+    written_at = db.Column(db.DateTime, nullable=False)
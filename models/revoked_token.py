@@ -0,0 +1,18 @@
+from __init__ import db
+from datetime import datetime
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # A row without a jti revokes every token of user_id issued before revoked_at
+    jti = db.Column(db.String(36), unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    token_type = db.Column(db.String(10))  # 'access', 'refresh' or None for all
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)  # row can be purged after this
+    
+    __table_args__ = (
+        db.Index('ix_revoked_tokens_expires_at', 'expires_at'),
+        db.Index('ix_revoked_tokens_revoked_at', 'revoked_at'),
+    )
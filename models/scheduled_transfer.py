@@ -0,0 +1,63 @@
+from __init__ import db
+from models.serializer import SerializableMixin
+from utils.money import from_minor
+from datetime import datetime
+
+class ScheduledTransfer(SerializableMixin, db.Model):
+    __tablename__ = 'scheduled_transfers'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    beneficiary_id = db.Column(db.Integer, db.ForeignKey('beneficiaries.id'), nullable=False)
+    amount = db.Column(db.BigInteger, nullable=False)  # minor units, see utils.money
+    currency = db.Column(db.String(10), nullable=False, default='KSh')  # sender's wallet currency
+    note = db.Column(db.Text)
+    frequency = db.Column(db.String(10), nullable=False, default='once')  # once, daily, weekly, monthly
+    start_at = db.Column(db.DateTime, nullable=False)  # first occurrence; later ones count from it
+    end_at = db.Column(db.DateTime)
+    occurrence = db.Column(db.Integer, nullable=False, default=0)  # index of next_run_at from start_at
+    next_run_at = db.Column(db.DateTime)  # when the next occurrence is scheduled
+    due_at = db.Column(db.DateTime)  # next_run_at plus this schedule's spread offset
+    status = db.Column(db.String(20), nullable=False, default='active')  # active, completed, cancelled
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+    failure_count = db.Column(db.Integer, nullable=False, default=0)
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)
+    last_run_at = db.Column(db.DateTime)
+    last_status = db.Column(db.String(20))  # completed, failed or skipped
+    last_error = db.Column(db.String(255))
+    last_transaction_id = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    beneficiary = db.relationship('Beneficiary', backref=db.backref(
+        'scheduled_transfers', lazy='dynamic', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.Index('ix_scheduled_transfers_status_due', 'status', 'due_at'),
+        db.Index('ix_scheduled_transfers_user_created', 'user_id', 'created_at'),
+        db.Index('ix_scheduled_transfers_beneficiary', 'beneficiary_id'),
+    )
+
+    field_dependencies = {'amount': ('currency',)}
+
+    serializers = {
+        'id': lambda o: o.id,
+        'user_id': lambda o: o.user_id,
+        'beneficiary_id': lambda o: o.beneficiary_id,
+        'amount': lambda o: from_minor(o.amount, o.currency),
+        'currency': lambda o: o.currency,
+        'note': lambda o: o.note,
+        'frequency': lambda o: o.frequency,
+        'start_at': lambda o: o.start_at.isoformat() if o.start_at else None,
+        'end_at': lambda o: o.end_at.isoformat() if o.end_at else None,
+        'next_run_at': lambda o: o.next_run_at.isoformat() if o.next_run_at else None,
+        'status': lambda o: o.status,
+        'run_count': lambda o: o.run_count,
+        'failure_count': lambda o: o.failure_count,
+        'skipped_count': lambda o: o.skipped_count,
+        'last_run_at': lambda o: o.last_run_at.isoformat() if o.last_run_at else None,
+        'last_status': lambda o: o.last_status,
+        'last_error': lambda o: o.last_error,
+        'last_transaction_id': lambda o: o.last_transaction_id,
+        'created_at': lambda o: o.created_at.isoformat() if o.created_at else None
+    }
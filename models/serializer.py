@@ -0,0 +1,24 @@
+class SerializableMixin:
+    """
+    to_dict() built from a table of per-field serializers, so callers can
+    ask for a subset of fields (and only load the columns behind them)
+    """
+    serializers = {}
+    # Other columns a field's serializer reads, e.g. {'balance': ('currency',)}
+    field_dependencies = {}
+    
+    def to_dict(self, fields=None):
+        return {
+            name: serialize(self)
+            for name, serialize in self.serializers.items()
+            if fields is None or name in fields
+        }
+    
+    @classmethod
+    def columns_for(cls, fields):
+        """Mapped columns needed to serialize the given fields"""
+        columns = cls.__table__.columns
+        names = set(fields)
+        for name in fields:
+            names.update(cls.field_dependencies.get(name, ()))
+        return [getattr(cls, name) for name in sorted(names) if name in columns]
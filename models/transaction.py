@@ -1,32 +1,68 @@
 from __init__ import db
+from models.serializer import SerializableMixin
+from utils.money import from_minor, RATE_SCALE
 from datetime import datetime
 
-class Transaction(db.Model):
+class Transaction(SerializableMixin, db.Model):
     __tablename__ = 'transactions'
     
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(50), unique=True, nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    fee = db.Column(db.Float, default=0.0)
-    total_amount = db.Column(db.Float, nullable=False)
+    # Money columns hold integer minor units, see utils.money
+    amount = db.Column(db.BigInteger, nullable=False)
+    fee = db.Column(db.BigInteger, nullable=False, default=0)
+    total_amount = db.Column(db.BigInteger, nullable=False)
+    currency = db.Column(db.String(10), nullable=False, default='KSh')  # of amount, fee and total_amount
+    # Cross-currency transfers: what the receiver was credited, and the rate
+    # (scaled by utils.money.RATE_SCALE); NULL when both wallets share a currency
+    receiver_amount = db.Column(db.BigInteger)
+    receiver_currency = db.Column(db.String(10))
+    fx_rate = db.Column(db.BigInteger)
     type = db.Column(db.String(50))
     status = db.Column(db.String(20), default='completed')
     note = db.Column(db.Text)
+    # Client key of an admin adjustment, so a retried batch is not applied twice
+    idempotency_key = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'transaction_id': self.transaction_id,
-            'sender_id': self.sender_id,
-            'receiver_id': self.receiver_id,
-            'amount': round(self.amount, 2),
-            'fee': round(self.fee, 2),
-            'total_amount': round(self.total_amount, 2),
-            'type': self.type,
-            'status': self.status,
-            'note': self.note,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+    # Each search filter leads an index that also serves the (created_at, id) keyset order
+    __table_args__ = (
+        db.Index('ix_transactions_created_at_id', 'created_at', 'id'),
+        db.Index('ix_transactions_sender_created', 'sender_id', 'created_at', 'id'),
+        db.Index('ix_transactions_receiver_created', 'receiver_id', 'created_at', 'id'),
+        db.Index('ix_transactions_type_created', 'type', 'created_at', 'id'),
+        db.Index('ix_transactions_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_transactions_amount', 'amount'),
+        db.Index('ix_transactions_idempotency_key', 'idempotency_key', unique=True),
+    )
+    
+    field_dependencies = {
+        'amount': ('currency',),
+        'fee': ('currency',),
+        'total_amount': ('currency',),
+        'receiver_amount': ('amount', 'currency', 'receiver_currency'),
+        'receiver_currency': ('currency',)
+    }
+    
+    serializers = {
+        'id': lambda o: o.id,
+        'transaction_id': lambda o: o.transaction_id,
+        'sender_id': lambda o: o.sender_id,
+        'receiver_id': lambda o: o.receiver_id,
+        'amount': lambda o: from_minor(o.amount, o.currency),
+        'fee': lambda o: from_minor(o.fee, o.currency),
+        'total_amount': lambda o: from_minor(o.total_amount, o.currency),
+        'currency': lambda o: o.currency,
+        'receiver_amount': lambda o: (
+            from_minor(o.receiver_amount, o.receiver_currency) if o.receiver_amount is not None
+            else from_minor(o.amount, o.currency)
+        ),
+        'receiver_currency': lambda o: o.receiver_currency or o.currency,
+        'fx_rate': lambda o: None if o.fx_rate is None else o.fx_rate / RATE_SCALE,
+        'type': lambda o: o.type,
+        'status': lambda o: o.status,
+        'note': lambda o: o.note,
+        'created_at': lambda o: o.created_at.isoformat() if o.created_at else None
+    }
\ No newline at end of file
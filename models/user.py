@@ -1,7 +1,8 @@
 from __init__ import db, bcrypt
+from models.serializer import SerializableMixin
 from datetime import datetime
 
-class User(db.Model):
+class User(SerializableMixin, db.Model):
     __tablename__ = 'users'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -13,14 +14,23 @@ class User(db.Model):
     country = db.Column(db.String(100), default='Kenya')
     role = db.Column(db.String(20), default='user')  # 'user' or 'admin'
     status = db.Column(db.String(20), default='active')  # 'active' or 'inactive'
+    segment = db.Column(db.String(50), default='standard')  # customer segment for fee pricing
+    deleted_at = db.Column(db.DateTime)  # tombstone: set when deleted, PII purged in the background
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Emails are matched case-insensitively; rows from before they were
+    # lowercased on write may still be mixed-case
+    __table_args__ = (
+        db.Index('ix_users_email_lower', db.func.lower(email)),
+    )
+    
     # Relationships
     wallet = db.relationship('Wallet', backref='user', uselist=False, cascade='all, delete-orphan')
     sent_transactions = db.relationship('Transaction', foreign_keys='Transaction.sender_id', backref='sender', lazy='dynamic')
     received_transactions = db.relationship('Transaction', foreign_keys='Transaction.receiver_id', backref='receiver', lazy='dynamic')
     beneficiaries = db.relationship('Beneficiary', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    scheduled_transfers = db.relationship('ScheduledTransfer', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
         self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
@@ -28,16 +38,17 @@ class User(db.Model):
     def check_password(self, password):
         return bcrypt.check_password_hash(self.password_hash, password)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'email': self.email,
-            'phone': self.phone,
-            'country': self.country,
-            'role': self.role,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+    serializers = {
+        'id': lambda o: o.id,
+        'first_name': lambda o: o.first_name,
+        'last_name': lambda o: o.last_name,
+        'email': lambda o: o.email,
+        'phone': lambda o: o.phone,
+        'country': lambda o: o.country,
+        'role': lambda o: o.role,
+        'status': lambda o: o.status,
+        'segment': lambda o: o.segment,
+        'created_at': lambda o: o.created_at.isoformat() if o.created_at else None,
+        'updated_at': lambda o: o.updated_at.isoformat() if o.updated_at else None,
+        'deleted_at': lambda o: o.deleted_at.isoformat() if o.deleted_at else None
+    }
\ No newline at end of file
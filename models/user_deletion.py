@@ -0,0 +1,41 @@
+from __init__ import db
+from models.serializer import SerializableMixin
+from datetime import datetime
+
+class UserDeletion(SerializableMixin, db.Model):
+    __tablename__ = 'user_deletions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    stage = db.Column(db.String(50))  # purge stage in progress, see utils.user_deletion.STAGES
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    # Keyset position of stages that walk the user's transactions
+    cursor_at = db.Column(db.DateTime)
+    cursor_id = db.Column(db.Integer)
+    last_error = db.Column(db.String(255))
+    requested_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # heartbeat of the purge
+
+    __table_args__ = (
+        db.Index('ix_user_deletions_status_updated', 'status', 'updated_at'),
+    )
+
+    serializers = {
+        'id': lambda o: o.id,
+        'user_id': lambda o: o.user_id,
+        'requested_by': lambda o: o.requested_by,
+        'status': lambda o: o.status,
+        'stage': lambda o: o.stage,
+        'rows_processed': lambda o: o.rows_processed,
+        'chunks': lambda o: o.chunks,
+        'last_error': lambda o: o.last_error,
+        'requested_at': lambda o: o.requested_at.isoformat() if o.requested_at else None,
+        'started_at': lambda o: o.started_at.isoformat() if o.started_at else None,
+        'completed_at': lambda o: o.completed_at.isoformat() if o.completed_at else None,
+        'updated_at': lambda o: o.updated_at.isoformat() if o.updated_at else None
+    }
@@ -1,26 +1,29 @@
 from __init__ import db
+from models.serializer import SerializableMixin
+from utils.money import from_minor
 from datetime import datetime
 
-class Wallet(db.Model):
+class Wallet(SerializableMixin, db.Model):
     __tablename__ = 'wallets'
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
     wallet_id = db.Column(db.String(50), unique=True, nullable=False)
-    balance = db.Column(db.Float, default=0.0)
+    balance = db.Column(db.BigInteger, nullable=False, default=0)  # minor units, see utils.money
     currency = db.Column(db.String(10), default='KSh')
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'wallet_id': self.wallet_id,
-            'balance': round(self.balance, 2),
-            'currency': self.currency,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+    field_dependencies = {'balance': ('currency',)}
+    
+    serializers = {
+        'id': lambda o: o.id,
+        'user_id': lambda o: o.user_id,
+        'wallet_id': lambda o: o.wallet_id,
+        'balance': lambda o: from_minor(o.balance, o.currency),
+        'currency': lambda o: o.currency,
+        'status': lambda o: o.status,
+        'created_at': lambda o: o.created_at.isoformat() if o.created_at else None,
+        'updated_at': lambda o: o.updated_at.isoformat() if o.updated_at else None
+    }
\ No newline at end of file
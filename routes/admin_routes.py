@@ -1,111 +1,292 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, send_file, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
 from __init__ import db
-from models import User, Wallet, Transaction
-from utils.decorators import admin_required
+from models import User, UserDeletion, Wallet, Transaction
+from utils.decorators import admin_required, read_only
+from utils.fields import parse_fields, sparse
+from utils.fees import reload_fee_engine
+from utils.fx import get_fx_snapshot, reload_fx_snapshot, set_fx_rates
+from utils.money import from_minor
+from utils.user_import import INSERT_PAGE_ROWS, import_users
+from utils.adjustments import apply_adjustments
+from utils.archive import get_archived_totals
+from utils.revocation import revoke_all_tokens
+from utils.recent_history import forget_user, get_recent_history
+from utils.user_deletion import delete_user
+from utils.profiling import list_profiles, load_profile, profile_path
+from utils.transaction_search import parse_search_args, build_search_query, search_transactions
+from utils.export import parse_export_args, export_response, iter_transaction_rows, render_rows, encode_chunks
+from utils.validation import Schema, Field, validate_json, setting
+from utils.query_budget import query_budget
+from collections import Counter
 from datetime import datetime
+import json
+import os
 
 bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
+UPDATE_USER_SCHEMA = Schema({
+    'status': Field('str', choices=('active', 'inactive')),
+    'role': Field('str', choices=('user', 'admin')),
+})
+
+ADJUST_SCHEMA = Schema({
+    'action': Field('str', required=True, choices=('add', 'deduct')),
+    'amount': Field('amount', required=True, max=setting('MAX_TRANSACTION_AMOUNT')),
+    'note': Field('str', max_length=500),
+    'idempotency_key': Field('str', min_length=1, max_length=100),
+})
+
+# Items are checked one by one in apply_adjustments, so each gets its own outcome
+ADJUST_BATCH_SCHEMA = Schema({
+    'items': Field('list', required=True, min_length=1),
+    'idempotency_key': Field('str', min_length=1, max_length=64),
+})
+
+FX_RATES_SCHEMA = Schema({
+    'rates': Field('dict', required=True, min_length=1, keys=Field('str', min_length=1, max_length=10),
+                   values=Field('amount')),
+})
+
+
+def _adjust_batch_budget():
+    """
+    Query budget of a batch adjustment
+
+    Each committed chunk looks up its idempotency keys and prices its
+    wallets in a statement each, then runs one round per repeat of its most
+    repeated wallet, each round an UPDATE, a lookup of the wallets it missed
+    and the INSERT of its transactions.
+    """
+    items = g.get('body', {}).get('items', ())
+    chunk_size = current_app.config.get('ADJUST_BATCH_CHUNK_SIZE', 500)
+    budget = 0
+    for start in range(0, len(items), chunk_size):
+        repeats = Counter(item.get('wallet_id') if isinstance(item, dict) else None
+                          for item in items[start:start + chunk_size])
+        budget += 2 + 3 * max(repeats.values())
+    return budget
+
+
 @bp.route('/users', methods=['GET'])
 @admin_required
+@query_budget(1)
+@read_only
 def admin_get_users():
     try:
-        users = User.query.all()
+        fields = parse_fields(User)
+        users = sparse(User.query, User, fields).filter(User.deleted_at.is_(None)).all()
         return jsonify({
-            'users': [u.to_dict() for u in users],
+            'users': [u.to_dict(fields) for u in users],
             'count': len(users)
         }), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _import_stream_budget():
+    # Per chunk: the existing-email check, then the user and wallet inserts,
+    # each sent in pages of up to INSERT_PAGE_ROWS rows
+    pages = -(-current_app.config.get('IMPORT_CHUNK_SIZE', 500) // INSERT_PAGE_ROWS)
+    return 1 + 2 * pages
+
+
+@bp.route('/users/import', methods=['POST'])
+@admin_required
+@query_budget(0, stream=_import_stream_budget)
+def admin_import_users():
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'A CSV or NDJSON file is required'}), 400
+    
+    fmt = request.args.get('format')
+    if not fmt:
+        filename = (upload.filename or '').lower()
+        fmt = 'ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    
+    events = import_users(
+        upload.stream,
+        fmt=fmt,
+        chunk_size=current_app.config.get('IMPORT_CHUNK_SIZE', 500),
+        workers=current_app.config.get('IMPORT_HASH_WORKERS'),
+        rounds=current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+    )
+    
+    # Progress and per-row errors are streamed as NDJSON while the import runs
+    return Response(
+        stream_with_context(json.dumps(event) + '\n' for event in events),
+        mimetype='application/x-ndjson'
+    )
+
+
 @bp.route('/users/<int:user_id>', methods=['GET', 'PUT', 'DELETE'])
 @admin_required
+@query_budget({'GET': 1, 'PUT': 3, 'DELETE': 5})
+@validate_json(UPDATE_USER_SCHEMA)
 def admin_user_detail(user_id):
     try:
-        user = User.query.get(user_id)
+        fields = parse_fields(User) if request.method == 'GET' else None
+        query = sparse(User.query, User, fields, required=('deleted_at',))
+        if request.method == 'GET':
+            query = query.options(joinedload(User.wallet))
+        user = query.get(user_id)
         
-        if not user:
+        if not user or user.deleted_at is not None:
             return jsonify({'error': 'User not found'}), 404
         
         if request.method == 'GET':
             return jsonify({
-                'user': user.to_dict(),
+                'user': user.to_dict(fields),
                 'wallet': user.wallet.to_dict() if user.wallet else None
             }), 200
         
         elif request.method == 'PUT':
-            data = request.get_json()
+            data = g.body
             
             if 'status' in data:
                 user.status = data['status']
+                if user.status != 'active':
+                    revoke_all_tokens(user.id)
             if 'role' in data:
                 user.role = data['role']
             
             user.updated_at = datetime.utcnow()
+            user_data = user.to_dict()  # before the commit expires it
             db.session.commit()
             
             return jsonify({
                 'message': 'User updated successfully',
-                'user': user.to_dict()
+                'user': user_data
             }), 200
         
         elif request.method == 'DELETE':
-            db.session.delete(user)
+            # Tombstoned now; dependent rows are purged in the background
+            deletion = delete_user(user, requested_by=get_jwt_identity())
+            db.session.flush()
+            deletion_data = deletion.to_dict()  # before the commit expires it
             db.session.commit()
+            forget_user(user_id)
             
-            return jsonify({'message': 'User deleted successfully'}), 200
+            return jsonify({
+                'message': 'User deleted successfully',
+                'deletion': deletion_data
+            }), 202
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/deletions', methods=['GET'])
+@admin_required
+@query_budget(1)
+@read_only
+def admin_get_deletions():
+    try:
+        status = request.args.get('status')
+        limit = min(int(request.args.get('limit', 50)), 500)
+        
+        query = UserDeletion.query
+        if status:
+            if status not in ('pending', 'running', 'completed', 'failed'):
+                return jsonify({'error': 'status must be pending, running, completed or failed'}), 400
+            query = query.filter(UserDeletion.status == status)
+        deletions = query.order_by(UserDeletion.id.desc()).limit(limit).all()
+        
+        return jsonify({
+            'deletions': [d.to_dict() for d in deletions],
+            'count': len(deletions)
+        }), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/wallets', methods=['GET'])
 @admin_required
+@query_budget(1)
+@read_only
 def admin_get_wallets():
     try:
-        wallets = Wallet.query.all()
+        fields = parse_fields(Wallet)
+        wallets = sparse(Wallet.query, Wallet, fields).all()
         return jsonify({
-            'wallets': [w.to_dict() for w in wallets],
+            'wallets': [w.to_dict(fields) for w in wallets],
             'count': len(wallets)
         }), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @bp.route('/wallets/<int:wallet_id>/adjust', methods=['POST'])
 @admin_required
+@query_budget(5)
+@validate_json(ADJUST_SCHEMA)
 def admin_adjust_wallet(wallet_id):
     try:
-        wallet = Wallet.query.get(wallet_id)
+        data = g.body
+        action = data['action']
         
-        if not wallet:
-            return jsonify({'error': 'Wallet not found'}), 404
+        result = apply_adjustments([{
+            'wallet_id': wallet_id,
+            'action': action,
+            'amount': data['amount'],
+            'note': data.get('note'),
+            'idempotency_key': data.get('idempotency_key')
+        }], get_jwt_identity())[0]
         
-        data = request.get_json()
-        action = data.get('action')  # 'add' or 'deduct'
-        amount = float(data.get('amount', 0))
+        if result['status'] != 'applied':
+            status_code = 404 if result['error'] == 'Wallet not found' else 400
+            return jsonify({'error': result['error']}), status_code
         
-        if amount <= 0:
-            return jsonify({'error': 'Invalid amount'}), 400
+        # Loaded once the adjustment is applied, which reports a missing wallet itself
+        wallet = Wallet.query.get(wallet_id)
         
-        if action == 'add':
-            wallet.balance += amount
-        elif action == 'deduct':
-            if wallet.balance < amount:
-                return jsonify({'error': 'Insufficient balance'}), 400
-            wallet.balance -= amount
-        else:
-            return jsonify({'error': 'Invalid action'}), 400
+        return jsonify({
+            'message': f'Wallet {action}ed successfully',
+            'wallet': wallet.to_dict(),
+            'transaction_id': result['transaction_id']
+        }), 200
         
-        wallet.updated_at = datetime.utcnow()
-        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/wallets/adjust/batch', methods=['POST'])
+@admin_required
+@query_budget(_adjust_batch_budget)
+@validate_json(ADJUST_BATCH_SCHEMA)
+def admin_adjust_wallets_batch():
+    try:
+        items = g.body['items']
+        max_items = current_app.config.get('ADJUST_BATCH_MAX_ITEMS', 50000)
+        if len(items) > max_items:
+            return jsonify({'error': f'At most {max_items} adjustments per batch'}), 400
+        
+        results = apply_adjustments(
+            items,
+            get_jwt_identity(),
+            chunk_size=current_app.config.get('ADJUST_BATCH_CHUNK_SIZE', 500),
+            idempotency_key=g.body.get('idempotency_key')
+        )
+        applied = sum(1 for r in results if r['status'] == 'applied')
         
         return jsonify({
-            'message': f'Wallet {action}ed successfully',
-            'wallet': wallet.to_dict()
+            'results': results,
+            'applied': applied,
+            'failed': len(results) - applied
         }), 200
         
     except Exception as e:
@@ -113,41 +294,175 @@ def admin_adjust_wallet(wallet_id):
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/fees/reload', methods=['POST'])
+@admin_required
+@query_budget(0)
+def admin_reload_fees():
+    try:
+        engine = reload_fee_engine()
+        return jsonify({
+            'message': 'Fee schedule reloaded',
+            'schedules': len(engine.tables)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/fx-rates', methods=['GET', 'PUT'])
+@admin_required
+@query_budget({'GET': 1, 'PUT': 4})
+@validate_json(FX_RATES_SCHEMA)
+def admin_fx_rates():
+    try:
+        if request.method == 'GET':
+            return jsonify(get_fx_snapshot().to_dict()), 200
+
+        # PUT - Set rates against the pivot currency
+        set_fx_rates(g.body['rates'])
+        db.session.commit()
+        snapshot = reload_fx_snapshot()
+
+        return jsonify({
+            'message': 'Exchange rates updated',
+            **snapshot.to_dict()
+        }), 200
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/transactions', methods=['GET'])
 @admin_required
+@query_budget(1)
+@read_only
 def admin_get_transactions():
     try:
-        limit = int(request.args.get('limit', 100))
+        filters = parse_search_args(request.args)
         offset = int(request.args.get('offset', 0))
+        fields = parse_fields(Transaction)
         
-        transactions = Transaction.query\
-            .order_by(Transaction.created_at.desc())\
-            .limit(limit).offset(offset).all()
+        query = sparse(Transaction.query, Transaction, fields, required=('id', 'created_at'))
+        if offset:
+            # Legacy offset paging; prefer the returned next_cursor
+            transactions = build_search_query(filters, query).limit(filters['limit']).offset(offset).all()
+            next_cursor = None
+        else:
+            transactions, next_cursor = search_transactions(filters, query)
         
         return jsonify({
-            'transactions': [t.to_dict() for t in transactions],
-            'count': len(transactions)
+            'transactions': [t.to_dict(fields) for t in transactions],
+            'count': len(transactions),
+            'next_cursor': next_cursor
         }), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/transactions/export', methods=['GET'])
+@admin_required
+@query_budget(0, stream=1)
+@read_only
+def admin_export_transactions():
+    try:
+        fmt, compress, start, end = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows = iter_transaction_rows(start=start, end=end)
+    return export_response(encode_chunks(render_rows(rows, fmt), compress), fmt, compress, 'transactions')
+
+
+@bp.route('/profiles', methods=['GET'])
+@admin_required
+@query_budget(0)
+def admin_get_profiles():
+    try:
+        profiles = list_profiles()
+        return jsonify({
+            'profiles': profiles,
+            'count': len(profiles)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/profiles/<profile_id>', methods=['GET'])
+@admin_required
+@query_budget(0)
+def admin_get_profile(profile_id):
+    try:
+        kind = request.args.get('format')
+        if kind:
+            # Download the pstats dump or the collapsed stacks
+            path = profile_path(profile_id, kind)
+            if not os.path.exists(path):
+                return jsonify({'error': 'Profile not found'}), 404
+            return send_file(path, as_attachment=True, download_name=os.path.basename(path),
+                             mimetype='application/octet-stream' if kind == 'pstats' else 'text/plain')
+        
+        profile = load_profile(profile_id)
+        if not profile:
+            return jsonify({'error': 'Profile not found'}), 404
+        return jsonify({'profile': profile}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @bp.route('/stats', methods=['GET'])
 @admin_required
+@query_budget(6)
+@read_only
 def admin_stats():
     try:
-        total_users = User.query.count()
+        total_users = User.query.filter(User.deleted_at.is_(None)).count()
         active_users = User.query.filter_by(status='active').count()
-        total_transactions = Transaction.query.count()
-        total_revenue = db.session.query(db.func.sum(Transaction.fee)).scalar() or 0
-        total_wallet_balance = db.session.query(db.func.sum(Wallet.balance)).scalar() or 0
+        # Archived transactions are counted from the archive index, without reading segments
+        archived = get_archived_totals()
+        total_transactions = Transaction.query.count() + sum(count for count, _ in archived.values())
+        fees = {currency: fee for currency, (_, fee) in archived.items()}
+        for currency, fee in db.session.query(Transaction.currency, db.func.sum(Transaction.fee)) \
+                .group_by(Transaction.currency):
+            fees[currency] = fees.get(currency, 0) + int(fee or 0)
+        revenue = list(fees.items())
+        balances = db.session.query(Wallet.currency, db.func.sum(Wallet.balance)) \
+            .group_by(Wallet.currency).all()
         
         return jsonify({
             'total_users': total_users,
             'active_users': active_users,
             'total_transactions': total_transactions,
-            'total_revenue': round(total_revenue, 2),
-            'total_wallet_balance': round(total_wallet_balance, 2)
+            'reporting_currency': current_app.config.get('FX_REPORTING_CURRENCY', 'KSh'),
+            'total_revenue': _reporting_total(revenue),
+            'total_wallet_balance': _reporting_total(balances),
+            'revenue_by_currency': {c: from_minor(v or 0, c) for c, v in revenue},
+            'wallet_balance_by_currency': {c: from_minor(v or 0, c) for c, v in balances},
+            'recent_history_cache': _recent_history_stats()
         }), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+def _reporting_total(sums):
+    """Per-currency sums converted to FX_REPORTING_CURRENCY; None if a rate is missing"""
+    target = current_app.config.get('FX_REPORTING_CURRENCY', 'KSh')
+    if not sums:
+        return from_minor(0, target)
+    currencies, units = zip(*((c, int(v or 0)) for c, v in sums))
+    try:
+        converted = get_fx_snapshot().convert_many(units, currencies, target)
+    except ValueError:
+        return None
+    return from_minor(int(converted.sum()), target)
+
+
+def _recent_history_stats():
+    """This worker's recent-history cache counters, or None if it is disabled"""
+    cache = get_recent_history()
+    return cache.snapshot() if cache is not None else None
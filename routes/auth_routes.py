@@ -1,24 +1,49 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import Blueprint, jsonify, g
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, jwt_required, get_jwt, get_jwt_identity
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from __init__ import db
 from models import User, Wallet
+from utils.fx import supported_currency
 from utils.helpers import generate_unique_id
+from utils.money import DEFAULT_CURRENCY
+from utils.revocation import revoke_token, revoke_all_tokens
+from utils.validation import Schema, Field, validate_json
+from utils.query_budget import query_budget
 
 bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
+REGISTER_SCHEMA = Schema({
+    'first_name': Field('str', required=True, min_length=1, max_length=100),
+    'last_name': Field('str', required=True, min_length=1, max_length=100),
+    'email': Field('email', required=True, max_length=120),
+    'password': Field('password', required=True),
+    'phone': Field('phone', max_length=20),
+    'currency': Field('str', default=DEFAULT_CURRENCY,
+                      check=lambda c: None if supported_currency(c) else 'is not a supported currency'),
+})
+
+LOGIN_SCHEMA = Schema({
+    'email': Field('str', required=True, min_length=1, max_length=120),
+    'password': Field('secret', required=True, min_length=1),
+})
+
+LOGOUT_SCHEMA = Schema({
+    'refresh_token': Field('secret'),
+    'access_token': Field('secret'),
+})
+
 @bp.route('/register', methods=['POST'])
+@query_budget(3)
+@validate_json(REGISTER_SCHEMA)
 def register():
     try:
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['first_name', 'last_name', 'email', 'password']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'{field} is required'}), 400
+        data = g.body
         
         # Check if user already exists
-        if User.query.filter_by(email=data['email']).first():
+        if User.query.filter(func.lower(User.email) == data['email']).first():
             return jsonify({'error': 'Email already registered'}), 400
         
         # Create new user
@@ -27,7 +52,7 @@ def register():
             last_name=data['last_name'],
             email=data['email'],
             phone=data.get('phone'),
-            role=data.get('role', 'user')
+            role='user'
         )
 
         user.set_password(data['password'])
@@ -39,19 +64,26 @@ def register():
         wallet = Wallet(
             user_id=user.id,
             wallet_id=generate_unique_id('QP'),
-            balance=0.0
+            balance=0,
+            currency=data['currency']
         )
         db.session.add(wallet)
+        db.session.flush()
+        
+        # Serialized before the commit expires them, saving two reloads
+        user_data, wallet_data = user.to_dict(), wallet.to_dict()
         db.session.commit()
         
-        # Generate access token
-        access_token = create_access_token(identity=user.id)
+        # Generate tokens
+        access_token = create_access_token(identity=user_data['id'])
+        refresh_token = create_refresh_token(identity=user_data['id'])
         
         return jsonify({
             'message': 'Registration successful',
             'access_token': access_token,
-            'user': user.to_dict(),
-            'wallet': wallet.to_dict()
+            'refresh_token': refresh_token,
+            'user': user_data,
+            'wallet': wallet_data
         }), 201
         
     except Exception as e:
@@ -60,14 +92,14 @@ def register():
 
 
 @bp.route('/login', methods=['POST'])
+@query_budget(1)
+@validate_json(LOGIN_SCHEMA)
 def login():
     try:
-        data = request.get_json()
-        
-        if not data.get('email') or not data.get('password'):
-            return jsonify({'error': 'Email and password are required'}), 400
+        data = g.body
         
-        user = User.query.filter_by(email=data['email']).first()
+        user = User.query.options(joinedload(User.wallet)) \
+            .filter(func.lower(User.email) == data['email'].lower()).first()
         
         if not user or not user.check_password(data['password']):
             return jsonify({'error': 'Invalid email or password'}), 401
@@ -75,12 +107,14 @@ def login():
         if user.status != 'active':
             return jsonify({'error': 'Account is inactive'}), 403
         
-        # Generate access token
+        # Generate tokens
         access_token = create_access_token(identity=user.id)
+        refresh_token = create_refresh_token(identity=user.id)
         
         return jsonify({
             'message': 'Login successful',
             'access_token': access_token,
+            'refresh_token': refresh_token,
             'user': user.to_dict(),
             'wallet': user.wallet.to_dict() if user.wallet else None
         }), 200
@@ -89,12 +123,83 @@ def login():
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+@query_budget(3)
+def refresh():
+    try:
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        if not user or user.status != 'active':
+            return jsonify({'error': 'Account is inactive'}), 403
+        
+        # Rotate: the presented refresh token cannot be used again
+        user_id = user.id
+        revoke_token(get_jwt())
+        db.session.commit()
+        
+        return jsonify({
+            'access_token': create_access_token(identity=user_id),
+            'refresh_token': create_refresh_token(identity=user_id)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+@query_budget(4)
+@validate_json(LOGOUT_SCHEMA)
+def logout():
+    try:
+        # Optionally revoke the paired token too; checked before revoking anything
+        data = g.body
+        other = data.get('refresh_token') or data.get('access_token')
+        payload = None
+        if other:
+            try:
+                payload = decode_token(other, allow_expired=True)
+            except (InvalidTokenError, JWTExtendedException):
+                return jsonify({'error': 'Invalid token'}), 400
+            if str(payload['sub']) != str(get_jwt_identity()):
+                return jsonify({'error': 'Token belongs to another user'}), 400
+        
+        revoke_token(get_jwt())
+        if payload is not None:
+            revoke_token(payload)
+        
+        db.session.commit()
+        return jsonify({'message': 'Logged out'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/revoke-all', methods=['POST'])
+@jwt_required()
+@query_budget(1)
+def revoke_all():
+    try:
+        revoke_all_tokens(get_jwt_identity())
+        db.session.commit()
+        return jsonify({'message': 'All sessions revoked'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/me', methods=['GET'])
 @jwt_required()
+@query_budget(1)
 def get_current_user():
     try:
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = User.query.options(joinedload(User.wallet)).get(current_user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
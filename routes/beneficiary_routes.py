@@ -1,27 +1,62 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from __init__ import db
-from models import Beneficiary
+from models import Beneficiary, ScheduledTransfer
+from utils.decorators import read_only
+from utils.fields import parse_fields, sparse
+from utils.beneficiaries import search_beneficiaries
+from utils.validation import Schema, Field, validate_json
+from utils.query_budget import query_budget
 
 bp = Blueprint('beneficiary', __name__, url_prefix='/api/beneficiaries')
 
+CREATE_SCHEMA = Schema({
+    'name': Field('str', required=True, min_length=1, max_length=200),
+    'email': Field('email', required=True, max_length=120),
+    'phone': Field('phone', max_length=20),
+    'relationship': Field('str', max_length=100),
+})
+
+# Same fields, all optional
+UPDATE_SCHEMA = Schema({
+    'name': Field('str', min_length=1, max_length=200),
+    'email': Field('email', max_length=120),
+    'phone': Field('phone', max_length=20),
+    'relationship': Field('str', max_length=100),
+})
+
 @bp.route('', methods=['GET', 'POST'])
 @jwt_required()
+@query_budget({'GET': 1, 'POST': 2})
+@read_only
+@validate_json(CREATE_SCHEMA)
 def beneficiaries():
     try:
         current_user_id = get_jwt_identity()
         
         if request.method == 'GET':
-            beneficiaries = Beneficiary.query.filter_by(user_id=current_user_id).all()
+            fields = parse_fields(Beneficiary)
+            term = request.args.get('q', '').strip()
+            limit = request.args.get('limit', type=int)
+            offset = request.args.get('offset', 0, type=int)
+            
+            query = sparse(Beneficiary.query, Beneficiary, fields)
+            if term:
+                query = search_beneficiaries(query, current_user_id, term)
+                limit = limit or current_app.config.get('ITEMS_PER_PAGE', 20)
+            else:
+                query = query.filter_by(user_id=current_user_id).order_by(Beneficiary.id)
+            
+            if limit:
+                query = query.limit(limit)
+            beneficiaries = query.offset(offset).all()
             return jsonify({
-                'beneficiaries': [b.to_dict() for b in beneficiaries]
+                'beneficiaries': [b.to_dict(fields) for b in beneficiaries],
+                'count': len(beneficiaries)
             }), 200
         
         # POST - Create new beneficiary
-        data = request.get_json()
-        
-        if not data.get('name') or not data.get('email'):
-            return jsonify({'error': 'Name and email are required'}), 400
+        data = g.body
         
         beneficiary = Beneficiary(
             user_id=current_user_id,
@@ -39,6 +74,9 @@ def beneficiaries():
             'beneficiary': beneficiary.to_dict()
         }), 201
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -46,10 +84,15 @@ def beneficiaries():
 
 @bp.route('/<int:beneficiary_id>', methods=['GET', 'PUT', 'DELETE'])
 @jwt_required()
+@query_budget({'GET': 1, 'PUT': 2, 'DELETE': 3})
+@read_only
+@validate_json(UPDATE_SCHEMA)
 def beneficiary_detail(beneficiary_id):
     try:
         current_user_id = get_jwt_identity()
-        beneficiary = Beneficiary.query.get(beneficiary_id)
+        fields = parse_fields(Beneficiary) if request.method == 'GET' else None
+        beneficiary = sparse(Beneficiary.query, Beneficiary, fields, required=['user_id']) \
+            .get(beneficiary_id)
         
         if not beneficiary:
             return jsonify({'error': 'Beneficiary not found'}), 404
@@ -59,10 +102,10 @@ def beneficiary_detail(beneficiary_id):
             return jsonify({'error': 'Unauthorized'}), 403
         
         if request.method == 'GET':
-            return jsonify({'beneficiary': beneficiary.to_dict()}), 200
+            return jsonify({'beneficiary': beneficiary.to_dict(fields)}), 200
         
         elif request.method == 'PUT':
-            data = request.get_json()
+            data = g.body
             
             if 'name' in data:
                 beneficiary.name = data['name']
@@ -73,19 +116,26 @@ def beneficiary_detail(beneficiary_id):
             if 'relationship' in data:
                 beneficiary.relationship = data['relationship']
             
+            beneficiary_data = beneficiary.to_dict()  # before the commit expires it
             db.session.commit()
             
             return jsonify({
                 'message': 'Beneficiary updated successfully',
-                'beneficiary': beneficiary.to_dict()
+                'beneficiary': beneficiary_data
             }), 200
         
         elif request.method == 'DELETE':
-            db.session.delete(beneficiary)
+            # Its schedules go in one statement, rather than being loaded
+            # through the cascade and deleted one by one
+            ScheduledTransfer.query.filter_by(beneficiary_id=beneficiary_id).delete(synchronize_session=False)
+            Beneficiary.query.filter_by(id=beneficiary_id).delete(synchronize_session=False)
             db.session.commit()
             
             return jsonify({'message': 'Beneficiary deleted successfully'}), 200
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
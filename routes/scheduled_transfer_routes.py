@@ -0,0 +1,100 @@
+from flask import Blueprint, request, jsonify, current_app, g
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from __init__ import db
+from models import ScheduledTransfer
+from utils.decorators import read_only
+from utils.helpers import NotFoundError
+from utils.scheduled_transfers import FREQUENCIES, create_scheduled_transfer, cancel_scheduled_transfer
+from utils.validation import Schema, Field, validate_json, setting
+from utils.query_budget import query_budget
+
+bp = Blueprint('scheduled_transfer', __name__, url_prefix='/api/scheduled-transfers')
+
+SCHEDULE_SCHEMA = Schema({
+    'beneficiary_id': Field('int', required=True, min=1),
+    'amount': Field('amount', required=True, max=setting('MAX_TRANSACTION_AMOUNT')),
+    'frequency': Field('str', choices=FREQUENCIES, default='once'),
+    'start_at': Field('datetime'),
+    'end_at': Field('datetime'),
+    'note': Field('str', max_length=500),
+})
+
+@bp.route('', methods=['GET', 'POST'])
+@jwt_required()
+@query_budget({'GET': 1, 'POST': 4})
+@read_only
+@validate_json(SCHEDULE_SCHEMA)
+def scheduled_transfers():
+    try:
+        current_user_id = get_jwt_identity()
+
+        if request.method == 'GET':
+            limit = request.args.get('limit', current_app.config.get('ITEMS_PER_PAGE', 20), type=int)
+            offset = request.args.get('offset', 0, type=int)
+            status = request.args.get('status')
+
+            query = ScheduledTransfer.query.filter_by(user_id=current_user_id)
+            if status:
+                query = query.filter_by(status=status)
+            schedules = query.order_by(ScheduledTransfer.created_at.desc()) \
+                .limit(limit).offset(offset).all()
+
+            return jsonify({
+                'scheduled_transfers': [s.to_dict() for s in schedules],
+                'count': len(schedules)
+            }), 200
+
+        # POST - Create a schedule
+        schedule = create_scheduled_transfer(current_user_id, g.body)
+        schedule_data = schedule.to_dict()  # before the commit expires it
+        db.session.commit()
+
+        return jsonify({
+            'message': 'Transfer scheduled successfully',
+            'scheduled_transfer': schedule_data
+        }), 201
+
+    except NotFoundError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/<int:schedule_id>', methods=['GET', 'DELETE'])
+@jwt_required()
+@query_budget({'GET': 1, 'DELETE': 2})
+@read_only
+def scheduled_transfer_detail(schedule_id):
+    try:
+        current_user_id = get_jwt_identity()
+        schedule = ScheduledTransfer.query.get(schedule_id)
+
+        if not schedule:
+            return jsonify({'error': 'Scheduled transfer not found'}), 404
+
+        # Check ownership
+        if schedule.user_id != current_user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        if request.method == 'GET':
+            return jsonify({'scheduled_transfer': schedule.to_dict()}), 200
+
+        # DELETE - Cancel; past runs stay on record
+        if schedule.status == 'active':
+            cancel_scheduled_transfer(schedule)
+        schedule_data = schedule.to_dict()  # before the commit expires it
+        db.session.commit()
+
+        return jsonify({
+            'message': 'Scheduled transfer cancelled',
+            'scheduled_transfer': schedule_data
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -1,90 +1,240 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from __init__ import db
-from models import User, Wallet, Transaction
-from utils.helpers import generate_unique_id, calculate_fee
+from models import User, Wallet, Transaction, CounterpartyStat
+from utils.helpers import InsufficientFundsError, NotFoundError
+from utils.money import Money, from_minor
+from utils.fees import get_fee_engine, corridor_for
+from utils.fx import get_fx_snapshot, same_currency
+from utils.decorators import read_only
+from utils.fields import parse_fields, sparse, pick
+from utils.beneficiaries import resolve_receiver
+from utils.counterparties import current_score
+from utils.recent_history import recent_page
+from utils.transfers import execute_transfer
+from utils.validation import Schema, Field, validate_json, setting
+from utils.query_budget import query_budget
+from utils.archive import has_archive, get_archived_transactions, find_archived_transaction
+from utils.export import (
+    parse_export_args, export_response, iter_transaction_rows, render_rows,
+    encode_chunks, month_bounds, get_cached_statement, iter_file
+)
 from datetime import datetime
 
 bp = Blueprint('transaction', __name__, url_prefix='/api/transactions')
 
+# Computed fields a transaction response can include
+NAME_FIELDS = ('sender_name', 'receiver_name')
+
+SEND_SCHEMA = Schema({
+    'receiver_id': Field('int', min=1),
+    'beneficiary_id': Field('int', min=1),
+    'receiver_email': Field('email', max_length=120),
+    'amount': Field('amount', required=True, max=setting('MAX_TRANSACTION_AMOUNT')),
+    'note': Field('str', max_length=500, default=''),
+}, require_any=('receiver_id', 'beneficiary_id', 'receiver_email'))
+
+QUOTE_SCHEMA = Schema({
+    'items': Field('list', required=True, min_length=1, items=Schema({
+        'amount': Field('amount', required=True, max=setting('MAX_TRANSACTION_AMOUNT')),
+        'receiver_id': Field('int', min=1),
+    })),
+})
+
 @bp.route('/send', methods=['POST'])
 @jwt_required()
+@query_budget(6)
+@validate_json(SEND_SCHEMA)
 def send_money():
     try:
         current_user_id = get_jwt_identity()
-        sender_wallet = Wallet.query.filter_by(user_id=current_user_id).first()
-
-        if not sender_wallet:
-            return jsonify({'error': 'Sender wallet not found'}), 404
-
-        data = request.get_json()
+        data = g.body
         receiver_id = data.get('receiver_id')
-        amount = float(data.get('amount', 0))
 
-        if amount <= 0:
-            return jsonify({'error': 'Invalid amount'}), 400
-
-        receiver = User.query.get(receiver_id)
+        if receiver_id is None:
+            receiver, _ = resolve_receiver(
+                current_user_id,
+                beneficiary_id=data.get('beneficiary_id'),
+                email=data.get('receiver_email')
+            )
+        else:
+            receiver = User.query.get(receiver_id)
         if not receiver:
             return jsonify({'error': 'Receiver not found'}), 404
 
-        receiver_wallet = Wallet.query.filter_by(user_id=receiver_id).first()
-        if not receiver_wallet:
-            return jsonify({'error': 'Receiver wallet not found'}), 404
-
-        fee = calculate_fee(amount)
-        total_amount = amount + fee
-
-        if sender_wallet.balance < total_amount:
-            return jsonify({'error': 'Insufficient balance'}), 400
-
-        sender_wallet.balance -= total_amount
-        receiver_wallet.balance += amount
-        sender_wallet.updated_at = datetime.utcnow()
-        receiver_wallet.updated_at = datetime.utcnow()
-
-        sender = User.query.get(current_user_id)
-
-        transaction = Transaction(
-            transaction_id=generate_unique_id('TXN', 7),
-            sender_id=current_user_id,
-            receiver_id=receiver_id,
-            amount=amount,
-            fee=fee,
-            total_amount=total_amount,
-            type='transfer',
-            status='completed',
-            note=data.get('note', '')
+        transaction, sender, sender_wallet = execute_transfer(
+            current_user_id, receiver, data['amount'], note=data['note']
         )
+        db.session.flush()
 
-        db.session.add(transaction)
-        db.session.commit()
-
+        # Serialized before the commit expires the rows, which would reload them one by one
         transaction_data = transaction.to_dict()
         transaction_data.update({
             'sender_name': f"{sender.first_name} {sender.last_name}",
             'receiver_name': f"{receiver.first_name} {receiver.last_name}"
         })
+        wallet_data = sender_wallet.to_dict()
+        db.session.commit()
 
         return jsonify({
             'message': 'Money sent successfully',
             'transaction': transaction_data,
-            'wallet': sender_wallet.to_dict()
+            'wallet': wallet_data
         }), 200
 
+    except NotFoundError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 404
+    except (InsufficientFundsError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/quote', methods=['POST'])
+@jwt_required()
+@query_budget(3)
+@validate_json(QUOTE_SCHEMA)
+def quote_fees():
+    try:
+        current_user_id = get_jwt_identity()
+        items = g.body['items']
+        max_items = current_app.config.get('QUOTE_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            return jsonify({'error': f'At most {max_items} items can be quoted at once'}), 400
+
+        # The sender and their wallet's currency in one query
+        sender, currency = db.session.query(User, Wallet.currency) \
+            .outerjoin(Wallet, Wallet.user_id == User.id) \
+            .filter(User.id == current_user_id).first() or (None, None)
+
+        if not sender:
+            return jsonify({'error': 'User not found'}), 404
+
+        amounts = []
+        for item in items:
+            amount = Money.parse(item['amount'], currency).units
+            if amount <= 0:
+                return jsonify({'error': 'Invalid amount'}), 400
+            amounts.append(amount)
+
+        # Resolve all receiver countries and currencies in one query
+        receiver_ids = {item.get('receiver_id') for item in items if item.get('receiver_id') is not None}
+        receivers = {
+            row.id: row for row in
+            db.session.query(User.id, User.country, Wallet.currency)
+            .join(Wallet, Wallet.user_id == User.id)
+            .filter(User.id.in_(receiver_ids), User.deleted_at.is_(None)).all()
+        } if receiver_ids else {}
+
+        corridors = []
+        for item in items:
+            receiver_id = item.get('receiver_id')
+            if receiver_id in receivers:
+                corridors.append(corridor_for(sender.country, receivers[receiver_id].country))
+            else:
+                corridors.append(None)
+
+        fees = get_fee_engine().quote_many(amounts, segment=sender.segment, corridors=corridors,
+                                           currency=currency)
+        fx = get_fx_snapshot()
+
+        quotes = []
+        for item, amount, fee in zip(items, amounts, fees):
+            receiver_id = item.get('receiver_id')
+            quote = {
+                'receiver_id': receiver_id,
+                'amount': from_minor(amount, currency),
+                'fee': from_minor(fee, currency),
+                'total_amount': from_minor(amount + fee, currency),
+                'currency': currency
+            }
+            receiver = receivers.get(receiver_id)
+            if receiver_id is not None and receiver is None:
+                quote['error'] = 'Receiver not found'
+            elif receiver is not None and not same_currency(currency, receiver.currency):
+                try:
+                    credit, rate = fx.convert(Money(amount, currency), receiver.currency)
+                    quote.update(receiver_amount=credit.to_major(), receiver_currency=receiver.currency,
+                                 fx_rate=float(rate))
+                except ValueError as e:
+                    quote['error'] = str(e)
+            quotes.append(quote)
+
+        return jsonify({
+            'quotes': quotes,
+            'count': len(quotes)
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/counterparties', methods=['GET'])
+@jwt_required()
+@query_budget(1)
+@read_only
+def get_counterparties():
+    try:
+        current_user_id = get_jwt_identity()
+        limit = min(int(request.args.get('limit', 10)), 100)
+        sort = request.args.get('sort', 'frequency')
+
+        if sort not in ('frequency', 'recency'):
+            return jsonify({'error': 'sort must be frequency or recency'}), 400
+
+        order = CounterpartyStat.frequency_score if sort == 'frequency' else CounterpartyStat.last_sent_at
+
+        # Top-K straight off the (user_id, score) index
+        rows = db.session.query(CounterpartyStat, User.first_name, User.last_name, User.email) \
+            .join(User, User.id == CounterpartyStat.counterparty_id) \
+            .filter(CounterpartyStat.user_id == current_user_id, User.deleted_at.is_(None)) \
+            .order_by(order.desc()) \
+            .limit(limit).all()
+
+        now = datetime.utcnow()
+        counterparties = [{
+            'counterparty_id': stat.counterparty_id,
+            'name': f"{first_name} {last_name}",
+            'email': email,
+            'transfer_count': stat.transfer_count,
+            'frequency_score': round(current_score(stat.frequency_score, now), 4),
+            'last_sent_at': stat.last_sent_at.isoformat() if stat.last_sent_at else None
+        } for stat, first_name, last_name, email in rows]
+
+        return jsonify({
+            'counterparties': counterparties,
+            'count': len(counterparties)
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('', methods=['GET'])
 @jwt_required()
+@query_budget(6)
+@read_only
 def get_transactions():
     try:
         current_user_id = get_jwt_identity()
         transaction_type = request.args.get('type', 'all')
         limit = int(request.args.get('limit', 50))
         offset = int(request.args.get('offset', 0))
+        fields = parse_fields(Transaction, extra=NAME_FIELDS)
+
+        # The newest pages come from this worker's recent-history cache
+        rows = recent_page(current_user_id, transaction_type, limit, offset)
+        if rows is not None:
+            transactions_list = [pick(t_data, fields) for t_data in rows]
+            return jsonify({
+                'transactions': transactions_list,
+                'count': len(transactions_list)
+            }), 200
 
         query = Transaction.query
         if transaction_type == 'sent':
@@ -97,64 +247,143 @@ def get_transactions():
                 (Transaction.receiver_id == current_user_id)
             )
 
-        transactions = query.order_by(Transaction.created_at.desc()) \
+        # sender_id/receiver_id are always needed to resolve names
+        loaded = fields | {'sender_id', 'receiver_id'} if fields is not None else None
+        transactions = sparse(query, Transaction, loaded) \
+            .order_by(Transaction.created_at.desc(), Transaction.id.desc()) \
             .limit(limit).offset(offset).all()
-
-        # Get all unique user IDs
-        user_ids = set()
-        for t in transactions:
-            user_ids.add(t.sender_id)
-            user_ids.add(t.receiver_id)
-        
-        # Fetch all users at once
-        users = User.query.filter(User.id.in_(user_ids)).all()
-        user_dict = {u.id: u for u in users}
+        rows = [t.to_dict(loaded) for t in transactions]
+
+        # Read through to the archive once the page runs past the hot table
+        if len(rows) < limit and has_archive(current_user_id):
+            hot_total = offset + len(rows) if rows else query.count()
+            rows.extend(get_archived_transactions(
+                current_user_id,
+                transaction_type,
+                limit=limit - len(rows),
+                offset=max(offset - hot_total, 0)
+            ))
+
+        if fields is None or fields & set(NAME_FIELDS):
+            # Get all unique user IDs
+            user_ids = set()
+            for t_data in rows:
+                user_ids.add(t_data['sender_id'])
+                user_ids.add(t_data['receiver_id'])
+            
+            # Fetch all names at once
+            names = {
+                u.id: f"{u.first_name} {u.last_name}"
+                for u in User.query.with_entities(User.id, User.first_name, User.last_name)
+                .filter(User.id.in_(user_ids)).all()
+            }
+
+            for t_data in rows:
+                t_data.update({
+                    'sender_name': names.get(t_data['sender_id']),
+                    'receiver_name': names.get(t_data['receiver_id'])
+                })
 
         # Build transaction list
-        transactions_list = []
-        for t in transactions:
-            sender = user_dict.get(t.sender_id)
-            receiver = user_dict.get(t.receiver_id)
-
-            t_data = t.to_dict()
-            t_data.update({
-                'sender_name': f"{sender.first_name} {sender.last_name}" if sender else None,
-                'receiver_name': f"{receiver.first_name} {receiver.last_name}" if receiver else None
-            })
-            transactions_list.append(t_data)
+        transactions_list = [pick(t_data, fields) for t_data in rows]
 
         return jsonify({
             'transactions': transactions_list,
             'count': len(transactions_list)
         }), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/statement', methods=['GET'])
+@jwt_required()
+@query_budget(0, stream=1)
+@read_only
+def download_statement():
+    try:
+        current_user_id = get_jwt_identity()
+        fmt, compress, start, end = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = iter_transaction_rows(current_user_id, start, end)
+    return export_response(
+        encode_chunks(render_rows(rows, fmt), compress),
+        fmt, compress, f'statement-{current_user_id}'
+    )
+
+
+@bp.route('/statements/<string:month>', methods=['GET'])
+@jwt_required()
+@query_budget(1, stream=1)
+@read_only
+def download_monthly_statement(month):
+    try:
+        current_user_id = get_jwt_identity()
+        fmt, compress, _, _ = parse_export_args(request.args)
+        start, end = month_bounds(month)
+    except ValueError:
+        return jsonify({'error': 'Invalid format or month (expected YYYY-MM)'}), 400
+
+    filename = f'statement-{current_user_id}-{month}'
+
+    # The current month can still change, so only completed months are cached
+    if end > datetime.utcnow():
+        rows = iter_transaction_rows(current_user_id, start, end)
+        return export_response(encode_chunks(render_rows(rows, fmt), compress), fmt, compress, filename)
+
+    try:
+        path = get_cached_statement(current_user_id, month, fmt)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    return export_response(iter_file(path, decompress=not compress), fmt, compress, filename)
+
 
 @bp.route('/<string:transaction_id>', methods=['GET'])
 @jwt_required()
+@query_budget(2)
+@read_only
 def get_transaction(transaction_id):
     try:
         current_user_id = get_jwt_identity()
-        transaction = Transaction.query.filter_by(transaction_id=transaction_id).first()
+        fields = parse_fields(Transaction, extra=NAME_FIELDS)
+        loaded = fields | {'sender_id', 'receiver_id'} if fields is not None else None
+
+        transaction = sparse(Transaction.query, Transaction, loaded) \
+            .filter_by(transaction_id=transaction_id).first()
 
-        if not transaction:
+        if transaction:
+            transaction_data = transaction.to_dict(loaded)
+        else:
+            # Not in the hot table; it may have been archived
+            transaction_data = find_archived_transaction(current_user_id, transaction_id)
+
+        if not transaction_data:
             return jsonify({'error': 'Transaction not found'}), 404
 
-        if transaction.sender_id != current_user_id and transaction.receiver_id != current_user_id:
+        if transaction_data['sender_id'] != current_user_id and transaction_data['receiver_id'] != current_user_id:
             return jsonify({'error': 'Unauthorized'}), 403
 
-        sender = User.query.get(transaction.sender_id)
-        receiver = User.query.get(transaction.receiver_id)
-
-        transaction_data = transaction.to_dict()
-        transaction_data.update({
-            'sender_name': f"{sender.first_name} {sender.last_name}" if sender else None,
-            'receiver_name': f"{receiver.first_name} {receiver.last_name}" if receiver else None
-        })
+        if fields is None or fields & set(NAME_FIELDS):
+            # Both names in one query
+            names = {
+                u.id: f"{u.first_name} {u.last_name}"
+                for u in User.query.with_entities(User.id, User.first_name, User.last_name)
+                .filter(User.id.in_({transaction_data['sender_id'], transaction_data['receiver_id']})).all()
+            }
+
+            transaction_data.update({
+                'sender_name': names.get(transaction_data['sender_id']),
+                'receiver_name': names.get(transaction_data['receiver_id'])
+            })
 
-        return jsonify({'transaction': transaction_data}), 200
+        return jsonify({'transaction': pick(transaction_data, fields)}), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
@@ -1,26 +1,46 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, g
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from __init__ import db
 from models import User
+from utils.fields import parse_fields, sparse
+from utils.recent_history import forget_user
+from utils.revocation import revoke_all_tokens
+from utils.validation import Schema, Field, validate_json
+from utils.query_budget import query_budget
 from datetime import datetime
 
 bp = Blueprint('user', __name__, url_prefix='/api/users')
 
+PROFILE_SCHEMA = Schema({
+    'first_name': Field('str', min_length=1, max_length=100),
+    'last_name': Field('str', min_length=1, max_length=100),
+    'phone': Field('phone', max_length=20),
+    'country': Field('str', min_length=1, max_length=100),
+})
+
+CHANGE_PASSWORD_SCHEMA = Schema({
+    'current_password': Field('secret', required=True, min_length=1),
+    'new_password': Field('password', required=True),
+})
+
 @bp.route('/profile', methods=['GET', 'PUT'])
 @jwt_required()
+@query_budget({'GET': 1, 'PUT': 2})
+@validate_json(PROFILE_SCHEMA)
 def user_profile():
     try:
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        fields = parse_fields(User) if request.method == 'GET' else None
+        user = sparse(User.query, User, fields).get(current_user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         if request.method == 'GET':
-            return jsonify({'user': user.to_dict()}), 200
+            return jsonify({'user': user.to_dict(fields)}), 200
         
         # PUT - Update profile
-        data = request.get_json()
+        data = g.body
         
         if 'first_name' in data:
             user.first_name = data['first_name']
@@ -32,13 +52,19 @@ def user_profile():
             user.country = data['country']
         
         user.updated_at = datetime.utcnow()
+        user_data = user.to_dict()  # before the commit expires it
         db.session.commit()
+        if 'first_name' in data or 'last_name' in data:
+            forget_user(user_data['id'])
         
         return jsonify({
             'message': 'Profile updated successfully',
-            'user': user.to_dict()
+            'user': user_data
         }), 200
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -46,6 +72,8 @@ def user_profile():
 
 @bp.route('/change-password', methods=['POST'])
 @jwt_required()
+@query_budget(3)
+@validate_json(CHANGE_PASSWORD_SCHEMA)
 def change_password():
     try:
         current_user_id = get_jwt_identity()
@@ -54,19 +82,24 @@ def change_password():
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        data = request.get_json()
-        
-        if not data.get('current_password') or not data.get('new_password'):
-            return jsonify({'error': 'Current and new password are required'}), 400
+        data = g.body
         
         if not user.check_password(data['current_password']):
             return jsonify({'error': 'Current password is incorrect'}), 401
         
         user.set_password(data['new_password'])
         user.updated_at = datetime.utcnow()
+        
+        # Sign out every other session; this one gets fresh tokens
+        user_id = user.id
+        revoke_all_tokens(user_id)
         db.session.commit()
         
-        return jsonify({'message': 'Password changed successfully'}), 200
+        return jsonify({
+            'message': 'Password changed successfully',
+            'access_token': create_access_token(identity=user_id),
+            'refresh_token': create_refresh_token(identity=user_id)
+        }), 200
         
     except Exception as e:
         db.session.rollback()
@@ -1,74 +1,102 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, jsonify, g
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from __init__ import db
 from models import User, Wallet, Transaction
 from utils.helpers import generate_unique_id
+from utils.decorators import read_only
+from utils.fields import parse_fields, sparse
+from utils.money import Money
+from utils.recent_history import stage_transaction, wallet_version
+from utils.validation import Schema, Field, validate_json, setting
+from utils.query_budget import query_budget
 from datetime import datetime
 
 bp = Blueprint('wallet', __name__, url_prefix='/api/wallet')
 
+ADD_FUNDS_SCHEMA = Schema({
+    'amount': Field('amount', required=True, max=setting('MAX_TRANSACTION_AMOUNT')),
+    'note': Field('str', max_length=500, default='Added funds to wallet'),
+})
+
 
 @bp.route('', methods=['GET'])
 @jwt_required()
+@query_budget(1)
+@read_only
 def get_wallet():
     try:
         print("🔍 Wallet endpoint called")  # ADD THIS
         current_user_id = get_jwt_identity()
         print(f"👤 Current user ID: {current_user_id}")  # ADD THIS
+        fields = parse_fields(Wallet)
         
-        wallet = Wallet.query.filter_by(user_id=current_user_id).first()
+        wallet = sparse(Wallet.query, Wallet, fields, required=('wallet_id',)).filter_by(user_id=current_user_id).first()
 
         if not wallet:
             print(f"❌ No wallet found for user {current_user_id}")  # ADD THIS
             return jsonify({'error': 'Wallet not found'}), 404
 
         print(f"✅ Wallet found: {wallet.wallet_id}")  # ADD THIS
-        return jsonify({'wallet': wallet.to_dict()}), 200
+        return jsonify({'wallet': wallet.to_dict(fields)}), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"❌ Error in get_wallet: {str(e)}")  # ADD THIS
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/add-funds', methods=['POST'])
 @jwt_required()
+@query_budget(3)
+@validate_json(ADD_FUNDS_SCHEMA)
 def add_funds():
     try:
         current_user_id = get_jwt_identity()
-        wallet = Wallet.query.filter_by(user_id=current_user_id).first()
+        wallet = Wallet.query.filter_by(user_id=current_user_id).with_for_update().first()
 
         if not wallet:
             return jsonify({'error': 'Wallet not found'}), 404
 
-        data = request.get_json()
-        amount = float(data.get('amount', 0))
+        data = g.body
+        amount = Money.parse(data['amount'], wallet.currency)
 
-        if amount <= 0:
+        if amount.units <= 0:
             return jsonify({'error': 'Invalid amount'}), 400
 
-        wallet.balance = max(wallet.balance + amount, 0)
+        previous = wallet_version(wallet)
+        wallet.balance = max(wallet.balance + amount.units, 0)
         wallet.updated_at = datetime.utcnow()
 
         transaction = Transaction(
             transaction_id=generate_unique_id('TXN', 7),
             sender_id=current_user_id,
             receiver_id=current_user_id,
-            amount=amount,
-            fee=0.0,
-            total_amount=amount,
+            amount=amount.units,
+            fee=0,
+            total_amount=amount.units,
+            currency=wallet.currency,
             type='add_funds',
             status='completed',
-            note=data.get('note', 'Added funds to wallet')
+            note=data['note']
         )
 
         db.session.add(transaction)
+        stage_transaction(transaction, {current_user_id: (previous, wallet_version(wallet))})
+        db.session.flush()
+
+        # Serialized before the commit expires them, saving two reloads
+        wallet_data, transaction_data = wallet.to_dict(), transaction.to_dict()
         db.session.commit()
 
         return jsonify({
             'message': 'Funds added successfully',
-            'wallet': wallet.to_dict(),
-            'transaction': transaction.to_dict()
+            'wallet': wallet_data,
+            'transaction': transaction_data
         }), 200
 
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
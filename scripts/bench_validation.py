@@ -0,0 +1,118 @@
+"""
+Measure request validation overhead per endpoint schema
+
+    python scripts/bench_validation.py
+    python scripts/bench_validation.py --number 20000 --json
+
+For each schema, times Schema.validate on a valid and an invalid body, and
+the full validate_json decorator (JSON parsing included) inside a request
+context with a no-op handler. Reports the best of --repeat runs in
+microseconds per request. No database is needed.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+
+from routes import admin_routes, auth_routes, beneficiary_routes, scheduled_transfer_routes, \
+    transaction_routes, user_routes, wallet_routes  # noqa: E402
+from utils.validation import Invalid, NestedInvalid, validate_json  # noqa: E402
+
+QUOTE_ITEMS = [{'amount': 10 + i, 'receiver_id': i + 1} for i in range(100)]
+
+# (name, schema, valid body, invalid body)
+CASES = [
+    ('auth.register', auth_routes.REGISTER_SCHEMA,
+     {'first_name': 'Jane', 'last_name': 'Doe', 'email': 'jane@example.com',
+      'password': 'Passw0rd!', 'phone': '+254700000001'},
+     {'first_name': '', 'email': 'not-an-email', 'password': 'short'}),
+    ('auth.login', auth_routes.LOGIN_SCHEMA,
+     {'email': 'jane@example.com', 'password': 'Passw0rd!'},
+     {'email': 42}),
+    ('user.change_password', user_routes.CHANGE_PASSWORD_SCHEMA,
+     {'current_password': 'Passw0rd!', 'new_password': 'Passw0rd!2'},
+     {'current_password': 'x', 'new_password': 'weak'}),
+    ('beneficiary.create', beneficiary_routes.CREATE_SCHEMA,
+     {'name': 'Jane Doe', 'email': 'jane@example.com', 'phone': '+254700000001', 'relationship': 'friend'},
+     {'name': 'Jane Doe'}),
+    ('wallet.add_funds', wallet_routes.ADD_FUNDS_SCHEMA,
+     {'amount': '250.00'},
+     {'amount': 'abc'}),
+    ('transaction.send', transaction_routes.SEND_SCHEMA,
+     {'beneficiary_id': 12, 'amount': 25.5, 'note': 'Rent'},
+     {'amount': 'NaN'}),
+    ('transaction.quote (100 items)', transaction_routes.QUOTE_SCHEMA,
+     {'items': QUOTE_ITEMS},
+     {'items': QUOTE_ITEMS[:99] + [{'amount': -1}]}),
+    ('scheduled_transfer.create', scheduled_transfer_routes.SCHEDULE_SCHEMA,
+     {'beneficiary_id': 12, 'amount': 10, 'frequency': 'monthly', 'start_at': '2030-01-01T09:00:00'},
+     {'beneficiary_id': 'x', 'amount': 10, 'frequency': 'hourly'}),
+    ('admin.adjust', admin_routes.ADJUST_SCHEMA,
+     {'action': 'add', 'amount': 5},
+     {'action': 'steal', 'amount': 5}),
+]
+
+
+def _validate_quietly(schema, body):
+    try:
+        schema.validate(body)
+    except (Invalid, NestedInvalid):
+        pass
+
+
+def per_call_us(fn, number, repeat):
+    """Best time per call in microseconds"""
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def bench_decorator(app, schema, body, number, repeat):
+    """validate_json on a no-op handler, including JSON parsing"""
+    handler = validate_json(schema)(lambda: None)
+    payload = json.dumps(body)
+
+    def run():
+        with app.test_request_context('/', method='POST', data=payload, content_type='application/json'):
+            handler()
+
+    # The bare request context, measured the same way, is subtracted
+    def baseline():
+        with app.test_request_context('/', method='POST', data=payload, content_type='application/json'):
+            pass
+
+    return per_call_us(run, number, repeat) - per_call_us(baseline, number, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=5000, help='Calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs; the best is reported')
+    parser.add_argument('--json', action='store_true', help='Print raw measurements as JSON')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    results = []
+    for name, schema, valid, invalid in CASES:
+        results.append({
+            'schema': name,
+            'valid_us': per_call_us(lambda: schema.validate(valid), args.number, args.repeat),
+            'invalid_us': per_call_us(lambda: _validate_quietly(schema, invalid), args.number, args.repeat),
+            'decorator_us': bench_decorator(app, schema, valid, max(args.number // 5, 1), args.repeat)
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'schema':<32}{'valid':>10}{'invalid':>10}{'decorator':>12}   (µs per request)")
+    for r in results:
+        print(f"{r['schema']:<32}{r['valid_us']:>10.1f}{r['invalid_us']:>10.1f}{r['decorator_us']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
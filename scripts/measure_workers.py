@@ -0,0 +1,164 @@
+"""
+Measure gunicorn worker startup time and memory for each profile
+
+    python scripts/measure_workers.py
+    python scripts/measure_workers.py --profile sync --profile sync:nopreload --workers 4
+
+A profile is WORKER_CLASS[:nopreload]. Each one starts gunicorn with
+gunicorn.conf.py against a scratch SQLite database, waits for every worker
+to log that it is ready, sends some traffic, and reports the boot time and
+per-worker memory read from /proc (Linux only). PSS splits shared pages
+between the processes sharing them, so preloaded workers show a lower PSS
+than RSS; USS is memory private to one worker.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_RE = re.compile(r'Worker ready \(pid: (\d+)\)')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def memory(pid):
+    """RSS, PSS and USS of a process in KiB"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                values[parts[0][:-1]] = int(parts[1])
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    }
+
+
+def send_traffic(port, requests):
+    """Exercise a few routes so workers load their lazy state"""
+    for i in range(requests):
+        body = json.dumps({'email': f'nobody{i}@example.com', 'password': 'x'}).encode('utf-8')
+        req = urllib.request.Request(f'http://127.0.0.1:{port}/api/auth/login', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(req, timeout=10).read()
+        except urllib.error.HTTPError:
+            pass
+
+
+def measure(profile, workers, threads, requests, env):
+    """
+    Boot gunicorn with one profile and measure it
+
+    Returns:
+        dict: Boot time, master memory and per-worker memory before and
+            after traffic
+    """
+    worker_class, _, preload = profile.partition(':')
+    port = free_port()
+    env = dict(env,
+               GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads),
+               GUNICORN_PRELOAD='false' if preload == 'nopreload' else 'true',
+               GUNICORN_MAX_REQUESTS='0',
+               PORT=str(port))
+
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+
+    ready = {}
+    all_ready = threading.Event()
+
+    def watch():
+        for line in proc.stderr:
+            match = READY_RE.search(line)
+            if match:
+                ready[int(match.group(1))] = time.monotonic() - started
+                if len(ready) >= workers:
+                    all_ready.set()
+
+    threading.Thread(target=watch, daemon=True).start()
+
+    try:
+        if not all_ready.wait(120):
+            raise RuntimeError(f'{profile}: only {len(ready)} of {workers} workers became ready')
+
+        pids = sorted(ready)
+        idle = {pid: memory(pid) for pid in pids}
+        send_traffic(port, requests)
+        loaded = {pid: memory(pid) for pid in pids}
+
+        return {
+            'profile': profile,
+            'boot_seconds': round(max(ready.values()), 3),
+            'master': memory(proc.pid),
+            'idle': idle,
+            'loaded': loaded
+        }
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+
+def _mean(samples, key):
+    return sum(s[key] for s in samples.values()) / len(samples) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', action='append',
+                        help='WORKER_CLASS[:nopreload]; repeat to compare (default: sync, sync:nopreload, gthread)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requests sent before the loaded sample')
+    parser.add_argument('--json', action='store_true', help='Print raw measurements as JSON')
+    args = parser.parse_args()
+    profiles = args.profile or ['sync', 'sync:nopreload', 'gthread']
+
+    workdir = tempfile.mkdtemp(prefix='measure-workers-')
+    env = dict(os.environ,
+               FLASK_CONFIG=os.environ.get('FLASK_CONFIG', 'production'),
+               DATABASE_URL=os.environ.get('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'measure.db')}"))
+
+    try:
+        # Create the schema once so workers booting in parallel do not race on it
+        subprocess.run([sys.executable, '-c', 'import wsgi'], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        results = [measure(p, args.workers, args.threads, args.requests, env) for p in profiles]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'profile':<18}{'boot s':>8}{'master RSS':>12}{'RSS':>9}{'PSS':>9}{'USS':>9}"
+          f"{'RSS*':>9}{'PSS*':>9}{'USS*':>9}   (MiB per worker, * after traffic)")
+    for r in results:
+        print(f"{r['profile']:<18}{r['boot_seconds']:>8.2f}{r['master']['rss'] / 1024:>12.1f}"
+              f"{_mean(r['idle'], 'rss'):>9.1f}{_mean(r['idle'], 'pss'):>9.1f}{_mean(r['idle'], 'uss'):>9.1f}"
+              f"{_mean(r['loaded'], 'rss'):>9.1f}{_mean(r['loaded'], 'pss'):>9.1f}{_mean(r['loaded'], 'uss'):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Demonstrate read-replica routing with two SQLite files
+
+    python scripts/replica_demo.py
+
+Creates a primary and a replica database in a scratch directory, copies the
+primary into the replica once (a replica that then stops replicating, i.e.
+lags forever), and checks that:
+
+- a user who just topped up reads the new balance from the primary, even
+  when the read lands on another worker;
+- once REPLICA_STICKY_SECONDS have passed, their reads go to the lagging
+  replica (the stale balance proves the replica is really used);
+- an admin adjustment keeps the wallet owner's reads on the primary.
+
+"Another worker" is simulated by dropping this process's routing state
+(utils.db_routing.reset_after_fork) before each read. Exits non-zero if a
+check fails.
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from __init__ import create_app  # noqa: E402
+from models import User, Wallet  # noqa: E402
+from utils.db_routing import reset_after_fork  # noqa: E402
+
+PASSWORD = 'Passw0rd!'
+
+
+def copy_database(source, target):
+    """Snapshot one SQLite file into another"""
+    with contextlib.closing(sqlite3.connect(source)) as src, contextlib.closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sticky-seconds', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='replica-demo-')
+    primary = os.path.join(workdir, 'primary.db')
+    replica = os.path.join(workdir, 'replica.db')
+    failures = 0
+
+    try:
+        app = create_app('testing', {
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}',
+            'SQLALCHEMY_BINDS': {'replica_0': f'sqlite:///{replica}'},
+            'REPLICA_STICKY_SECONDS': args.sticky_seconds,
+            'QUERY_BUDGET_ENFORCE': False,
+        })
+        client = app.test_client()
+
+        def call(method, path, token=None, **kwargs):
+            headers = {'Authorization': f'Bearer {token}'} if token else {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                return getattr(client, method)(path, headers=headers, **kwargs)
+
+        def login(email, password=PASSWORD):
+            return call('post', '/api/auth/login', json={'email': email, 'password': password}).json['access_token']
+
+        def balance(token):
+            reset_after_fork()  # the read lands on a worker that did not see the write
+            return call('get', '/api/wallet', token).json['wallet']['balance']
+
+        def check(label, actual, expected):
+            nonlocal failures
+            ok = actual == expected
+            failures += not ok
+            print(f"{'✓' if ok else '✗'} {label}: balance {actual} (expected {expected})")
+
+        for email in ('alice@example.com', 'bob@example.com'):
+            call('post', '/api/auth/register', json={
+                'first_name': email.split('@')[0].title(), 'last_name': 'Demo', 'email': email,
+                'password': PASSWORD, 'phone': '+254700000000'
+            })
+        admin, alice, bob = login('admin@example.com', 'admin123'), login('alice@example.com'), login('bob@example.com')
+        with app.app_context():
+            bob_wallet = Wallet.query.join(User).filter(User.email == 'bob@example.com').one().id
+
+        # The replica stops here: nothing written from now on reaches it
+        time.sleep(args.sticky_seconds)
+        copy_database(primary, replica)
+
+        call('post', '/api/wallet/add-funds', alice, json={'amount': 250})
+        check('Alice right after her top-up (primary)', balance(alice), 250.0)
+
+        time.sleep(args.sticky_seconds + 0.5)
+        check('Alice after the sticky window (lagging replica)', balance(alice), 0.0)
+
+        call('post', f'/api/admin/wallets/{bob_wallet}/adjust', admin,
+             json={'action': 'add', 'amount': 40, 'note': 'demo'})
+        check('Bob right after an admin adjustment (primary)', balance(bob), 40.0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
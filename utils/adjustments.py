@@ -0,0 +1,225 @@
+"""
+Admin wallet adjustments
+
+Adjustments are applied with set-based conditional UPDATEs: one statement
+per chunk moves every wallet by its delta and refuses any deduction that
+would take a balance below zero, so it never races with transfers running
+at the same time. Each applied adjustment is recorded as an
+'adjustment_credit' or 'adjustment_debit' transaction for audit.
+
+Chunks commit one at a time, so a batch that fails part way leaves its
+earlier chunks applied. An adjustment may carry an idempotency key, stored
+on its audit transaction under a unique index: retrying the batch replays
+the adjustments already applied (their outcome is 'applied' with
+'replayed': true) instead of applying them again.
+"""
+from datetime import datetime
+
+from sqlalchemy import case, insert, or_, select, update
+
+from __init__ import db
+from models import Transaction, Wallet
+from utils.db_routing import mark_write
+from utils.helpers import generate_unique_id
+from utils.money import from_minor, to_minor
+from utils.validation import Schema, Field, Invalid, NestedInvalid, error_message, setting
+
+ACTIONS = {'add': 'adjustment_credit', 'deduct': 'adjustment_debit'}
+
+ITEM_SCHEMA = Schema({
+    'wallet_id': Field('int', required=True, min=1),
+    'action': Field('str', required=True, choices=tuple(ACTIONS)),
+    'amount': Field('amount', required=True, max=setting('MAX_TRANSACTION_AMOUNT')),
+    'note': Field('str', max_length=500),
+    'idempotency_key': Field('str', min_length=1, max_length=100),
+})
+
+
+def _parse_item(index, item):
+    try:
+        item = ITEM_SCHEMA.validate(item)
+    except (Invalid, NestedInvalid) as e:
+        return None, error_message(e, subject='Item')
+
+    return {
+        'index': index,
+        'wallet_id': item['wallet_id'],
+        'action': item['action'],
+        'value': item['amount'],
+        'note': item.get('note') or 'Admin adjustment',
+        'key': item.get('idempotency_key')
+    }, None
+
+
+def _replay(adjustments, results):
+    """
+    Report adjustments whose idempotency key was already applied
+
+    Returns:
+        list: The adjustments still to apply
+    """
+    keys = {a['key'] for a in adjustments if a['key']}
+    if not keys:
+        return adjustments
+    applied = dict(db.session.execute(
+        select(Transaction.idempotency_key, Transaction.transaction_id)
+        .where(Transaction.idempotency_key.in_(keys))
+    ).all())
+    pending = []
+    for a in adjustments:
+        if a['key'] in applied:
+            results[a['index']] = {'index': a['index'], 'wallet_id': a['wallet_id'], 'status': 'applied',
+                                   'replayed': True, 'transaction_id': applied[a['key']]}
+        else:
+            pending.append(a)
+    return pending
+
+
+def _price(adjustments, results):
+    """
+    Convert each adjustment's amount to its wallet's minor units
+
+    Returns:
+        list: The adjustments still worth applying; ones that round to
+            nothing in their wallet's currency are failed in `results`
+    """
+    ids = {a['wallet_id'] for a in adjustments}
+    currencies = dict(db.session.execute(select(Wallet.id, Wallet.currency).where(Wallet.id.in_(ids))).all())
+    priced = []
+    for a in adjustments:
+        a['currency'] = currencies.get(a['wallet_id'])
+        try:
+            a['amount'] = to_minor(a['value'], a['currency'])
+        except ValueError as e:
+            results[a['index']] = {'index': a['index'], 'wallet_id': a['wallet_id'],
+                                   'status': 'failed', 'error': str(e)}
+            continue
+        if a['amount'] <= 0:
+            results[a['index']] = {'index': a['index'], 'wallet_id': a['wallet_id'],
+                                   'status': 'failed', 'error': 'Invalid amount'}
+            continue
+        a['delta'] = a['amount'] if a['action'] == 'add' else -a['amount']
+        priced.append(a)
+    return priced
+
+
+def _apply_round(adjustments, admin_id, results):
+    """Apply adjustments to distinct wallets with a single UPDATE"""
+    wallets = Wallet.__table__
+    deltas = {a['wallet_id']: a['delta'] for a in adjustments}
+    delta = case(deltas, value=wallets.c.id)
+    now = datetime.utcnow()
+
+    stmt = update(wallets) \
+        .where(
+            wallets.c.id.in_(list(deltas)),
+            or_(delta >= 0, wallets.c.balance + delta >= 0)
+        ) \
+        .values(balance=wallets.c.balance + delta, updated_at=now) \
+        .returning(wallets.c.id, wallets.c.user_id, wallets.c.balance)
+    applied = {row.id: row for row in db.session.execute(stmt)}
+    # The wallets' owners should see the new balances, not a lagging replica
+    mark_write(*(row.user_id for row in applied.values()))
+
+    missed = [wid for wid in deltas if wid not in applied]
+    existing = set(db.session.scalars(select(wallets.c.id).where(wallets.c.id.in_(missed)))) if missed else set()
+
+    transactions = []
+    for a in adjustments:
+        row = applied.get(a['wallet_id'])
+        if row is None:
+            error = 'Insufficient balance' if a['wallet_id'] in existing else 'Wallet not found'
+            results[a['index']] = {'index': a['index'], 'wallet_id': a['wallet_id'], 'status': 'failed', 'error': error}
+            continue
+
+        transaction_id = generate_unique_id('TXN', 7)
+        transactions.append({
+            'transaction_id': transaction_id,
+            'sender_id': row.user_id,
+            'receiver_id': row.user_id,
+            'amount': a['amount'],
+            'fee': 0,
+            'total_amount': a['amount'],
+            'currency': a['currency'],
+            'type': ACTIONS[a['action']],
+            'status': 'completed',
+            'note': f"[admin:{admin_id}] {a['note']}",
+            'idempotency_key': a['key'],
+            'created_at': now
+        })
+        results[a['index']] = {
+            'index': a['index'],
+            'wallet_id': a['wallet_id'],
+            'status': 'applied',
+            'balance': from_minor(row.balance, a['currency']),
+            'transaction_id': transaction_id
+        }
+
+    if transactions:
+        db.session.execute(insert(Transaction), transactions)
+
+
+def apply_adjustments(items, admin_id, chunk_size=500, idempotency_key=None):
+    """
+    Apply many wallet adjustments in committed chunks
+
+    Args:
+        items (list): Dicts with wallet_id, action ('add' or 'deduct'),
+            amount and an optional note and idempotency_key
+        admin_id (int): Admin applying the adjustments (recorded in the note)
+        chunk_size (int): Items per committed chunk
+        idempotency_key (str): Key of the whole batch; an item without its
+            own key gets '<idempotency_key>:<index>'
+
+    Returns:
+        list: One outcome dict per item, in input order
+    """
+    results = [None] * len(items)
+    valid, keys = [], set()
+    for index, item in enumerate(items):
+        adjustment, error = _parse_item(index, item)
+        if adjustment and adjustment['key'] is None and idempotency_key:
+            adjustment['key'] = f'{idempotency_key}:{index}'
+        if adjustment and adjustment['key'] in keys:
+            error = 'Duplicate idempotency_key'
+        if error:
+            results[index] = {'index': index, 'wallet_id': item.get('wallet_id') if isinstance(item, dict) else None,
+                              'status': 'failed', 'error': error}
+            continue
+        if adjustment['key']:
+            keys.add(adjustment['key'])
+        valid.append(adjustment)
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            pending = _price(_replay(chunk, results), results)
+
+            # A wallet may appear more than once; each UPDATE touches it only once
+            rounds = []
+            for adjustment in pending:
+                for r in rounds:
+                    if adjustment['wallet_id'] not in r:
+                        r[adjustment['wallet_id']] = adjustment
+                        break
+                else:
+                    rounds.append({adjustment['wallet_id']: adjustment})
+
+            for r in rounds:
+                _apply_round(list(r.values()), admin_id, results)
+            db.session.commit()
+        except Exception as e:
+            # Nothing in the chunk was applied; a concurrent retry of the same
+            # key lands here too, and replays once retried
+            db.session.rollback()
+            for adjustment in chunk:
+                result = results[adjustment['index']]
+                if result is None or (result['status'] == 'applied' and not result.get('replayed')):
+                    results[adjustment['index']] = {
+                        'index': adjustment['index'],
+                        'wallet_id': adjustment['wallet_id'],
+                        'status': 'failed',
+                        'error': str(e)
+                    }
+
+    return results
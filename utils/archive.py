@@ -0,0 +1,547 @@
+"""
+Cold storage for old transactions
+
+Transactions older than ARCHIVE_AFTER_DAYS are moved out of the hot
+`transactions` table into gzip JSONL segments, one per calendar month.
+A small index records which months each user appears in and the hot
+horizon (everything older than it lives in the archive).
+
+A segment is a run of gzip members, each holding up to MEMBER_ROWS rows of
+a single user (a transfer is written once for each party). Next to it,
+transactions-YYYY-MM.idx.json lists each user's members with their offset,
+length, sent and received counts and transaction IDs, so a page of history
+decompresses only the members it returns, and looking up an ID that was
+never archived decompresses nothing. Segments written before the member
+index existed are scanned whole until the next archive run rewrites them.
+
+The member index also keeps the segment's transaction count and fee total
+per currency, and the archive index a copy of them per month, so totals
+over the whole history (admin stats) need no segment reads.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from __init__ import db
+from models import Transaction
+from utils.money import DEFAULT_CURRENCY, to_minor
+
+INDEX_FILE = 'index.json'
+
+# Rows per gzip member, so a page never decompresses more than a few hundred rows
+MEMBER_ROWS = 500
+
+_index_cache = {'path': None, 'mtime': None, 'data': None}
+_index_lock = threading.Lock()
+
+# Member indexes of recently read segments: path -> (mtime, members)
+_members_cache = OrderedDict()
+_members_lock = threading.Lock()
+
+
+def get_archive_dir():
+    """
+    Resolve the archive directory for the current app
+
+    Returns:
+        str: Absolute path of the archive directory
+    """
+    path = current_app.config.get('ARCHIVE_DIR', 'archive')
+    if not os.path.isabs(path):
+        path = os.path.join(current_app.instance_path, path)
+    return path
+
+
+def _segment_path(archive_dir, partition):
+    return os.path.join(archive_dir, f'transactions-{partition}.jsonl.gz')
+
+
+def _members_path(archive_dir, partition):
+    return os.path.join(archive_dir, f'transactions-{partition}.idx.json')
+
+
+def _empty_index():
+    return {'horizon': None, 'users': {}, 'totals': {}}
+
+
+def load_index():
+    """
+    Load the archive index, re-reading it only when the file changes
+
+    Returns:
+        dict: {'horizon': iso timestamp or None, 'users': {user_id: [partitions]},
+            'totals': {partition: {currency: [count, fee minor units]}}}
+    """
+    path = os.path.join(get_archive_dir(), INDEX_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return _empty_index()
+
+    with _index_lock:
+        if _index_cache['path'] != path or _index_cache['mtime'] != mtime:
+            with open(path, 'r', encoding='utf-8') as fh:
+                _index_cache.update(path=path, mtime=mtime, data=json.load(fh))
+        return _index_cache['data']
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh, separators=(',', ':'))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_index(archive_dir, horizon, users, totals):
+    _write_json(os.path.join(archive_dir, INDEX_FILE), {
+        'horizon': horizon,
+        'users': {uid: sorted(parts) for uid, parts in users.items()},
+        'totals': totals
+    })
+
+
+def _read_segment_index(archive_dir, partition):
+    try:
+        with open(_members_path(archive_dir, partition), 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _read_members(archive_dir, partition):
+    """Member index of a segment as stored: {user_id: [[offset, length, sent, received, [ids]]]}"""
+    stored = _read_segment_index(archive_dir, partition)
+    return None if stored is None else stored['users']
+
+
+def _write_segment_index(archive_dir, partition, members, totals):
+    _write_json(_members_path(archive_dir, partition), {'users': members, 'totals': totals})
+
+
+def _add_totals(totals, rows):
+    """
+    Count serialized rows and their fees into per-currency totals
+
+    Args:
+        totals (dict): {currency: [count, fee minor units]} to extend
+        rows: Serialized transactions (fees in major units)
+    """
+    for row in rows:
+        currency = row.get('currency') or DEFAULT_CURRENCY
+        entry = totals.setdefault(currency, [0, 0])
+        entry[0] += 1
+        entry[1] += to_minor(row.get('fee') or 0, currency)
+    return totals
+
+
+def load_members(archive_dir, partition):
+    """
+    Load a segment's member index, re-reading it only when the file changes
+
+    Keeps the ARCHIVE_INDEX_CACHE_SIZE most recently read segments.
+
+    Returns:
+        dict: user_id -> list of (offset, length, sent, received, frozenset
+            of transaction IDs) in archive order, or None for a segment
+            without a member index
+    """
+    path = _members_path(archive_dir, partition)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    with _members_lock:
+        cached = _members_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            _members_cache.move_to_end(path)
+            return cached[1]
+
+    stored = _read_members(archive_dir, partition) or {}
+    members = {
+        uid: [(offset, length, sent, received, frozenset(ids)) for offset, length, sent, received, ids in entries]
+        for uid, entries in stored.items()
+    }
+    with _members_lock:
+        _members_cache[path] = (mtime, members)
+        _members_cache.move_to_end(path)
+        while len(_members_cache) > current_app.config.get('ARCHIVE_INDEX_CACHE_SIZE', 24):
+            _members_cache.popitem(last=False)
+    return members
+
+
+def _read_member(path, offset, length):
+    """Rows of one gzip member, oldest first"""
+    with open(path, 'rb') as fh:
+        fh.seek(offset)
+        data = fh.read(length)
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line]
+
+
+def _scan_segment(path):
+    """Every row of a segment without a member index, without duplicates"""
+    seen = set()
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            row = json.loads(line)
+            if row['transaction_id'] in seen:
+                continue
+            seen.add(row['transaction_id'])
+            yield row
+
+
+def _append_members(raw, rows, members):
+    """
+    Append rows to an open segment as per-user gzip members
+
+    Args:
+        raw: Segment file opened for appending in binary mode
+        rows (list): Serialized transactions, oldest first
+        members (dict): Member index to extend (as stored)
+    """
+    by_user = {}
+    for row in rows:
+        for uid in {row['sender_id'], row['receiver_id']}:
+            by_user.setdefault(str(uid), []).append(row)
+
+    raw.seek(0, os.SEEK_END)
+    for uid, user_rows in by_user.items():
+        for i in range(0, len(user_rows), MEMBER_ROWS):
+            chunk = user_rows[i:i + MEMBER_ROWS]
+            payload = ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in chunk)
+            data = gzip.compress(payload.encode('utf-8'))
+            offset = raw.tell()
+            raw.write(data)
+            members.setdefault(uid, []).append([
+                offset, len(data),
+                sum(1 for row in chunk if str(row['sender_id']) == uid),
+                sum(1 for row in chunk if str(row['receiver_id']) == uid),
+                [row['transaction_id'] for row in chunk]
+            ])
+
+
+def _reindex_segment(archive_dir, partition):
+    """Rewrite a segment without a member index into per-user members"""
+    path = _segment_path(archive_dir, partition)
+    rows = sorted(_scan_segment(path), key=lambda r: (r['created_at'] or '', r['id']))
+    members = {}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as raw:
+        _append_members(raw, rows, members)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    totals = _add_totals({}, rows)
+    _write_segment_index(archive_dir, partition, members, totals)
+    return totals
+
+
+def _segment_totals(archive_dir, partition):
+    """A segment's per-currency totals, computing and storing them if the member index predates them"""
+    stored = _read_segment_index(archive_dir, partition)
+    if stored is None:
+        return _reindex_segment(archive_dir, partition)
+    if 'totals' not in stored:
+        stored['totals'] = _add_totals({}, _scan_segment(_segment_path(archive_dir, partition)))
+        _write_segment_index(archive_dir, partition, stored['users'], stored['totals'])
+    return stored['totals']
+
+
+def get_hot_horizon():
+    """
+    Get the timestamp before which transactions live in the archive
+
+    Returns:
+        datetime: Hot horizon, or None if nothing has been archived
+    """
+    horizon = load_index().get('horizon')
+    return datetime.fromisoformat(horizon) if horizon else None
+
+
+def get_archived_totals():
+    """
+    Get the number and fee total of archived transactions per currency
+
+    Months archived before the totals were kept are counted from the next
+    archive run on.
+
+    Returns:
+        dict: {currency: (count, fee minor units)}
+    """
+    result = {}
+    for totals in load_index().get('totals', {}).values():
+        for currency, (count, fees) in totals.items():
+            total_count, total_fees = result.get(currency, (0, 0))
+            result[currency] = (total_count + count, total_fees + fees)
+    return result
+
+
+def has_archive(user_id):
+    """Check whether any archived transactions involve a user"""
+    return bool(load_index()['users'].get(str(user_id)))
+
+
+def archive_transactions(older_than_days=None, batch_size=5000):
+    """
+    Move transactions older than the cutoff into monthly archive segments
+
+    Rows are appended to their segment and both indexes are updated before
+    the rows are deleted from the hot table, so a crash never leaves a
+    transaction unreachable; rows a retried batch finds already archived
+    are only deleted, and are not counted into the totals again. Segments
+    without a member index are rewritten first, and segments without
+    totals are counted once.
+
+    Args:
+        older_than_days (int): Age threshold (default ARCHIVE_AFTER_DAYS)
+        batch_size (int): Rows moved per committed batch
+
+    Returns:
+        dict: Number of rows archived and the new hot horizon
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config.get('ARCHIVE_AFTER_DAYS', 365)
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    archive_dir = get_archive_dir()
+    os.makedirs(archive_dir, exist_ok=True)
+
+    index = load_index()
+    users = {uid: set(parts) for uid, parts in index['users'].items()}
+    totals = dict(index.get('totals', {}))
+
+    for name in sorted(os.listdir(archive_dir)):
+        if name.startswith('transactions-') and name.endswith('.jsonl.gz'):
+            partition = name[len('transactions-'):-len('.jsonl.gz')]
+            if partition not in totals or not os.path.exists(_members_path(archive_dir, partition)):
+                totals[partition] = _segment_totals(archive_dir, partition)
+
+    members_by_partition, ids_by_partition = {}, {}
+    archived = 0
+
+    while True:
+        batch = Transaction.query \
+            .filter(Transaction.created_at < cutoff) \
+            .order_by(Transaction.created_at, Transaction.id) \
+            .limit(batch_size).all()
+        if not batch:
+            break
+
+        by_partition = {}
+        for t in batch:
+            partition = t.created_at.strftime('%Y-%m')
+            by_partition.setdefault(partition, []).append(t.to_dict())
+            users.setdefault(str(t.sender_id), set()).add(partition)
+            users.setdefault(str(t.receiver_id), set()).add(partition)
+
+        for partition, rows in by_partition.items():
+            if partition not in members_by_partition:
+                stored = _read_segment_index(archive_dir, partition) or {'users': {}, 'totals': {}}
+                members = stored['users']
+                members_by_partition[partition] = members
+                # The member index is the source of truth, e.g. after a crash before the index write
+                totals[partition] = stored['totals']
+                ids_by_partition[partition] = {
+                    tid for entries in members.values() for entry in entries for tid in entry[4]
+                }
+            members, ids = members_by_partition[partition], ids_by_partition[partition]
+
+            rows = [row for row in rows if row['transaction_id'] not in ids]
+            if not rows:
+                continue
+            with open(_segment_path(archive_dir, partition), 'ab') as raw:
+                _append_members(raw, rows, members)
+                raw.flush()
+                os.fsync(raw.fileno())
+            ids.update(row['transaction_id'] for row in rows)
+            _add_totals(totals[partition], rows)
+            _write_segment_index(archive_dir, partition, members, totals[partition])
+
+        _write_index(archive_dir, index.get('horizon'), users, totals)
+
+        Transaction.query.filter(Transaction.id.in_([t.id for t in batch])) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(batch)
+
+    horizon = get_hot_horizon()
+    if horizon is None or cutoff > horizon:
+        horizon = cutoff
+    _write_index(archive_dir, horizon.isoformat(), users, totals)
+
+    return {'archived': archived, 'horizon': horizon.isoformat()}
+
+
+def _matches(row, user_id, transaction_type):
+    if transaction_type == 'sent':
+        return row['sender_id'] == user_id
+    if transaction_type == 'received':
+        return row['receiver_id'] == user_id
+    return row['sender_id'] == user_id or row['receiver_id'] == user_id
+
+
+def _count(entry, transaction_type):
+    """Rows of a member a history of this type shows"""
+    if transaction_type == 'sent':
+        return entry[2]
+    if transaction_type == 'received':
+        return entry[3]
+    return len(entry[4])
+
+
+def _user_segments(user_id, newest_first=True):
+    """
+    Yield (segment path, the user's members) for each month the user is in
+
+    The members are None for a segment without a member index.
+    """
+    archive_dir = get_archive_dir()
+    partitions = load_index()['users'].get(str(user_id), [])
+    for partition in sorted(partitions, reverse=newest_first):
+        path = _segment_path(archive_dir, partition)
+        if not os.path.exists(path):
+            continue
+        members = load_members(archive_dir, partition)
+        yield partition, path, None if members is None else members.get(str(user_id), [])
+
+
+def _scan_user_rows(path, user_id, transaction_type):
+    """A user's rows of a segment without a member index, newest first"""
+    rows = [row for row in _scan_segment(path) if _matches(row, user_id, transaction_type)]
+    rows.sort(key=lambda r: r['created_at'] or '', reverse=True)
+    return rows
+
+
+def iter_archived_transactions(user_id, transaction_type='all'):
+    """
+    Yield a user's archived transactions, newest first
+
+    Only the user's own members are read, one at a time.
+
+    Args:
+        user_id (int): User whose transactions to read
+        transaction_type (str): 'all', 'sent' or 'received'
+
+    Yields:
+        dict: Serialized transaction
+    """
+    for _, path, entries in _user_segments(user_id):
+        if entries is None:
+            yield from _scan_user_rows(path, user_id, transaction_type)
+            continue
+        for offset, length, *_ in reversed(entries):
+            rows = _read_member(path, offset, length)
+            yield from (row for row in reversed(rows) if _matches(row, user_id, transaction_type))
+
+
+def iter_archive_range(user_id=None, start=None, end=None):
+    """
+    Yield archived transactions oldest first
+
+    Args:
+        user_id (int): Only transactions involving this user (default: all)
+        start (datetime): Inclusive lower bound on created_at
+        end (datetime): Exclusive upper bound on created_at
+
+    Yields:
+        dict: Serialized transaction
+    """
+    def in_range(row):
+        created_at = datetime.fromisoformat(row['created_at'])
+        return (start is None or created_at >= start) and (end is None or created_at < end)
+
+    def in_months(partition):
+        return (start is None or partition >= start.strftime('%Y-%m')) and \
+            (end is None or partition <= end.strftime('%Y-%m'))
+
+    if user_id is not None:
+        for partition, path, entries in _user_segments(user_id, newest_first=False):
+            if not in_months(partition):
+                continue
+            if entries is None:
+                rows = reversed(_scan_user_rows(path, user_id, 'all'))
+            else:
+                rows = (row for offset, length, *_ in entries for row in _read_member(path, offset, length))
+            yield from (row for row in rows if in_range(row))
+        return
+
+    archive_dir = get_archive_dir()
+    partitions = sorted(
+        name[len('transactions-'):-len('.jsonl.gz')]
+        for name in (os.listdir(archive_dir) if os.path.isdir(archive_dir) else ())
+        if name.startswith('transactions-') and name.endswith('.jsonl.gz')
+    )
+    for partition in partitions:
+        if in_months(partition):
+            # A transfer is stored once per party; _scan_segment drops the copy
+            yield from (row for row in _scan_segment(_segment_path(archive_dir, partition)) if in_range(row))
+
+
+def get_archived_transactions(user_id, transaction_type='all', limit=50, offset=0):
+    """
+    Get one page of a user's archived transactions
+
+    Members before the page are skipped by their counts, so only the
+    members holding the page are decompressed.
+
+    Args:
+        user_id (int): User whose transactions to read
+        transaction_type (str): 'all', 'sent' or 'received'
+        limit (int): Page size
+        offset (int): Rows to skip within the archive
+
+    Returns:
+        list: Serialized transactions, newest first
+    """
+    page = []
+    for _, path, entries in _user_segments(user_id):
+        if entries is None:
+            groups = [(None, _scan_user_rows(path, user_id, transaction_type))]
+        else:
+            groups = [(entry, None) for entry in reversed(entries)]
+
+        for entry, rows in groups:
+            count = len(rows) if rows is not None else _count(entry, transaction_type)
+            if offset >= count:
+                offset -= count
+                continue
+            if rows is None:
+                rows = [row for row in reversed(_read_member(path, entry[0], entry[1]))
+                        if _matches(row, user_id, transaction_type)]
+            page.extend(rows[offset:offset + limit - len(page)])
+            offset = 0
+            if len(page) >= limit:
+                return page
+    return page
+
+
+def find_archived_transaction(user_id, transaction_id):
+    """
+    Look up a single archived transaction involving a user
+
+    Only the member listing the ID is decompressed; an ID the user's member
+    indexes do not list costs no decompression at all.
+
+    Args:
+        user_id (int): User who sent or received the transaction
+        transaction_id (str): Public transaction ID
+
+    Returns:
+        dict: Serialized transaction, or None if not archived
+    """
+    for _, path, entries in _user_segments(user_id):
+        if entries is None:
+            rows = _scan_segment(path)
+        else:
+            rows = (row for offset, length, _, _, ids in entries if transaction_id in ids
+                    for row in _read_member(path, offset, length))
+        for row in rows:
+            if row['transaction_id'] == transaction_id:
+                return row
+    return None
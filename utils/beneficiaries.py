@@ -0,0 +1,76 @@
+"""
+Beneficiary search and receiver resolution
+"""
+import re
+
+from flask import g
+from sqlalchemy import and_, func, or_
+
+from __init__ import db
+from models import Beneficiary, User, Wallet
+
+
+def _prefix_range(column, prefix):
+    """Prefix match as an index-friendly range: prefix <= column < next prefix"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+
+def search_beneficiaries(query, user_id, term):
+    """
+    Restrict a Beneficiary query to prefix matches on name, email or phone
+    
+    Each branch is a range scan over one of the (user_id, ...) indexes.
+    
+    Args:
+        query: Query over Beneficiary
+        user_id (int): Owner of the beneficiaries
+        term (str): Search prefix
+    
+    Returns:
+        Query: Filtered query ordered by name
+    """
+    term = term.strip().lower()
+    conditions = [
+        _prefix_range(Beneficiary.name_key, term),
+        _prefix_range(Beneficiary.email, term)
+    ]
+    digits = re.sub(r'\D', '', term)
+    if digits:
+        conditions.append(_prefix_range(Beneficiary.phone_key, digits))
+    
+    return query.filter(Beneficiary.user_id == user_id, or_(*conditions)) \
+        .order_by(Beneficiary.name_key, Beneficiary.id)
+
+
+def resolve_receiver(user_id, beneficiary_id=None, email=None):
+    """
+    Resolve a beneficiary or an email to the receiving user and wallet
+    
+    One indexed join either way; the result is cached for the rest of the
+    request.
+    
+    Args:
+        user_id (int): Current user (must own the beneficiary)
+        beneficiary_id (int): One of the user's beneficiaries
+        email (str): Receiver's account email, matched case-insensitively
+    
+    Returns:
+        tuple: (User, Wallet), or (None, None) if nothing matches
+    """
+    cache = g.setdefault('resolved_receivers', {})
+    key = (user_id, beneficiary_id, email)
+    if key in cache:
+        return cache[key]
+    
+    query = db.session.query(User, Wallet).join(Wallet, Wallet.user_id == User.id)
+    if beneficiary_id is not None:
+        query = query.join(Beneficiary, func.lower(Beneficiary.email) == func.lower(User.email)) \
+            .filter(Beneficiary.id == beneficiary_id, Beneficiary.user_id == user_id)
+    else:
+        query = query.filter(func.lower(User.email) == email.lower())
+    query = query.filter(User.deleted_at.is_(None))
+    
+    result = query.first() or (None, None)
+    cache[key] = tuple(result)
+    return cache[key]
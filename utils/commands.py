@@ -0,0 +1,183 @@
+"""
+Flask CLI commands for maintenance jobs
+
+Run with e.g. `flask --app run archive-transactions`.
+"""
+import click
+
+
+def register_commands(app):
+    """Attach maintenance commands to the app CLI"""
+
+    @app.cli.command('archive-transactions')
+    @click.option('--days', type=int, default=None,
+                  help='Archive transactions older than this many days')
+    @click.option('--batch-size', type=int, default=5000)
+    def archive_transactions_command(days, batch_size):
+        """Move old transactions into the cold archive"""
+        from utils.archive import archive_transactions
+
+        result = archive_transactions(older_than_days=days, batch_size=batch_size)
+        click.echo(f"✓ Archived {result['archived']} transactions (hot horizon {result['horizon']})")
+
+    @app.cli.command('reconcile')
+    @click.option('--full', is_flag=True,
+                  help='Rebuild from the whole history instead of the last watermark')
+    @click.option('--chunk-size', type=int, default=100000)
+    @click.option('--tolerance', type=float, default=0.0,
+                  help="Ignore drift up to this amount in each wallet's currency")
+    @click.option('--limit', type=int, default=50, help='Maximum drifted wallets to print')
+    def reconcile_command(full, chunk_size, tolerance, limit):
+        """Check wallet balances against the transaction history"""
+        from utils.reconcile import reconcile
+
+        result = reconcile(full=full, chunk_size=chunk_size, tolerance=tolerance)
+        drift = result['drift']
+        click.echo(f"✓ Processed {result['processed']} transactions (watermark {result['watermark']})")
+
+        if not drift:
+            click.echo("✓ All wallets reconcile")
+            return
+
+        click.echo(f"✗ {len(drift)} wallets drifted")
+        for d in drift[:limit]:
+            click.echo(f"  wallet {d['wallet_id']} (user {d['user_id']}): "
+                       f"balance {d['balance']:.2f}, expected {d['expected_balance']:.2f}, "
+                       f"drift {d['drift']:+.2f}")
+
+    @app.cli.command('backfill-counterparties')
+    @click.option('--chunk-size', type=int, default=1000)
+    def backfill_counterparties_command(chunk_size):
+        """Rebuild frequent-counterparty stats from transaction history"""
+        from utils.counterparties import backfill_counterparty_stats
+
+        processed = backfill_counterparty_stats(chunk_size=chunk_size)
+        click.echo(f"✓ Rebuilt counterparty stats from {processed} transfers")
+
+    @app.cli.command('index-advisor')
+    @click.option('--verbose', is_flag=True, help='Print the plan of every combination')
+    def index_advisor_command(verbose):
+        """Check admin transaction search filters for full table scans (SQLite)"""
+        from __init__ import db
+        from utils.transaction_search import check_search_plans
+
+        if db.engine.dialect.name != 'sqlite':
+            raise click.ClickException('The index advisor runs EXPLAIN QUERY PLAN and needs SQLite')
+
+        results = check_search_plans()
+        failures = [r for r in results if r['full_scan']]
+        for r in results:
+            if verbose or r['full_scan']:
+                marker = '✗' if r['full_scan'] else '✓'
+                click.echo(f"{marker} {', '.join(r['filters']) or '(no filters)'}: {' | '.join(r['plan'])}")
+
+        if failures:
+            raise click.ClickException(f'{len(failures)} of {len(results)} filter combinations scan transactions')
+        click.echo(f"✓ All {len(results)} filter combinations use an index")
+
+    @app.cli.command('db-upgrade')
+    @click.option('--target', default=None, help='Stop after this migration version')
+    def db_upgrade_command(target):
+        """Apply pending schema migrations"""
+        from __init__ import db
+        from utils.migrations import upgrade
+
+        applied = upgrade(db.engine, target=target)
+        for version, name in applied:
+            click.echo(f"✓ Applied {version}_{name}")
+        if not applied:
+            click.echo("✓ Schema is up to date")
+
+    @app.cli.command('db-status')
+    def db_status_command():
+        """List applied and pending schema migrations"""
+        from __init__ import db
+        from utils.migrations import applied_versions, discover
+
+        applied = applied_versions(db.engine)
+        for version, name, _ in discover():
+            click.echo(f"{'✓' if version in applied else ' '} {version}_{name}")
+
+    @app.cli.command('plan-snapshot')
+    @click.option('--update', is_flag=True, help='Record the current plans as the new snapshot')
+    @click.option('--path', default=None, help='Snapshot file (default: QUERY_PLAN_SNAPSHOT_PATH)')
+    def plan_snapshot_command(update, path):
+        """Check route query plans against the recorded snapshot"""
+        from utils.plan_snapshots import (
+            capture_plans, compare_plans, load_snapshot, save_snapshot, uncovered_endpoints
+        )
+        from utils.query_budget import QueryBudgetExceeded, unbudgeted_endpoints
+
+        path = path or app.config['QUERY_PLAN_SNAPSHOT_PATH']
+        for endpoint in uncovered_endpoints(app):
+            click.echo(f"! {endpoint} is not exercised by the plan scenario")
+        unbudgeted = unbudgeted_endpoints(app)
+        for endpoint in unbudgeted:
+            click.echo(f"✗ {endpoint} declares no @query_budget")
+        if unbudgeted:
+            raise click.ClickException(f"{len(unbudgeted)} endpoint(s) without a query budget")
+
+        # The scenario runs with QUERY_BUDGET_ENFORCE, so every handler is held to its budget
+        try:
+            plans = capture_plans()
+        except QueryBudgetExceeded as e:
+            raise click.ClickException(str(e))
+        if update:
+            save_snapshot(path, plans)
+            click.echo(f"✓ Recorded plans for {len(plans)} endpoints in {path}")
+            return
+
+        result = compare_plans(load_snapshot(path), plans)
+        for label, marker in (('new', '+'), ('changed', '~'), ('regressions', '✗')):
+            for entry in result[label]:
+                click.echo(f"{marker} {entry['endpoint']}: {entry['sql']}")
+                click.echo(f"    now:    {' | '.join(entry['plan'])}")
+                if 'snapshot' in entry:
+                    click.echo(f"    before: {' | '.join(entry['snapshot'])}")
+
+        if result['regressions']:
+            raise click.ClickException(f"{len(result['regressions'])} statement(s) now scan a whole table")
+        click.echo("✓ No query plan regressions")
+
+    @app.cli.command('purge-revoked-tokens')
+    def purge_revoked_tokens_command():
+        """Delete revocation records for tokens that have expired"""
+        from utils.revocation import purge_expired_revocations
+
+        deleted = purge_expired_revocations()
+        click.echo(f"✓ Purged {deleted} expired revocation records")
+
+    @app.cli.command('run-scheduled-transfers')
+    @click.option('--loop', is_flag=True, help='Keep polling for due transfers')
+    @click.option('--batch-size', type=int, default=None)
+    def run_scheduled_transfers_command(loop, batch_size):
+        """Execute scheduled transfers that are due"""
+        from utils.scheduled_transfers import run_due_transfers, run_scheduler
+
+        def report(counts):
+            click.echo(f"✓ {counts['completed']} completed, {counts['failed']} failed, "
+                       f"{counts['skipped']} skipped, {counts['errors']} errors "
+                       f"in {counts['batches']} batches")
+
+        if not loop:
+            report(run_due_transfers(batch_size=batch_size))
+            return
+        for counts in run_scheduler(batch_size=batch_size):
+            report(counts)
+
+    @app.cli.command('purge-deleted-users')
+    @click.option('--loop', is_flag=True, help='Keep polling for deleted users')
+    @click.option('--chunk-size', type=int, default=None)
+    def purge_deleted_users_command(loop, chunk_size):
+        """Purge the data of users deleted through the admin API"""
+        from utils.user_deletion import run_user_purges, run_purger
+
+        def report(counts):
+            click.echo(f"✓ {counts['completed']} purged, {counts['failed']} failed, "
+                       f"{counts['rows']} rows processed")
+
+        if not loop:
+            report(run_user_purges(chunk_size=chunk_size))
+            return
+        for counts in run_purger(chunk_size=chunk_size):
+            report(counts)
@@ -0,0 +1,98 @@
+"""
+Response compression
+
+Negotiates brotli (when the `brotli` package is installed) or gzip from
+Accept-Encoding. Buffered responses are compressed once they reach
+COMPRESS_MIN_SIZE bytes; streamed responses are compressed chunk by chunk,
+flushing after each so clients still see rows as they are produced.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+# Payloads that are already compressed gain nothing from another pass
+SKIP_MIMETYPES = ('application/gzip', 'application/zip', 'image/', 'video/', 'audio/')
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+def _make_compressor(encoding, config):
+    if encoding == 'br':
+        return _BrotliCompressor(config.get('COMPRESS_BR_QUALITY', 4))
+    return _GzipCompressor(config.get('COMPRESS_LEVEL', 6))
+
+
+def _compress_stream(chunks, compressor):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def init_compression(app):
+    """Register the compression hook on an app"""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return response
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        if (response.mimetype or '').startswith(SKIP_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(offered)
+        if encoding is None:
+            return response
+
+        compressor = _make_compressor(encoding, app.config)
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config.get('COMPRESS_MIN_SIZE', 1024):
+                return response
+            response.set_data(compressor.compress(data) + compressor.finish())
+
+        response.headers['Content-Encoding'] = encoding
+        return response
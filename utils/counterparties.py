@@ -0,0 +1,161 @@
+"""
+Frequent-counterparty statistics
+
+Every transfer bumps a (user_id, counterparty_id) row in counterparty_stats.
+Frequency is forward-decayed: a transfer at time t adds
+2 ** ((t - EPOCH) / half_life), so a stored score divided by the same weight
+for "now" is the exponentially decayed frequency, and rows can be ranked
+straight from the (user_id, frequency_score) index without rewriting them.
+Changing COUNTERPARTY_HALF_LIFE_DAYS requires a backfill.
+"""
+from datetime import datetime
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import case
+
+from __init__ import db
+from models import CounterpartyStat, Transaction
+from utils.archive import iter_archive_range
+
+EPOCH = datetime(2020, 1, 1)
+
+
+def _half_life_seconds():
+    return current_app.config.get('COUNTERPARTY_HALF_LIFE_DAYS', 30) * 86400
+
+
+def decay_weight(when):
+    """Forward-decay weight of an event at `when`"""
+    return 2 ** ((when - EPOCH).total_seconds() / _half_life_seconds())
+
+
+def current_score(frequency_score, now=None):
+    """Decayed frequency of a stored score as of `now`"""
+    return frequency_score / decay_weight(now or datetime.utcnow())
+
+
+def _upsert(rows):
+    """Merge aggregated rows into counterparty_stats"""
+    if not rows:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        for row in rows:
+            stat = db.session.get(CounterpartyStat, (row['user_id'], row['counterparty_id']))
+            if stat is None:
+                db.session.add(CounterpartyStat(**row))
+            else:
+                stat.transfer_count += row['transfer_count']
+                stat.frequency_score += row['frequency_score']
+                stat.last_sent_at = max(stat.last_sent_at, row['last_sent_at'])
+        return
+
+    table = CounterpartyStat.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.counterparty_id],
+        set_={
+            'transfer_count': table.c.transfer_count + stmt.excluded.transfer_count,
+            'frequency_score': table.c.frequency_score + stmt.excluded.frequency_score,
+            'last_sent_at': case(
+                (stmt.excluded.last_sent_at > table.c.last_sent_at, stmt.excluded.last_sent_at),
+                else_=table.c.last_sent_at
+            )
+        }
+    )
+    db.session.execute(stmt, rows)
+
+
+def record_transfer(sender_id, receiver_id, when=None):
+    """
+    Count a transfer towards the sender's counterparty stats
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    if sender_id == receiver_id:
+        return
+    when = when or datetime.utcnow()
+    _upsert([{
+        'user_id': sender_id,
+        'counterparty_id': receiver_id,
+        'transfer_count': 1,
+        'frequency_score': decay_weight(when),
+        'last_sent_at': when
+    }])
+
+
+def _aggregate(rows):
+    """Fold (sender_id, receiver_id, created_at) rows of one pair into a stat row"""
+    rows = list(rows)
+    return {
+        'user_id': rows[0][0],
+        'counterparty_id': rows[0][1],
+        'transfer_count': len(rows),
+        'frequency_score': sum(decay_weight(r[2]) for r in rows),
+        'last_sent_at': max(r[2] for r in rows)
+    }
+
+
+def backfill_counterparty_stats(chunk_size=1000):
+    """
+    Rebuild counterparty_stats from the transaction history
+
+    Hot transfers are streamed in (sender_id, receiver_id) order so each
+    pair is aggregated and written as soon as its rows have been read;
+    archived transfers are folded in one monthly segment at a time.
+
+    Args:
+        chunk_size (int): Stat rows written per statement
+
+    Returns:
+        int: Number of transfers processed
+    """
+    CounterpartyStat.query.delete()
+    processed = 0
+
+    for segment_rows in _iter_archived_pairs():
+        pending = [_aggregate(group) for _, group in groupby(segment_rows, key=lambda r: r[:2])]
+        processed += sum(r['transfer_count'] for r in pending)
+        for start in range(0, len(pending), chunk_size):
+            _upsert(pending[start:start + chunk_size])
+
+    query = db.session.query(Transaction.sender_id, Transaction.receiver_id, Transaction.created_at) \
+        .filter(Transaction.type == 'transfer', Transaction.sender_id != Transaction.receiver_id) \
+        .order_by(Transaction.sender_id, Transaction.receiver_id) \
+        .yield_per(chunk_size)
+
+    pending = []
+    for _, group in groupby(query, key=lambda r: (r[0], r[1])):
+        stat = _aggregate(group)
+        processed += stat['transfer_count']
+        pending.append(stat)
+        if len(pending) >= chunk_size:
+            _upsert(pending)
+            pending = []
+    _upsert(pending)
+
+    db.session.commit()
+    return processed
+
+
+def _iter_archived_pairs():
+    """Yield each archive segment's transfers as sorted (sender, receiver, created_at) rows"""
+    current = None
+    rows = []
+    for t in iter_archive_range():
+        if t['type'] != 'transfer' or t['sender_id'] == t['receiver_id']:
+            continue
+        partition = t['created_at'][:7]
+        if partition != current and rows:
+            yield sorted(rows)
+            rows = []
+        current = partition
+        rows.append((t['sender_id'], t['receiver_id'], datetime.fromisoformat(t['created_at'])))
+    if rows:
+        yield sorted(rows)
@@ -0,0 +1,245 @@
+"""
+Read-replica routing for the SQLAlchemy session
+
+Handlers marked with `utils.decorators.read_only` send their SELECTs to a
+replica bind (any SQLALCHEMY_BINDS key starting with 'replica'); everything
+else, including all flushes, goes to the primary.
+
+Read-your-writes: each commit records the users whose data it changed (the
+caller, the owners of the rows it flushed and anyone passed to mark_write())
+in the recent_writes table on the primary, so whichever worker serves their
+next request keeps their reads on the primary for REPLICA_STICKY_SECONDS.
+Without replica binds nothing is recorded or looked up.
+"""
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect, select, text
+
+REPLICA_PREFIX = 'replica'
+OWNER_COLUMNS = ('user_id', 'sender_id', 'receiver_id')
+
+# Writes this worker recorded itself, so it can skip the lookup for them
+_last_write = {}
+_last_write_lock = threading.Lock()
+_health = {}
+_round_robin = itertools.count()
+
+
+def current_identity():
+    """Get the JWT identity of the current request, if one was verified"""
+    if not has_request_context():
+        return None
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+def has_replicas(engines):
+    """Whether any replica bind is configured"""
+    return any(key and key.startswith(REPLICA_PREFIX) for key in engines)
+
+
+def _owners(obj):
+    """Users a flushed ORM object belongs to, without loading anything"""
+    values = inspect(obj).dict
+    if getattr(obj, '__tablename__', None) == 'users':
+        return [values.get('id')]
+    return [values.get(column) for column in OWNER_COLUMNS]
+
+
+def mark_write(*user_ids, session=None):
+    """
+    Record that the current transaction changes these users' data
+
+    Rows flushed through the ORM are picked up on their own; call this after
+    bulk UPDATE/INSERT statements. Takes effect when the session commits.
+
+    Args:
+        user_ids (int): Affected users
+        session: Session (default: db.session)
+    """
+    if session is None:
+        from __init__ import db
+        session = db.session
+    session.info.setdefault('written_users', set()).update(user_ids)
+
+
+def _upsert_writes(conn, rows):
+    from models import RecentWrite
+
+    table = RecentWrite.__table__
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        ids = [row['user_id'] for row in rows]
+        conn.execute(table.update().where(table.c.user_id.in_(ids)).values(written_at=rows[0]['written_at']))
+        existing = set(conn.scalars(select(table.c.user_id).where(table.c.user_id.in_(ids))))
+        missing = [row for row in rows if row['user_id'] not in existing]
+        if missing:
+            conn.execute(table.insert(), missing)
+        return
+
+    stmt = insert(table)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={'written_at': stmt.excluded.written_at}
+    ), rows)
+
+
+def record_writes(engines, user_ids):
+    """
+    Start the read-your-writes window of users whose data was just committed
+
+    Args:
+        engines (dict): Engines by bind key (db.engines)
+        user_ids (set): Affected users
+    """
+    if not user_ids or not has_replicas(engines):
+        return
+
+    now = time.monotonic()
+    window = current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+    with _last_write_lock:
+        for user_id in user_ids:
+            _last_write[user_id] = now
+        if len(_last_write) > 10000:
+            for uid, ts in list(_last_write.items()):
+                if now - ts > window:
+                    del _last_write[uid]
+
+    written_at = datetime.utcnow()
+    try:
+        # Routing bookkeeping, not part of the handler's queries
+        with engines[None].connect().execution_options(query_budget=False) as conn:
+            _upsert_writes(conn, [{'user_id': uid, 'written_at': written_at} for uid in sorted(user_ids)])
+            conn.commit()
+    except Exception as e:
+        current_app.logger.warning(f'Could not record writes for read-your-writes: {e}')
+
+
+def recently_wrote(user_id):
+    """
+    Check whether a user is inside their read-your-writes window
+
+    Args:
+        user_id (int): User to check
+
+    Returns:
+        bool: True if reads for this user must go to the primary
+    """
+    if user_id is None:
+        return False
+    from __init__ import db
+    if not has_replicas(db.engines):
+        return False
+
+    window = current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+    ts = _last_write.get(user_id)
+    if ts is not None and time.monotonic() - ts < window:
+        return True
+
+    from models import RecentWrite
+    table = RecentWrite.__table__
+    try:
+        with db.engine.connect().execution_options(query_budget=False) as conn:
+            written_at = conn.scalar(select(table.c.written_at).where(table.c.user_id == user_id))
+    except Exception as e:
+        current_app.logger.warning(f'Could not check recent writes: {e}')
+        return True
+    return written_at is not None and written_at > datetime.utcnow() - timedelta(seconds=window)
+
+
+def reset_after_fork():
+    """Drop routing state inherited from the parent process"""
+    global _last_write_lock
+    _last_write.clear()
+    _health.clear()
+    _last_write_lock = threading.Lock()
+
+
+def _is_healthy(key, engine):
+    interval = current_app.config.get('REPLICA_HEALTH_CHECK_INTERVAL', 10)
+    now = time.monotonic()
+    state = _health.get(key)
+    if state is not None and now - state[1] < interval:
+        return state[0]
+
+    try:
+        # Not part of the handler that happens to trigger it
+        with engine.connect().execution_options(query_budget=False) as conn:
+            conn.execute(text('SELECT 1'))
+        healthy = True
+    except Exception as e:
+        current_app.logger.warning(f'Replica {key} failed health check: {e}')
+        healthy = False
+
+    _health[key] = (healthy, now)
+    return healthy
+
+
+def pick_replica(engines):
+    """
+    Choose a healthy replica engine, round-robin
+
+    Args:
+        engines (dict): Engines by bind key (db.engines)
+
+    Returns:
+        Engine: A replica engine, or None to fall back to the primary
+    """
+    keys = sorted(k for k in engines if k and k.startswith(REPLICA_PREFIX))
+    if not keys:
+        return None
+
+    start = next(_round_robin)
+    for i in range(len(keys)):
+        key = keys[(start + i) % len(keys)]
+        if _is_healthy(key, engines[key]):
+            return engines[key]
+    return None
+
+
+class RoutingSession(Session):
+    """Session that sends reads from read-only handlers to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None
+                and not self._flushing
+                and has_request_context()
+                and g.get('db_read_only')
+                and getattr(clause, 'is_select', False)):
+            engine = pick_replica(self._db.engines)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    users = session.info.setdefault('written_users', set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        users.update(_owners(obj))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    users = session.info.pop('written_users', None)
+    if users:
+        users.add(current_identity())
+        users.discard(None)
+        record_writes(session._db.engines, users)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('written_users', None)
@@ -2,9 +2,10 @@
 Custom decorators for route protection
 """
 from functools import wraps
-from flask import jsonify
+from flask import jsonify, request, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import User
+from utils.db_routing import current_identity, recently_wrote
 
 
 def admin_required(fn):
@@ -17,7 +18,7 @@ def admin_required(fn):
         current_user_id = get_jwt_identity()
         user = User.query.get(current_user_id)
         
-        if not user or user.role != 'admin':
+        if not user or user.deleted_at is not None or user.role != 'admin':
             return jsonify({'error': 'Admin access required'}), 403
         
         return fn(*args, **kwargs)
@@ -34,11 +35,24 @@ def active_user_required(fn):
         current_user_id = get_jwt_identity()
         user = User.query.get(current_user_id)
         
-        if not user:
+        if not user or user.deleted_at is not None:
             return jsonify({'error': 'User not found'}), 404
         
         if user.status != 'active':
             return jsonify({'error': 'Account is inactive'}), 403
         
         return fn(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def read_only(fn):
+    """
+    Decorator to mark a handler's GET requests as safe to serve from a
+    read replica, unless the user wrote something very recently
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.db_read_only = not recently_wrote(current_identity())
+        return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,248 @@
+"""
+Streaming transaction export
+
+Rows are read with `yield_per` (archived rows straight from their segments),
+rendered as NDJSON or CSV and optionally gzipped on the fly, so an export of
+any size runs in constant memory. Statements for completed months are
+written to disk once and served from there afterwards.
+"""
+import contextlib
+import csv
+import glob
+import gzip
+import io
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime, timezone
+
+from flask import current_app, Response, stream_with_context
+from sqlalchemy import or_
+
+from models import Transaction
+from utils.archive import get_hot_horizon, iter_archive_range
+
+EXPORT_FIELDS = [
+    'id', 'transaction_id', 'sender_id', 'receiver_id', 'amount', 'fee',
+    'total_amount', 'currency', 'receiver_amount', 'receiver_currency',
+    'fx_rate', 'type', 'status', 'note', 'created_at'
+]
+# Bumped whenever the rendered columns change, so cached statements are rebuilt
+STATEMENT_VERSION = 2
+FLUSH_BYTES = 64 * 1024
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _parse_datetime(value, name):
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 datetime')
+    # Stored datetimes are naive UTC
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_export_args(args):
+    """
+    Read format, gzip and date range query parameters
+
+    Args:
+        args: request.args
+
+    Returns:
+        tuple: (fmt, compress, start, end)
+
+    Raises:
+        ValueError: If a parameter is invalid
+    """
+    fmt = args.get('format', 'ndjson')
+    if fmt not in MIMETYPES:
+        raise ValueError('format must be ndjson or csv')
+    compress = args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    start = _parse_datetime(args['start'], 'start') if args.get('start') else None
+    end = _parse_datetime(args['end'], 'end') if args.get('end') else None
+    return fmt, compress, start, end
+
+
+def export_response(chunks, fmt, compress, filename):
+    """Wrap encoded chunks in a streaming download response"""
+    filename = f'{filename}.{fmt}' + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/gzip' if compress else MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def iter_transaction_rows(user_id=None, start=None, end=None, chunk_size=1000):
+    """
+    Yield serialized transactions oldest first, archive before hot table
+
+    Args:
+        user_id (int): Only transactions involving this user (default: all)
+        start (datetime): Inclusive lower bound on created_at
+        end (datetime): Exclusive upper bound on created_at
+        chunk_size (int): Rows fetched per round trip
+
+    Yields:
+        dict: Serialized transaction
+    """
+    horizon = get_hot_horizon()
+    if horizon is not None and (start is None or start < horizon):
+        yield from iter_archive_range(user_id, start, end)
+
+    query = Transaction.query
+    if user_id is not None:
+        query = query.filter(or_(Transaction.sender_id == user_id, Transaction.receiver_id == user_id))
+    if start is not None:
+        query = query.filter(Transaction.created_at >= start)
+    if end is not None:
+        query = query.filter(Transaction.created_at < end)
+
+    for t in query.order_by(Transaction.id).yield_per(chunk_size):
+        yield t.to_dict()
+
+
+def render_rows(rows, fmt='ndjson'):
+    """
+    Render rows as NDJSON or CSV text
+
+    Args:
+        rows (iterable): Serialized transactions
+        fmt (str): 'ndjson' or 'csv'
+
+    Yields:
+        str: One line (or the CSV header) at a time
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps(row, separators=(',', ':')) + '\n'
+
+
+def encode_chunks(lines, compress=False):
+    """
+    Encode text lines into byte chunks of roughly FLUSH_BYTES
+
+    Args:
+        lines (iterable): Text to encode
+        compress (bool): gzip the output
+
+    Yields:
+        bytes: Encoded (and possibly compressed) chunk
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    pending = []
+    size = 0
+
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def month_bounds(month):
+    """
+    Parse a 'YYYY-MM' month into its [start, end) datetimes
+
+    Raises:
+        ValueError: If the month is malformed
+    """
+    start = datetime.strptime(month, '%Y-%m')
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def statement_dir(user_id):
+    """Directory of a user's cached monthly statements"""
+    path = current_app.config.get('STATEMENT_CACHE_DIR', 'statements')
+    if not os.path.isabs(path):
+        path = os.path.join(current_app.instance_path, path)
+    return os.path.join(path, str(user_id))
+
+
+def statement_path(user_id, month, fmt):
+    """Location of a cached (gzipped) monthly statement"""
+    return os.path.join(statement_dir(user_id), f'{month}.v{STATEMENT_VERSION}.{fmt}.gz')
+
+
+def drop_cached_statements(user_id, month=None):
+    """
+    Delete cached statements so they are rebuilt from current data
+
+    Args:
+        user_id (int): Statement owner
+        month (str): Only this 'YYYY-MM', in every format and version
+            (default: all of the user's statements)
+    """
+    if month is None:
+        shutil.rmtree(statement_dir(user_id), ignore_errors=True)
+        return
+    for path in glob.glob(os.path.join(glob.escape(statement_dir(user_id)), f'{month}.*.gz')):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def get_cached_statement(user_id, month, fmt):
+    """
+    Get the path of a monthly statement, building it on first request
+
+    Args:
+        user_id (int): Statement owner
+        month (str): 'YYYY-MM'; must be a completed month
+        fmt (str): 'ndjson' or 'csv'
+
+    Returns:
+        str: Path of the gzipped statement file
+    """
+    path = statement_path(user_id, month, fmt)
+    if os.path.exists(path):
+        return path
+
+    start, end = month_bounds(month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        for chunk in encode_chunks(render_rows(iter_transaction_rows(user_id, start, end), fmt), compress=True):
+            fh.write(chunk)
+    os.replace(tmp_path, path)
+    return path
+
+
+def iter_file(path, decompress=False):
+    """Stream a file from disk, optionally gunzipping it"""
+    opener = gzip.open if decompress else open
+    with opener(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(FLUSH_BYTES)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,249 @@
+"""
+Fee engine
+
+Fee schedules are compiled once, on load or reload, into sorted breakpoint
+tables keyed by (customer segment, corridor). Quoting a fee is then a binary
+search over the matching table with no database access.
+
+A schedule file (FEE_SCHEDULE_PATH) is a JSON list of rules:
+
+    [
+        {"tiers": [{"up_to": 1000, "rate": 0.015}, {"rate": 0.01, "max_fee": 50}]},
+        {"segment": "premium", "tiers": [{"rate": 0.005}]},
+        {"corridor": "Kenya->Uganda", "tiers": [{"rate": 0.02, "flat": 1.0}]}
+    ]
+
+A tier applies to amounts up to and including `up_to` (omit it on the last
+tier). The fee is `amount * rate + flat`, rounded half up to a whole minor
+unit and clamped to `min_fee`/`max_fee`. Schedules are written in major units
+of the sender's currency and compiled to minor units once per currency
+exponent (see utils.money), so a 1000 bound is 100000 cents but 1000 UGX.
+The most specific rule wins: segment + corridor, then segment, then
+corridor, then the default rule. Without a schedule file every amount is
+charged TRANSACTION_FEE_RATE.
+
+Each worker compiles its own engine. Every FEE_REFRESH_SECONDS one request
+thread compares the schedule file's modification time and size with the ones
+it was compiled from and recompiles if they changed, so an edited schedule
+reaches every worker without a restart. /api/admin/fees/reload does the same
+straight away for the worker that handles it.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+from flask import current_app
+
+from utils.money import CURRENCY_EXPONENTS, DEFAULT_EXPONENT, Money, exponent_for
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def corridor_for(sender_country, receiver_country):
+    """Build the corridor key for a pair of countries"""
+    return f"{sender_country or ''}->{receiver_country or ''}".lower()
+
+
+def _minor(value, exponent):
+    if value == float('inf'):
+        return value
+    return float(Decimal(str(value)).scaleb(exponent).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class FeeTable:
+    """Sorted breakpoint table for one schedule rule, in minor units"""
+
+    def __init__(self, tiers, exponent=DEFAULT_EXPONENT):
+        if not tiers:
+            raise ValueError('A fee schedule needs at least one tier')
+
+        tiers = sorted(tiers, key=lambda t: float('inf') if t.get('up_to') is None else t['up_to'])
+        if tiers[-1].get('up_to') is not None:
+            raise ValueError('The last fee tier must not have an upper bound')
+
+        self.bounds = [float('inf') if t.get('up_to') is None else _minor(t['up_to'], exponent) for t in tiers]
+        self.rates = np.array([float(t.get('rate', 0.0)) for t in tiers])
+        self.flats = np.array([_minor(t.get('flat', 0.0), exponent) for t in tiers])
+        self.min_fees = np.array([_minor(t.get('min_fee', 0.0), exponent) for t in tiers])
+        self.max_fees = np.array([_minor(t.get('max_fee', float('inf')), exponent) for t in tiers])
+        self._bounds = np.array(self.bounds)
+
+    def quote(self, units):
+        """Fee in minor units for a single amount in minor units"""
+        i = bisect_left(self.bounds, units)
+        fee = np.floor(units * self.rates[i] + self.flats[i] + 0.5)
+        return int(min(max(fee, self.min_fees[i]), self.max_fees[i]))
+
+    def quote_many(self, units):
+        """Fees in minor units for an array of minor-unit amounts in one vectorized pass"""
+        i = np.searchsorted(self._bounds, units, side='left')
+        fees = np.floor(units * self.rates[i] + self.flats[i] + 0.5)
+        return np.minimum(np.maximum(fees, self.min_fees[i]), self.max_fees[i]).astype(np.int64)
+
+
+class FeeEngine:
+    """Compiled set of fee tables, one per rule and currency exponent"""
+
+    EXPONENTS = sorted(set(CURRENCY_EXPONENTS.values()) | {DEFAULT_EXPONENT})
+
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.tables = {}
+        for rule in rules:
+            key = (
+                (rule.get('segment') or None) and rule['segment'].lower(),
+                (rule.get('corridor') or None) and rule['corridor'].lower()
+            )
+            self.tables[key] = {exponent: FeeTable(rule['tiers'], exponent) for exponent in self.EXPONENTS}
+
+        if (None, None) not in self.tables:
+            raise ValueError('A fee schedule needs a default rule')
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Compile the fee schedule configured for an app
+
+        Args:
+            config (dict): Flask app config
+
+        Returns:
+            FeeEngine: Compiled engine
+        """
+        # Stat before reading, so a write in between is picked up on the next check
+        version = schedule_version(config)
+        path = config.get('FEE_SCHEDULE_PATH')
+        if path:
+            with open(path, 'r', encoding='utf-8') as fh:
+                rules = json.load(fh)
+        else:
+            rules = [{'tiers': [{'rate': config.get('TRANSACTION_FEE_RATE', 0.015)}]}]
+        return cls(rules, version)
+
+    def table_for(self, segment=None, corridor=None, currency=None):
+        """Most specific table for a segment and corridor, in a currency's minor units"""
+        segment = segment.lower() if segment else None
+        exponent = exponent_for(currency)
+        for key in ((segment, corridor), (segment, None), (None, corridor)):
+            if key in self.tables:
+                return self.tables[key][exponent]
+        return self.tables[(None, None)][exponent]
+
+    def quote(self, amount, segment=None, corridor=None):
+        """
+        Quote the fee for one amount
+
+        Args:
+            amount (Money): Transaction amount
+            segment (str): Sender's customer segment
+            corridor (str): Corridor key from corridor_for()
+
+        Returns:
+            Money: Fee
+        """
+        table = self.table_for(segment, corridor, amount.currency)
+        return Money(table.quote(amount.units), amount.currency)
+
+    def quote_many(self, amounts, segment=None, corridors=None, currency=None):
+        """
+        Quote fees for many amounts from one sender
+
+        Items are grouped by table and each group is priced in a single
+        vectorized pass.
+
+        Args:
+            amounts (list): Transaction amounts in minor units
+            segment (str): Sender's customer segment
+            corridors (list): Corridor key per amount (or None)
+            currency (str): Sender's currency, which the amounts are in
+
+        Returns:
+            list: Fees in minor units, in input order
+        """
+        amounts = np.asarray(amounts, dtype=np.int64)
+        if corridors is None:
+            corridors = [None] * len(amounts)
+
+        groups = {}
+        for i, corridor in enumerate(corridors):
+            groups.setdefault(id(self.table_for(segment, corridor, currency)), []).append(i)
+
+        fees = np.zeros(len(amounts), dtype=np.int64)
+        for indices in groups.values():
+            indices = np.array(indices)
+            table = self.table_for(segment, corridors[indices[0]], currency)
+            fees[indices] = table.quote_many(amounts[indices])
+        return fees.tolist()
+
+
+def schedule_version(config):
+    """
+    Identify the configured fee schedule's contents
+
+    Args:
+        config (dict): Flask app config
+
+    Returns:
+        tuple: (path, mtime_ns, size), or the flat rate without a schedule file
+    """
+    path = config.get('FEE_SCHEDULE_PATH')
+    if not path:
+        return (None, config.get('TRANSACTION_FEE_RATE', 0.015))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def get_fee_engine():
+    """
+    Get the compiled fee engine, compiling it on first use
+
+    Once the engine is FEE_REFRESH_SECONDS old, one thread checks the
+    schedule's version and recompiles it if it changed; the others keep
+    quoting from the current engine meanwhile.
+    """
+    global _engine
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = FeeEngine.from_config(current_app.config)
+            return _engine
+
+    if time.monotonic() - engine.checked_at < current_app.config.get('FEE_REFRESH_SECONDS', 60):
+        return engine
+    if not _engine_lock.acquire(blocking=False):
+        return engine
+    try:
+        if _engine is engine:
+            if schedule_version(current_app.config) != engine.version:
+                try:
+                    _engine = FeeEngine.from_config(current_app.config)
+                except (OSError, ArithmeticError, ValueError, KeyError, TypeError) as e:
+                    current_app.logger.warning('Fee schedule reload failed, keeping the old one: %s', e)
+            engine.checked_at = time.monotonic()
+        return _engine
+    finally:
+        _engine_lock.release()
+
+
+def reload_fee_engine():
+    """
+    Recompile the fee schedule and swap it in atomically
+
+    Returns:
+        FeeEngine: The new engine
+    """
+    global _engine
+    engine = FeeEngine.from_config(current_app.config)
+    with _engine_lock:
+        _engine = engine
+    return engine
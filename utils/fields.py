@@ -0,0 +1,58 @@
+"""
+Sparse fieldsets
+
+`?fields=id,amount,created_at` limits both the keys a handler returns and
+the columns it loads from the database.
+"""
+from flask import request
+from sqlalchemy.orm import load_only
+
+
+def parse_fields(model, extra=()):
+    """
+    Read the `fields` query parameter for a model
+    
+    Args:
+        model: Model whose serializers define the valid fields
+        extra (iterable): Additional computed fields the handler supports
+    
+    Returns:
+        set: Requested fields, or None for all fields
+    
+    Raises:
+        ValueError: If an unknown field is requested
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    
+    fields = {f.strip() for f in raw.split(',') if f.strip()}
+    unknown = fields - set(model.serializers) - set(extra)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    return fields
+
+
+def sparse(query, model, fields, required=()):
+    """
+    Restrict a query to the columns needed for the requested fields
+    
+    Args:
+        query: Query over `model`
+        model: Queried model
+        fields (set): Requested fields, or None for all
+        required (iterable): Fields the handler needs regardless
+    
+    Returns:
+        Query: Query with a load_only() option applied
+    """
+    if fields is None:
+        return query
+    return query.options(load_only(*model.columns_for(set(fields) | set(required))))
+
+
+def pick(data, fields):
+    """Drop keys that were not requested"""
+    if fields is None:
+        return data
+    return {k: v for k, v in data.items() if k in fields}
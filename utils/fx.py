@@ -0,0 +1,233 @@
+"""
+Foreign exchange rates
+
+Rates live in the fx_rates table as the amount of each currency worth one
+FX_PIVOT_CURRENCY. They are compiled into an immutable FxSnapshot with every
+cross rate precomputed, and the module-level snapshot is swapped atomically
+on reload, so quoting and converting never touch the database. Each worker
+reloads every FX_REFRESH_SECONDS, one thread at a time while the rest keep
+using the old snapshot, and straight away after an admin changes the rates
+through it.
+
+Rates are exact decimals with RATE_PLACES digits, stored as integers scaled
+by RATE_SCALE (see utils.money).
+"""
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from types import MappingProxyType
+
+import numpy as np
+from flask import current_app
+
+from __init__ import db
+from models import FxRate
+from utils.money import CURRENCY_EXPONENTS, DEFAULT_CURRENCY, RATE_PLACES, RATE_SCALE, Money, exponent_for
+
+_QUANTUM = Decimal(1).scaleb(-RATE_PLACES)
+
+# Wallets default to the local 'KSh' label for KES
+ALIASES = {'KSH': 'KES'}
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def normalize_currency(code):
+    """ISO code for a currency label ('KSh' -> 'KES')"""
+    code = (code or DEFAULT_CURRENCY).strip().upper()
+    return ALIASES.get(code, code)
+
+
+def same_currency(a, b):
+    return normalize_currency(a) == normalize_currency(b)
+
+
+def rate_to_scaled(rate):
+    """Decimal rate -> stored integer"""
+    return int((Decimal(str(rate)) * RATE_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def rate_from_scaled(value):
+    """Stored integer -> Decimal rate"""
+    return None if value is None else Decimal(int(value)).scaleb(-RATE_PLACES)
+
+
+class FxSnapshot:
+    """Immutable set of exchange rates with all cross rates precomputed"""
+
+    __slots__ = ('pivot', 'rates', 'cross', 'loaded_at')
+
+    def __init__(self, pivot, rates):
+        """
+        Args:
+            pivot (str): Currency the rates are quoted against
+            rates (dict): Currency -> amount of it worth one pivot
+        """
+        pivot = normalize_currency(pivot)
+        units = {pivot: Decimal(1)}
+        for currency, rate in rates.items():
+            rate = Decimal(str(rate))
+            if not rate.is_finite() or rate <= 0:
+                raise ValueError(f'Invalid rate for {currency}')
+            units[normalize_currency(currency)] = rate
+
+        # One unit of `source` buys units[target] / units[source] of `target`
+        cross = {
+            (source, target): (units[target] / units[source]).quantize(_QUANTUM, rounding=ROUND_HALF_UP)
+            for source in units for target in units
+        }
+        self.pivot = pivot
+        self.rates = MappingProxyType(units)
+        self.cross = MappingProxyType(cross)
+        self.loaded_at = time.monotonic()
+
+    def rate(self, source, target):
+        """
+        Rate from one currency to another
+
+        Raises:
+            ValueError: If either currency has no rate
+        """
+        key = (normalize_currency(source), normalize_currency(target))
+        if key[0] == key[1]:
+            return Decimal(1)
+        try:
+            return self.cross[key]
+        except KeyError:
+            raise ValueError(f'No exchange rate for {key[0]} -> {key[1]}')
+
+    def convert(self, amount, target):
+        """
+        Convert an amount, rounding half up to the target's minor unit
+
+        Args:
+            amount (Money): Amount to convert
+            target (str): Target currency label
+
+        Returns:
+            tuple: (Money in target, Decimal rate used)
+        """
+        rate = self.rate(amount.currency, target)
+        shift = exponent_for(target) - exponent_for(amount.currency)
+        units = (Decimal(amount.units) * rate).scaleb(shift).to_integral_value(rounding=ROUND_HALF_UP)
+        return Money(int(units), target), rate
+
+    def convert_many(self, units, currencies, target):
+        """
+        Convert many minor-unit amounts to one currency, for reporting
+
+        Amounts are grouped by currency and each group is converted in one
+        vectorized pass (float64, so totals beyond 2**53 minor units lose
+        precision).
+
+        Args:
+            units (list): Amounts in minor units
+            currencies (list): Currency label of each amount
+            target (str): Target currency label
+
+        Returns:
+            ndarray: int64 amounts in the target's minor units
+
+        Raises:
+            ValueError: If a currency has no rate
+        """
+        units = np.asarray(units, dtype=np.int64)
+        currencies = np.asarray(currencies, dtype=object)
+        converted = np.zeros(len(units), dtype=np.int64)
+        for currency in set(currencies.tolist()):
+            mask = currencies == currency
+            factor = float(self.rate(currency, target).scaleb(exponent_for(target) - exponent_for(currency)))
+            converted[mask] = np.floor(units[mask] * factor + 0.5).astype(np.int64)
+        return converted
+
+    def to_dict(self):
+        return {
+            'pivot': self.pivot,
+            'rates': {currency: float(rate) for currency, rate in sorted(self.rates.items())}
+        }
+
+
+def supported_currency(code):
+    """Whether wallets may hold a currency"""
+    return code in CURRENCY_EXPONENTS
+
+
+def load_fx_snapshot(config):
+    """Build a snapshot from the fx_rates table"""
+    rows = db.session.query(FxRate.currency, FxRate.rate).all()
+    return FxSnapshot(
+        config.get('FX_PIVOT_CURRENCY', 'USD'),
+        {currency: rate_from_scaled(rate) for currency, rate in rows}
+    )
+
+
+def reload_fx_snapshot():
+    """
+    Reload the rates and swap the new snapshot in atomically
+
+    Returns:
+        FxSnapshot: The new snapshot
+    """
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = load_fx_snapshot(current_app.config)
+        return _snapshot
+
+
+def get_fx_snapshot():
+    """
+    Current snapshot, refreshed once it is FX_REFRESH_SECONDS old
+
+    A single thread reloads an expired snapshot while the others keep
+    serving the old one; only the very first load waits.
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = load_fx_snapshot(current_app.config)
+            return _snapshot
+
+    if time.monotonic() - snapshot.loaded_at < current_app.config.get('FX_REFRESH_SECONDS', 60):
+        return snapshot
+    if not _snapshot_lock.acquire(blocking=False):
+        return snapshot
+    try:
+        # Another thread may have refreshed it since we looked
+        if _snapshot is snapshot:
+            _snapshot = load_fx_snapshot(current_app.config)
+        return _snapshot
+    finally:
+        _snapshot_lock.release()
+
+
+def set_fx_rates(rates):
+    """
+    Insert or update rates against the pivot currency
+
+    The caller commits, then calls reload_fx_snapshot().
+
+    Args:
+        rates (dict): Currency -> amount of it worth one pivot
+
+    Raises:
+        ValueError: If a currency or rate is invalid
+    """
+    pivot = normalize_currency(current_app.config.get('FX_PIVOT_CURRENCY', 'USD'))
+    FxSnapshot(pivot, rates)  # validates
+
+    existing = {r.currency: r for r in FxRate.query.filter(FxRate.currency.in_(
+        [normalize_currency(c) for c in rates])).all()}
+    for currency, rate in rates.items():
+        currency = normalize_currency(currency)
+        if currency == pivot:
+            raise ValueError(f'{pivot} is the pivot currency')
+        if not supported_currency(currency):
+            raise ValueError(f'Unsupported currency {currency}')
+        row = existing.get(currency)
+        if row is None:
+            db.session.add(FxRate(currency=currency, rate=rate_to_scaled(rate)))
+        else:
+            row.rate = rate_to_scaled(rate)
@@ -23,18 +23,25 @@ def generate_unique_id(prefix, length=10):
     return f"{prefix}-{random_part}"
 
 
-def calculate_fee(amount, fee_rate=0.015):
+def calculate_fee(amount, fee_rate=None, segment=None, corridor=None):
     """
     Calculate transaction fee
     
     Args:
-        amount (float): Transaction amount
-        fee_rate (float): Fee rate (default 1.5%)
+        amount (Money): Transaction amount
+        fee_rate (float): Flat fee rate; if omitted the configured fee
+            schedule is used (see utils.fees)
+        segment (str): Sender's customer segment
+        corridor (str): Corridor key from utils.fees.corridor_for()
     
     Returns:
-        float: Calculated fee rounded to 2 decimal places
+        Money: Calculated fee, rounded half up to a whole minor unit
     """
-    return round(amount * fee_rate, 2)
+    if fee_rate is not None:
+        return amount.scale(fee_rate)
+    
+    from utils.fees import get_fee_engine
+    return get_fee_engine().quote(amount, segment=segment, corridor=corridor)
 
 
 def validate_email(email):
@@ -195,4 +202,9 @@ class InsufficientFundsError(Exception):
 
 class UnauthorizedError(Exception):
     """Custom unauthorized error"""
+    pass
+
+
+class NotFoundError(Exception):
+    """Custom not found error"""
     pass
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""
+Schema migrations
+
+Versioned scripts live in migrations/ as NNNN_description.py, each with an
+`upgrade(op)` function taking an Operations object. Applied versions are
+recorded in the schema_migrations table. Every operation checks the live
+schema first, so a script is a no-op on a database that already has its
+change, and a fresh database is built with create_all() and stamped with
+every version instead of replaying them.
+
+Scripts that set ONLINE = True run outside a transaction, so their indexes
+are built with CREATE INDEX CONCURRENTLY on PostgreSQL and do not block
+writes while they build.
+"""
+import importlib.util
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+FILENAME_RE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', String(20), primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+class Operations:
+    """Schema operations available to a migration script"""
+
+    def __init__(self, connection, online=False):
+        self.connection = connection
+        self.dialect = connection.dialect.name
+        self.online = online
+
+    def has_table(self, table):
+        return inspect(self.connection).has_table(table)
+
+    def has_column(self, table, column):
+        return any(c['name'] == column for c in inspect(self.connection).get_columns(table))
+
+    def has_index(self, table, name):
+        return any(i['name'] == name for i in inspect(self.connection).get_indexes(table))
+
+    def create_table(self, table):
+        """Create a table (a SQLAlchemy Table) if it does not exist"""
+        table.create(self.connection, checkfirst=True)
+
+    def add_column(self, table, column):
+        """
+        Add a column (an unattached SQLAlchemy Column) if it does not exist
+
+        Give the column a server_default rather than a Python default so
+        existing rows get a value.
+        """
+        if self.has_column(table, column.name):
+            return
+        Table(table, MetaData(), column)
+        ddl = CreateColumn(column).compile(dialect=self.connection.dialect)
+        self.connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {ddl}'))
+
+    def create_index(self, name, table, columns, unique=False):
+        """
+        Create an index if it does not exist, concurrently where supported
+
+        A column is a name, or a function of the reflected table returning
+        an expression, e.g. `lambda t: func.lower(t.c.email)`.
+        """
+        if self.has_index(table, name):
+            return
+        reflected = Table(table, MetaData(), autoload_with=self.connection)
+        index = Index(
+            name, *[c(reflected) if callable(c) else reflected.c[c] for c in columns], unique=unique,
+            postgresql_concurrently=self.online and self.dialect == 'postgresql'
+        )
+        index.create(self.connection)
+
+    def drop_index(self, name, table):
+        """Drop an index if it exists"""
+        if not self.has_index(table, name):
+            return
+        if self.dialect == 'mysql':
+            self.connection.execute(text(f'DROP INDEX {name} ON {table}'))
+        elif self.online and self.dialect == 'postgresql':
+            self.connection.execute(text(f'DROP INDEX CONCURRENTLY {name}'))
+        else:
+            self.connection.execute(text(f'DROP INDEX {name}'))
+
+    def alter_column_types(self, table, columns, nullable=None):
+        """
+        Change column types, converting existing values
+
+        Columns that already have the new type are skipped. PostgreSQL
+        converts in place with ALTER COLUMN ... USING; MySQL widens to DOUBLE,
+        rewrites the values and then changes the type; SQLite cannot alter a
+        column, so the table is rebuilt under a temporary name, filled with
+        the converted rows and renamed back, and its indexes are recreated.
+
+        Args:
+            table (str): Table name
+            columns (dict): Column name -> (new SQLAlchemy type, SQL
+                expression over the old values)
+            nullable (bool): Also set the columns' nullability (default:
+                leave it)
+        """
+        reflected = Table(table, MetaData(), autoload_with=self.connection)
+        columns = {name: spec for name, spec in columns.items()
+                   if not isinstance(reflected.c[name].type, type(spec[0]))}
+        if not columns:
+            return
+
+        dialect = self.connection.dialect
+        if self.dialect == 'postgresql':
+            clauses = []
+            for name, (type_, using) in columns.items():
+                clauses.append(f'ALTER COLUMN {name} TYPE {type_.compile(dialect=dialect)} USING {using}')
+                if nullable is not None:
+                    clauses.append(f"ALTER COLUMN {name} {'DROP' if nullable else 'SET'} NOT NULL")
+            self.connection.execute(text(f"ALTER TABLE {table} {', '.join(clauses)}"))
+        elif self.dialect == 'mysql':
+            null = '' if nullable is None else (' NULL' if nullable else ' NOT NULL')
+            for name, (type_, using) in columns.items():
+                self.connection.execute(text(f'ALTER TABLE {table} MODIFY {name} DOUBLE'))
+                self.connection.execute(text(f'UPDATE {table} SET {name} = {using}'))
+                self.connection.execute(text(
+                    f'ALTER TABLE {table} MODIFY {name} {type_.compile(dialect=dialect)}{null}'
+                ))
+        else:
+            tmp_name = f'_{table}_rebuild'
+            rebuilt = reflected.to_metadata(reflected.metadata, name=tmp_name)
+            rebuilt.indexes.clear()
+            for name, (type_, _) in columns.items():
+                rebuilt.c[name].type = type_
+                if nullable is not None:
+                    rebuilt.c[name].nullable = nullable
+            rebuilt.create(self.connection)
+
+            names = [c.name for c in reflected.columns]
+            values = [columns[n][1] if n in columns else n for n in names]
+            self.connection.execute(text(
+                f"INSERT INTO {tmp_name} ({', '.join(names)}) SELECT {', '.join(values)} FROM {table}"
+            ))
+            self.connection.execute(text(f'DROP TABLE {table}'))
+            self.connection.execute(text(f'ALTER TABLE {tmp_name} RENAME TO {table}'))
+            for index in reflected.indexes:
+                index.create(self.connection)
+
+    def execute(self, sql, params=None):
+        """Run raw SQL"""
+        return self.connection.execute(text(sql), params or {})
+
+
+def discover():
+    """
+    List migration scripts in version order
+
+    Returns:
+        list: (version, name, path) tuples
+    """
+    scripts = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = FILENAME_RE.match(filename)
+        if match:
+            scripts.append((match.group(1), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return scripts
+
+
+def _load(version, path):
+    spec = importlib.util.spec_from_file_location(f'migration_{version}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def applied_versions(engine):
+    """Versions recorded in schema_migrations"""
+    _metadata.create_all(engine)
+    with engine.connect() as conn:
+        return set(conn.scalars(select(schema_migrations.c.version)))
+
+
+def pending_migrations(engine):
+    """Scripts not yet applied, in version order"""
+    applied = applied_versions(engine)
+    return [s for s in discover() if s[0] not in applied]
+
+
+def _record(conn, version, name):
+    conn.execute(schema_migrations.insert().values(
+        version=version, name=name, applied_at=datetime.utcnow()
+    ))
+
+
+def upgrade(engine, target=None):
+    """
+    Apply pending migrations
+
+    Args:
+        engine: Engine of the database to migrate
+        target (str): Stop after this version (default: apply all)
+
+    Returns:
+        list: (version, name) of each migration applied
+    """
+    applied = []
+    for version, name, path in pending_migrations(engine):
+        if target is not None and version > target:
+            break
+        module = _load(version, path)
+        if getattr(module, 'ONLINE', False):
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                module.upgrade(Operations(conn, online=True))
+                _record(conn, version, name)
+        else:
+            with engine.begin() as conn:
+                module.upgrade(Operations(conn))
+                _record(conn, version, name)
+        applied.append((version, name))
+    return applied
+
+
+def stamp(engine):
+    """Mark every migration as applied without running it"""
+    with engine.begin() as conn:
+        done = set(conn.scalars(select(schema_migrations.c.version)))
+        for version, name, _ in discover():
+            if version not in done:
+                _record(conn, version, name)
+
+
+def init_schema(app, db):
+    """
+    Bring the primary database's schema up to date on startup
+
+    A fresh database is created from the models and stamped. An existing one
+    is migrated when MIGRATE_ON_STARTUP is set; otherwise pending migrations
+    are left for `flask db-upgrade` and logged.
+
+    Returns:
+        list: Migrations still pending
+    """
+    engine = db.engine
+    _metadata.create_all(engine)
+
+    if not inspect(engine).has_table('users'):
+        db.create_all(bind_key=None)  # replicas get their schema via replication
+        stamp(engine)
+        return []
+
+    if app.config.get('MIGRATE_ON_STARTUP'):
+        upgrade(engine)
+
+    pending = pending_migrations(engine)
+    if pending:
+        app.logger.warning(
+            'Database schema is behind by %d migration(s); run `flask db-upgrade`',
+            len(pending)
+        )
+    return pending
@@ -0,0 +1,150 @@
+"""
+Fixed-point money
+
+Amounts are stored as integers in the currency's minor unit (cents for an
+exponent of 2), so balances and SUM() aggregates are exact. Request values
+are parsed into `Money` at the edge and rendered back to major units only
+when serialized.
+"""
+from decimal import Decimal, Overflow, ROUND_HALF_UP
+from functools import total_ordering
+
+DEFAULT_CURRENCY = 'KSh'
+DEFAULT_EXPONENT = 2
+
+# Amount columns are 64-bit integers
+MAX_MINOR_UNITS = 2 ** 63 - 1
+
+# Exchange rates are stored as integers scaled by RATE_SCALE
+RATE_PLACES = 10
+RATE_SCALE = 10 ** RATE_PLACES
+
+# Digits after the decimal point, per ISO 4217 (plus the wallet default 'KSh')
+CURRENCY_EXPONENTS = {
+    'KSh': 2, 'KES': 2, 'USD': 2, 'EUR': 2, 'GBP': 2, 'TZS': 2, 'NGN': 2, 'ZAR': 2,
+    'UGX': 0, 'RWF': 0, 'JPY': 0,
+}
+
+
+def exponent_for(currency=None):
+    """Minor-unit exponent of a currency"""
+    return CURRENCY_EXPONENTS.get(currency or DEFAULT_CURRENCY, DEFAULT_EXPONENT)
+
+
+def to_minor(value, currency=None):
+    """
+    Convert a major-unit amount to integer minor units
+
+    Rounds half away from zero to the currency's precision.
+
+    Args:
+        value: int, float, str or Decimal
+        currency (str): Currency code (default: DEFAULT_CURRENCY)
+
+    Returns:
+        int: Amount in minor units
+
+    Raises:
+        ValueError: If the value is not a finite number, or does not fit an
+            amount column (MAX_MINOR_UNITS)
+    """
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            raise ValueError('Invalid amount')
+        scaled = amount.scaleb(exponent_for(currency))
+        if abs(scaled) > MAX_MINOR_UNITS:
+            raise OverflowError
+        units = int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (OverflowError, Overflow):
+        raise ValueError('Amount is too large')
+    except (ArithmeticError, TypeError, ValueError):
+        raise ValueError('Invalid amount')
+    if abs(units) > MAX_MINOR_UNITS:
+        raise ValueError('Amount is too large')
+    return units
+
+
+def from_minor(units, currency=None):
+    """
+    Convert integer minor units to a major-unit number for JSON
+
+    The division is exact to the float's shortest representation, so the
+    result prints as the amount itself (1234 -> 12.34).
+    """
+    if units is None:
+        return None
+    exponent = exponent_for(currency)
+    return int(units) / 10 ** exponent if exponent else int(units)
+
+
+@total_ordering
+class Money:
+    """An amount of one currency in integer minor units"""
+
+    __slots__ = ('units', 'currency')
+
+    def __init__(self, units, currency=None):
+        self.units = int(units)
+        self.currency = currency or DEFAULT_CURRENCY
+
+    @classmethod
+    def parse(cls, value, currency=None):
+        """
+        Build from a major-unit request value such as 12.5 or "12.50"
+
+        Raises:
+            ValueError: If the value is not a finite number
+        """
+        return cls(to_minor(value, currency), currency)
+
+    def _check(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(f'Cannot combine {self.currency} and {other.currency}')
+        return other
+
+    def __add__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.units + other.units, self.currency)
+
+    def __sub__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.units - other.units, self.currency)
+
+    def __neg__(self):
+        return Money(-self.units, self.currency)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.units == other.units and self.currency == other.currency
+
+    def __lt__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return self.units < other.units
+
+    def __hash__(self):
+        return hash((self.units, self.currency))
+
+    def __bool__(self):
+        return self.units != 0
+
+    def scale(self, rate):
+        """Multiply by a rate, rounding half up to a whole minor unit"""
+        units = (Decimal(self.units) * Decimal(str(rate))).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+        return Money(int(units), self.currency)
+
+    def to_major(self):
+        """Major-unit number for JSON"""
+        return from_minor(self.units, self.currency)
+
+    def __repr__(self):
+        return f'Money({self.to_major()} {self.currency})'
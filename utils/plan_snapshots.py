@@ -0,0 +1,258 @@
+"""
+Query plan snapshots
+
+Drives every route in a scratch SQLite database through a fixed scenario,
+records EXPLAIN QUERY PLAN for each statement a route runs, and compares
+the result with the snapshot checked in at QUERY_PLAN_SNAPSHOT_PATH. A
+statement that starts scanning a whole table its route did not scan before
+is reported as a regression.
+"""
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import event
+
+USER = {'first_name': 'Plan', 'last_name': 'User', 'email': 'plan.user@example.com',
+        'password': 'Passw0rd!', 'phone': '+254700000001'}
+OTHER = {'first_name': 'Plan', 'last_name': 'Other', 'email': 'plan.other@example.com',
+         'password': 'Passw0rd!', 'phone': '+254700000002'}
+SPARE = {'first_name': 'Plan', 'last_name': 'Spare', 'email': 'plan.spare@example.com',
+         'password': 'Passw0rd!'}
+IMPORT_CSV = 'first_name,last_name,email,password\nPlan,Import,plan.import@example.com,Passw0rd!\n'
+
+# (actor, method, path, request kwargs, values to remember from the response)
+# Paths are formatted with the values remembered so far; an actor sends the
+# remembered token_<actor>.
+SCENARIO = [
+    (None, 'POST', '/api/auth/register', {'json': USER},
+     lambda r: {'user_id': r['user']['id'], 'wallet_id': r['wallet']['id']}),
+    (None, 'POST', '/api/auth/register', {'json': OTHER},
+     lambda r: {'other_id': r['user']['id'], 'token_other': r['access_token']}),
+    (None, 'POST', '/api/auth/register', {'json': SPARE}, lambda r: {'spare_id': r['user']['id']}),
+    (None, 'POST', '/api/auth/login', {'json': {'email': USER['email'], 'password': USER['password']}},
+     lambda r: {'token_user': r['access_token'], 'token_refresh': r['refresh_token']}),
+    ('user', 'GET', '/api/auth/me', {}, None),
+    ('user', 'GET', '/api/users/profile', {}, None),
+    ('user', 'PUT', '/api/users/profile', {'json': {'country': 'Kenya'}}, None),
+    ('user', 'POST', '/api/users/change-password',
+     {'json': {'current_password': USER['password'], 'new_password': 'Passw0rd!2'}},
+     lambda r: {'token_user': r['access_token'], 'token_refresh': r['refresh_token']}),
+    ('user', 'POST', '/api/wallet/add-funds', {'json': {'amount': 500}}, None),
+    ('user', 'GET', '/api/wallet', {}, None),
+    ('user', 'POST', '/api/beneficiaries', {'json': {'name': 'Plan Other', 'email': OTHER['email'],
+                                                     'phone': OTHER['phone']}},
+     lambda r: {'beneficiary_id': r['beneficiary']['id']}),
+    ('user', 'GET', '/api/beneficiaries?q=plan', {}, None),
+    ('user', 'GET', '/api/beneficiaries/{beneficiary_id}', {}, None),
+    ('user', 'PUT', '/api/beneficiaries/{beneficiary_id}', {'json': {'relationship': 'friend'}}, None),
+    ('user', 'POST', '/api/transactions/quote', {'json': {'items': [{'amount': 50, 'receiver_id': '{other_id}'}]}}, None),
+    ('user', 'POST', '/api/transactions/send', {'json': {'beneficiary_id': '{beneficiary_id}', 'amount': 25}},
+     lambda r: {'transaction_id': r['transaction']['transaction_id']}),
+    ('user', 'POST', '/api/transactions/send', {'json': {'receiver_email': OTHER['email'], 'amount': 10}}, None),
+    ('user', 'GET', '/api/transactions?type=sent', {}, None),
+    # Deeper than the recent-history cache, so this one reads the table
+    ('user', 'GET', '/api/transactions?type=received&limit=100', {}, None),
+    ('user', 'GET', '/api/transactions/{transaction_id}', {}, None),
+    ('user', 'GET', '/api/transactions/counterparties', {}, None),
+    ('user', 'POST', '/api/scheduled-transfers',
+     {'json': {'beneficiary_id': '{beneficiary_id}', 'amount': 5, 'frequency': 'monthly'}},
+     lambda r: {'schedule_id': r['scheduled_transfer']['id']}),
+    ('user', 'GET', '/api/scheduled-transfers', {}, None),
+    ('user', 'GET', '/api/scheduled-transfers/{schedule_id}', {}, None),
+    ('user', 'DELETE', '/api/scheduled-transfers/{schedule_id}', {}, None),
+    ('user', 'GET', '/api/transactions/statement?format=csv', {}, None),
+    ('user', 'GET', '/api/transactions/statements/{last_month}', {}, None),
+    ('user', 'DELETE', '/api/beneficiaries/{beneficiary_id}', {}, None),
+    ('refresh', 'POST', '/api/auth/refresh', {},
+     lambda r: {'token_user': r['access_token'], 'token_refresh': r['refresh_token']}),
+    ('user', 'POST', '/api/auth/logout', {'json': {'refresh_token': '{token_refresh}'}}, None),
+    ('other', 'POST', '/api/auth/revoke-all', {}, None),
+    ('admin', 'GET', '/api/admin/users', {}, None),
+    ('admin', 'GET', '/api/admin/users/{user_id}', {}, None),
+    ('admin', 'PUT', '/api/admin/users/{other_id}', {'json': {'status': 'active'}}, None),
+    ('admin', 'DELETE', '/api/admin/users/{spare_id}', {}, None),
+    ('admin', 'GET', '/api/admin/deletions?status=pending', {}, None),
+    ('admin', 'POST', '/api/admin/users/import',
+     {'data': {'file': (io.BytesIO(IMPORT_CSV.encode('utf-8')), 'users.csv')},
+      'content_type': 'multipart/form-data'}, None),
+    ('admin', 'GET', '/api/admin/wallets', {}, None),
+    ('admin', 'POST', '/api/admin/wallets/{wallet_id}/adjust', {'json': {'action': 'add', 'amount': 5}}, None),
+    ('admin', 'POST', '/api/admin/wallets/adjust/batch',
+     {'json': {'items': [{'wallet_id': '{wallet_id}', 'action': 'deduct', 'amount': 1}],
+               'idempotency_key': 'plan-snapshot'}}, None),
+    ('admin', 'POST', '/api/admin/fees/reload', {}, None),
+    ('admin', 'PUT', '/api/admin/fx-rates', {'json': {'rates': {'KES': 129.5}}}, None),
+    ('admin', 'GET', '/api/admin/fx-rates', {}, None),
+    ('admin', 'GET', '/api/admin/transactions?type=transfer&min_amount=1', {}, None),
+    ('admin', 'GET', '/api/admin/transactions/export', {}, None),
+    ('admin', 'GET', '/api/admin/stats', {'headers': {'X-Profile': '1'}}, None),
+    ('admin', 'GET', '/api/admin/profiles', {}, lambda r: {'profile_id': r['profiles'][0]['id']}),
+    ('admin', 'GET', '/api/admin/profiles/{profile_id}', {}, None),
+]
+
+EXPLAINED = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+
+def _fill(value, context):
+    """Substitute remembered values into a path or JSON body"""
+    if isinstance(value, str):
+        if re.fullmatch(r'\{\w+\}', value):
+            return context[value[1:-1]]
+        return value.format(**context)
+    if isinstance(value, dict):
+        return {k: _fill(v, context) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, context) for v in value]
+    return value
+
+
+def full_scans(plan):
+    """Tables a plan reads in full rather than through an index"""
+    tables = set()
+    for step in plan:
+        match = re.match(r'SCAN (\w+)', step)
+        if match and 'USING' not in step and match.group(1) != 'CONSTANT':
+            tables.add(match.group(1))
+    return tables
+
+
+def capture_plans():
+    """
+    Run the scenario against a scratch database and explain every statement
+
+    Returns:
+        dict: {endpoint: {sql: [plan steps]}}
+    """
+    from __init__ import create_app, db
+
+    workdir = tempfile.mkdtemp(prefix='query-plans-')
+    try:
+        app = create_app('testing', {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'plans.db')}",
+            'SQLALCHEMY_BINDS': {},
+            'SQLALCHEMY_ECHO': False,
+            'ARCHIVE_DIR': os.path.join(workdir, 'archive'),
+            'STATEMENT_CACHE_DIR': os.path.join(workdir, 'statements'),
+            'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+            'IMPORT_HASH_WORKERS': 1
+        })
+        client = app.test_client()
+        now = datetime.utcnow()
+        context = {'last_month': f'{now.year - (now.month == 1)}-{(now.month - 2) % 12 + 1:02d}'}
+        plans = {}
+
+        with app.app_context():
+            engine = db.engine
+        statements = []
+
+        def on_execute(conn, cursor, statement, parameters, context_, executemany):
+            if statement.lstrip().upper().startswith(EXPLAINED):
+                statements.append((statement, parameters[0] if executemany else parameters))
+
+        event.listen(engine, 'before_cursor_execute', on_execute)
+        adapter = app.url_map.bind('localhost')
+
+        context['token_admin'] = client.post('/api/auth/login', json={
+            'email': 'admin@example.com', 'password': 'admin123'
+        }).get_json()['access_token']
+
+        for actor, method, path, kwargs, remember in SCENARIO:
+            path = _fill(path, context)
+            kwargs = dict(kwargs)
+            if 'json' in kwargs:
+                kwargs['json'] = _fill(kwargs['json'], context)
+            if actor:
+                kwargs['headers'] = {**kwargs.get('headers', {}), 'Authorization': f"Bearer {context[f'token_{actor}']}"}
+
+            del statements[:]
+            response = client.open(path, method=method, **kwargs)
+            response.get_data()
+            if response.status_code >= 400:
+                raise RuntimeError(f'{method} {path} failed with {response.status_code}: {response.get_data(as_text=True)}')
+
+            body = response.get_json(silent=True) or {}
+            if remember:
+                context.update(remember(body))
+
+            endpoint, _ = adapter.match(path.split('?')[0], method=method)
+            endpoint = f'{method} {endpoint}'
+            with engine.connect() as conn:
+                for statement, parameters in statements:
+                    sql = ' '.join(statement.split())
+                    rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+                    plans.setdefault(endpoint, {})[sql] = [row[-1] for row in rows]
+
+        event.remove(engine, 'before_cursor_execute', on_execute)
+        with app.app_context():
+            db.session.remove()
+            engine.dispose()
+        return plans
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare_plans(snapshot, current):
+    """
+    Compare captured plans with a snapshot
+
+    Args:
+        snapshot (dict): Previously recorded plans
+        current (dict): Plans from capture_plans()
+
+    Returns:
+        dict: 'regressions' (new full table scans), 'changed' (other plan
+            differences) and 'new' (statements not in the snapshot), each a
+            list of dicts with endpoint, sql, plan and, where known, the
+            snapshot plan
+    """
+    result = {'regressions': [], 'changed': [], 'new': []}
+    for endpoint, statements in sorted(current.items()):
+        before = snapshot.get(endpoint, {})
+        scanned_before = set().union(*(full_scans(p) for p in before.values())) if before else set()
+
+        for sql, plan in sorted(statements.items()):
+            entry = {'endpoint': endpoint, 'sql': sql, 'plan': plan}
+            if sql in before:
+                entry['snapshot'] = before[sql]
+                if full_scans(plan) - full_scans(before[sql]):
+                    result['regressions'].append(entry)
+                elif plan != before[sql]:
+                    result['changed'].append(entry)
+            elif full_scans(plan) - scanned_before:
+                result['regressions'].append(entry)
+            else:
+                result['new'].append(entry)
+    return result
+
+
+def load_snapshot(path):
+    """Read a snapshot file, or an empty snapshot if there is none"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def save_snapshot(path, plans):
+    """Write captured plans as the new snapshot"""
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(plans, fh, indent=2, sort_keys=True)
+        fh.write('\n')
+
+
+def uncovered_endpoints(app):
+    """Route endpoints the scenario does not exercise"""
+    adapter = app.url_map.bind('localhost')
+    covered = set()
+    for _, method, path, _, _ in SCENARIO:
+        path = re.sub(r'\{\w+\}', '1', path.split('?')[0])
+        covered.add(adapter.match(path, method=method)[0])
+    return sorted(
+        rule.endpoint for rule in app.url_map.iter_rules()
+        if rule.endpoint != 'static' and rule.endpoint not in covered
+    )
@@ -0,0 +1,280 @@
+"""
+On-demand request profiling
+
+A request is profiled when an admin sends the PROFILE_HEADER header, or when
+PROFILE_SAMPLE_RATE picks it at random. The handler runs under cProfile,
+every SQL statement it executes is timed, and the result is written to
+PROFILE_DIR as a pstats dump, flamegraph-ready collapsed stacks and a JSON
+summary. Only the newest PROFILE_MAX_ENTRIES profiles are kept. Streamed
+response bodies are produced after the handler returns and are not
+included.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_ID_RE = re.compile(r'^\d{8}T\d{12}-\d+$')
+KINDS = {'pstats': '.prof', 'collapsed': '.collapsed'}
+MAX_STACK_DEPTH = 100
+
+
+def get_profile_dir():
+    """Directory holding the profile ring"""
+    path = current_app.config.get('PROFILE_DIR', 'profiles')
+    if not os.path.isabs(path):
+        path = os.path.join(current_app.instance_path, path)
+    return path
+
+
+def profile_path(profile_id, kind):
+    """
+    Location of one artifact of a stored profile
+
+    Args:
+        profile_id (str): Profile id
+        kind (str): 'pstats', 'collapsed' or 'summary'
+
+    Raises:
+        ValueError: If the id or kind is invalid
+    """
+    if not PROFILE_ID_RE.match(profile_id or ''):
+        raise ValueError('Invalid profile id')
+    if kind != 'summary' and kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    return os.path.join(get_profile_dir(), profile_id + KINDS.get(kind, '.json'))
+
+
+def list_profiles():
+    """Summaries of stored profiles, newest first, without their SQL"""
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as fh:
+                summary = json.load(fh)
+        except (OSError, ValueError):
+            continue  # removed or half-written by another worker
+        summary.pop('sql', None)
+        profiles.append(summary)
+    return profiles
+
+
+def load_profile(profile_id):
+    """
+    Full summary of one profile, including its SQL statements
+
+    Returns:
+        dict: Summary, or None if it is not stored
+    """
+    path = profile_path(profile_id, 'summary')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def collapse_stacks(stats):
+    """
+    Turn pstats data into collapsed stacks ("a;b;c <microseconds>" lines)
+
+    cProfile only records caller/callee edges, so each function's time is
+    split across the paths that reach it in proportion to the time spent
+    along each edge.
+
+    Args:
+        stats (pstats.Stats): Profile data
+
+    Returns:
+        list: Collapsed stack lines, heaviest first
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    def label(func):
+        filename, line, name = func
+        return f'{os.path.basename(filename)}:{line}({name})' if line else name
+
+    weights = {}
+
+    def visit(func, path, share):
+        _, _, tt, ct, _ = entries[func]
+        path = path + (label(func),)
+        self_time = tt * share
+        if self_time > 0:
+            weights[path] = weights.get(path, 0) + self_time
+        if len(path) >= MAX_STACK_DEPTH or ct <= 0:
+            return
+        for callee, edge_ct in callees.get(func, ()):
+            if label(callee) in path:
+                continue  # recursion is folded into the first frame
+            callee_ct = entries[callee][3]
+            callee_share = edge_ct * share / callee_ct if callee_ct else 0
+            if callee_share * callee_ct >= 1e-6:
+                visit(callee, path, callee_share)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            visit(func, (), 1.0)
+
+    lines = [(';'.join(path), int(weight * 1e6)) for path, weight in weights.items()]
+    return [f'{path} {us}' for path, us in sorted(lines, key=lambda l: -l[1]) if us > 0]
+
+
+def _prune(directory, keep):
+    """Drop the oldest profiles beyond the ring size"""
+    ids = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for profile_id in ids[:-keep] if keep else ids:
+        for suffix in ('.json',) + tuple(KINDS.values()):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except OSError:
+                pass
+
+
+def _save(state, response):
+    """Write one request's profile to the ring"""
+    directory = get_profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.utcnow()
+    profile_id = f"{now.strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+
+    profiler = state['profiler']
+    profiler.dump_stats(os.path.join(directory, profile_id + KINDS['pstats']))
+    stats = pstats.Stats(profiler)
+    with open(os.path.join(directory, profile_id + KINDS['collapsed']), 'w', encoding='utf-8') as fh:
+        fh.write('\n'.join(collapse_stacks(stats)) + '\n')
+
+    sql = state['sql']
+    summary = {
+        'id': profile_id,
+        'created_at': now.isoformat(),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'reason': state['reason'],
+        'user_id': state['user_id'],
+        'duration_ms': round((time.perf_counter() - state['started']) * 1000, 3),
+        'function_calls': stats.total_calls,
+        'sql_count': len(sql),
+        'sql_ms': round(sum(s['duration_ms'] for s in sql), 3),
+        'sql': sql
+    }
+    # Write the summary last: its presence marks the profile complete
+    tmp_path = os.path.join(directory, f'{profile_id}.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(summary, fh)
+    os.replace(tmp_path, os.path.join(directory, profile_id + '.json'))
+
+    _prune(directory, current_app.config.get('PROFILE_MAX_ENTRIES', 50))
+    return profile_id
+
+
+def _requesting_admin():
+    """Id of the admin making this request, if it is one"""
+    from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+    from models import User
+
+    try:
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        return None
+    user_id = get_jwt_identity()
+    if user_id is None:
+        return None
+    user = User.query.get(user_id)
+    return user.id if user is not None and user.role == 'admin' else None
+
+
+def _active_state():
+    from flask import has_request_context
+    return g.get('_profile') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_state() is not None:
+        conn.info.setdefault('_profile_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = _active_state()
+    started = conn.info.get('_profile_started')
+    if state is None or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if len(state['sql']) < current_app.config.get('PROFILE_MAX_SQL', 500):
+        state['sql'].append({
+            'statement': ' '.join(statement.split()),
+            'duration_ms': round(elapsed * 1000, 3),
+            'executemany': executemany
+        })
+
+
+def init_profiling(app):
+    """Register the profiling hooks on an app"""
+
+    @app.before_request
+    def start_profile():
+        if not app.config.get('PROFILE_ENABLED', True):
+            return
+
+        reason = user_id = None
+        if request.headers.get(app.config.get('PROFILE_HEADER', 'X-Profile')):
+            user_id = _requesting_admin()
+            if user_id is not None:
+                reason = 'requested'
+        if reason is None and random.random() < app.config.get('PROFILE_SAMPLE_RATE', 0.0):
+            reason = 'sampled'
+        if reason is None:
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # another profiler is already active in this thread
+        g._profile = {
+            'profiler': profiler,
+            'reason': reason,
+            'user_id': user_id,
+            'started': time.perf_counter(),
+            'sql': []
+        }
+
+    @app.after_request
+    def finish_profile(response):
+        state = g.pop('_profile', None)
+        if state is None:
+            return response
+        state['profiler'].disable()
+        try:
+            response.headers['X-Profile-Id'] = _save(state, response)
+        except OSError as e:
+            app.logger.warning('Could not store request profile: %s', e)
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        # after_request does not run when the handler raised
+        state = g.pop('_profile', None)
+        if state is not None:
+            state['profiler'].disable()
@@ -0,0 +1,157 @@
+"""
+Per-endpoint SQL statement budgets
+
+Each route declares how many statements its handler may run:
+
+    @bp.route('/<string:transaction_id>', methods=['GET'])
+    @jwt_required()
+    @query_budget(2)
+    @read_only
+    def get_transaction(transaction_id): ...
+
+or one budget per method, e.g. @query_budget({'GET': 2, 'POST': 5}), or a
+callable for handlers whose work grows with the request, evaluated once the
+handler has returned. Statements are counted on every engine while the
+handler runs; those of the authentication decorators above it, and those
+run with the execution option query_budget=False (e.g. replica health
+checks), are not.
+
+A handler that returns a streamed response does its work while the body is
+sent, after it has returned. Those routes also declare a `stream` budget:
+the most statements the body may run before each chunk it yields (and after
+the last one), e.g. @query_budget(0, stream=1) for an export that reads its
+rows through one cursor. Counting per chunk keeps the budget fixed
+however long the stream is, while an N+1 inside it still shows up.
+
+A handler or stream that goes over its budget is logged as a warning, or
+raises QueryBudgetExceeded when QUERY_BUDGET_ENFORCE is set (as in testing,
+so the plan-snapshot scenario fails on it). The budget is kept on the view
+function, so `unbudgeted_endpoints` can list routes that declare none.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.wrappers import Response
+
+# Statements counted for the streamed body being iterated, as a one-item list
+_stream_count = ContextVar('query_budget_stream_count', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """A handler ran more statements than its budget allows"""
+    pass
+
+
+def query_budget(statements, stream=None):
+    """
+    Decorator declaring the most statements a handler may run
+
+    Place it below the authentication decorators.
+
+    Args:
+        statements (int, dict or callable): Budget for every method; method
+            -> budget, where a method missing from the dict is not checked;
+            or a callable returning the budget of the current request
+        stream (int or callable): Budget per chunk of a streamed response
+            body; required for handlers that stream one
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            outer = g.get('_query_count')
+            g._query_count = 0
+            try:
+                response = fn(*args, **kwargs)
+                count = g._query_count
+            finally:
+                g._query_count = outer
+            budget = _budget_for(statements)
+            try:
+                if budget is not None and count > budget:
+                    _over_budget(count, budget)
+                # Files sent straight from disk (send_file) run no SQL
+                if isinstance(response, Response) and response.is_streamed and not response.direct_passthrough:
+                    if stream is None:
+                        _report(f'{_label()} streams its response but declares no stream budget')
+                    else:
+                        response.response = _counted_stream(response.response, _budget_for(stream), _label())
+            except QueryBudgetExceeded:
+                # Release a body that will never be sent (and its request context)
+                if isinstance(response, Response):
+                    response.close()
+                raise
+            return response
+        wrapper.query_budget = statements
+        wrapper.stream_budget = stream
+        return wrapper
+    return decorator
+
+
+def _budget_for(statements):
+    if isinstance(statements, dict):
+        return statements.get(request.method)
+    if callable(statements):
+        return statements()
+    return statements
+
+
+def _label():
+    return f'{request.method} {request.endpoint}'
+
+
+def _over_budget(count, budget, label=None, app=None):
+    _report(f'{label or _label()} ran {count} SQL statements, budget {budget}', app)
+
+
+def _report(message, app=None):
+    app = app or current_app
+    if app.config.get('QUERY_BUDGET_ENFORCE', False):
+        raise QueryBudgetExceeded(message)
+    app.logger.warning(message)
+
+
+def _counted_stream(chunks, budget, label):
+    """Iterate a response body, checking the statements run for each chunk"""
+    app = current_app._get_current_object()
+    counter = [0]
+    iterator = iter(chunks)
+    try:
+        while True:
+            token = _stream_count.set(counter)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _stream_count.reset(token)
+            if counter[0] > budget:
+                _over_budget(counter[0], budget, f'{label} stream', app)
+            counter[0] = 0
+            yield chunk
+        if counter[0] > budget:
+            _over_budget(counter[0], budget, f'{label} stream', app)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def unbudgeted_endpoints(app):
+    """Endpoints of the API blueprints without a query budget"""
+    return sorted(
+        endpoint for endpoint, view in app.view_functions.items()
+        if '.' in endpoint and getattr(view, 'query_budget', None) is None
+    )
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if not conn.get_execution_options().get('query_budget', True):
+        return
+    counter = _stream_count.get()
+    if counter is not None:
+        counter[0] += 1
+    elif has_request_context() and g.get('_query_count') is not None:
+        g._query_count += 1
@@ -0,0 +1,264 @@
+"""
+Recent transaction history cache
+
+Most calls to GET /api/transactions ask for the newest page. Each worker
+keeps, for up to RECENT_HISTORY_USERS users (least recently used first out),
+a ring buffer of the user's newest RECENT_HISTORY_SIZE serialized
+transactions and the names of everyone in them, so that page and its
+type=sent|received views are served without the history query, the names
+query or serialization.
+
+A buffer is stamped with the version (balance, updated_at) of the user's
+wallet it was built against. Every money movement updates the wallet, so a
+single indexed lookup of the wallet row tells whether the buffer is still
+current, whichever worker or process (e.g. the scheduled-transfer runner)
+made the change. Transfers and top-ups made by this worker are pushed into
+both parties' buffers when their session commits, moving the stamp along
+instead of throwing the buffer away. Name changes drop the buffers showing
+the name in this worker; other workers rebuild theirs after
+RECENT_HISTORY_TTL_SECONDS.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import current_app
+from sqlalchemy import event
+
+from __init__ import db
+from models import Transaction, User, Wallet
+from utils.archive import has_archive
+from utils.db_routing import RoutingSession
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def wallet_version(wallet):
+    """Version of a wallet as held in memory"""
+    return (wallet.balance, wallet.updated_at)
+
+
+class _Buffer:
+    """One user's newest transactions, newest first"""
+
+    __slots__ = ('entries', 'names', 'version', 'complete', 'loaded_at')
+
+    def __init__(self, entries, names, version, complete, depth):
+        self.entries = deque(entries, maxlen=depth)
+        self.names = names
+        self.version = version
+        self.complete = complete  # holds the user's whole history
+        self.loaded_at = time.monotonic()
+
+    def page(self, user_id, transaction_type, limit, offset):
+        """A page of entries with names, or None if the buffer cannot tell"""
+        if transaction_type == 'sent':
+            matching = [e for e in self.entries if e['sender_id'] == user_id]
+        elif transaction_type == 'received':
+            matching = [e for e in self.entries if e['receiver_id'] == user_id]
+        else:
+            matching = self.entries
+        if len(matching) < offset + limit and not self.complete:
+            return None
+
+        names = self.names
+        return [
+            dict(e, sender_name=names.get(e['sender_id']), receiver_name=names.get(e['receiver_id']))
+            for e in list(matching)[offset:offset + limit]
+        ]
+
+
+class RecentHistoryCache:
+    """Bounded LRU of per-user history buffers"""
+
+    def __init__(self, capacity, depth, ttl):
+        self.capacity = capacity
+        self.depth = depth
+        self.ttl = ttl
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(('hits', 'loads', 'fallbacks', 'pushes', 'invalidations', 'evictions'), 0)
+
+    def get(self, user_id, version):
+        """Buffer for a user if it matches the wallet version and has not expired"""
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                return None
+            if buffer.version != version or time.monotonic() - buffer.loaded_at >= self.ttl:
+                del self._buffers[user_id]
+                return None
+            self._buffers.move_to_end(user_id)
+            return buffer
+
+    def put(self, user_id, buffer):
+        with self._lock:
+            self._buffers[user_id] = buffer
+            self._buffers.move_to_end(user_id)
+            while len(self._buffers) > self.capacity:
+                self._buffers.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def push(self, user_id, entry, names, previous, version):
+        """
+        Add a committed transaction to a user's buffer, if one is cached
+
+        The buffer is only extended if it was current just before this
+        transaction; otherwise it missed something and is dropped.
+        """
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                return
+            if buffer.version != previous:
+                del self._buffers[user_id]
+                self.stats['invalidations'] += 1
+                return
+            if len(buffer.entries) == buffer.entries.maxlen:
+                buffer.complete = False
+            buffer.entries.appendleft(entry)
+            buffer.names.update(names)
+            buffer.version = version
+            self.stats['pushes'] += 1
+
+    def forget(self, user_id):
+        """Drop a user's buffer and every buffer that shows their name"""
+        with self._lock:
+            stale = [uid for uid, b in self._buffers.items() if uid == user_id or user_id in b.names]
+            for uid in stale:
+                del self._buffers[uid]
+            self.stats['invalidations'] += len(stale)
+
+    def page(self, buffer, user_id, transaction_type, limit, offset, hit):
+        """Read a page from a buffer and count the outcome"""
+        with self._lock:
+            page = buffer.page(user_id, transaction_type, limit, offset)
+            self.stats['fallbacks' if page is None else 'hits' if hit else 'loads'] += 1
+        return page
+
+    def snapshot(self):
+        """Counters and hit rate for this worker"""
+        with self._lock:
+            stats = dict(self.stats, users=len(self._buffers), capacity=self.capacity, depth=self.depth)
+        served = stats['hits'] + stats['loads'] + stats['fallbacks']
+        stats['hit_rate'] = round(stats['hits'] / served, 4) if served else None
+        return stats
+
+
+def get_recent_history():
+    """Get this worker's cache, creating it on first use; None if disabled"""
+    global _cache
+    if _cache is None:
+        config = current_app.config
+        if config.get('RECENT_HISTORY_SIZE', 50) <= 0:
+            return None
+        with _cache_lock:
+            if _cache is None:
+                _cache = RecentHistoryCache(
+                    config.get('RECENT_HISTORY_USERS', 1000),
+                    config.get('RECENT_HISTORY_SIZE', 50),
+                    config.get('RECENT_HISTORY_TTL_SECONDS', 300)
+                )
+    return _cache
+
+
+def _load(user_id, version, depth):
+    """Build a user's buffer from the newest rows"""
+    transactions = Transaction.query.filter(
+        (Transaction.sender_id == user_id) | (Transaction.receiver_id == user_id)
+    ).order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(depth).all()
+    entries = [t.to_dict() for t in transactions]
+
+    user_ids = {user_id}
+    for e in entries:
+        user_ids.update((e['sender_id'], e['receiver_id']))
+    names = {
+        u.id: f"{u.first_name} {u.last_name}"
+        for u in User.query.with_entities(User.id, User.first_name, User.last_name)
+        .filter(User.id.in_(user_ids)).all()
+    }
+
+    complete = len(entries) < depth and not has_archive(user_id)
+    return _Buffer(entries, names, version, complete, depth)
+
+
+def recent_page(user_id, transaction_type, limit, offset):
+    """
+    Serve a page of a user's history from the cache
+
+    Args:
+        user_id (int): Current user
+        transaction_type (str): 'all', 'sent' or 'received'
+        limit (int): Page size
+        offset (int): Rows to skip
+
+    Returns:
+        list: Serialized transactions with sender_name/receiver_name,
+            newest first, or None if the page must come from the database
+    """
+    cache = get_recent_history()
+    if cache is None or offset + limit > cache.depth:
+        return None
+
+    # Read the version first: a write landing after it is caught next time
+    row = db.session.query(Wallet.balance, Wallet.updated_at).filter(Wallet.user_id == user_id).first()
+    if row is None:
+        return None
+    version = tuple(row)
+
+    buffer = cache.get(user_id, version)
+    hit = buffer is not None
+    if not hit:
+        buffer = _load(user_id, version, cache.depth)
+        cache.put(user_id, buffer)
+
+    return cache.page(buffer, user_id, transaction_type, limit, offset, hit)
+
+
+def stage_transaction(transaction, versions, names=None):
+    """
+    Queue a transaction for the parties' buffers once the session commits
+
+    Args:
+        transaction (Transaction): New transaction, already added
+        versions (dict): user_id -> (wallet version before, after)
+        names (dict): user_id -> display name, where known
+    """
+    if _cache is None:
+        return  # nothing cached in this process, e.g. the scheduled-transfer runner
+    db.session.info.setdefault('recent_history', []).append((transaction, versions, names or {}))
+
+
+def forget_user(user_id):
+    """Drop cached history showing a user, e.g. after a name change"""
+    cache = _cache
+    if cache is not None:
+        cache.forget(user_id)
+
+
+@event.listens_for(RoutingSession, 'after_flush_postexec')
+def _serialize_staged(session, flush_context):
+    # Serialize while the new rows are loaded; after commit they are expired
+    staged = session.info.pop('recent_history', None)
+    if staged:
+        session.info.setdefault('recent_history_ready', []).extend(
+            (t.to_dict(), versions, names) for t, versions, names in staged
+        )
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _push_committed(session):
+    ready = session.info.pop('recent_history_ready', None)
+    cache = _cache
+    if not ready or cache is None:
+        return
+    for entry, versions, names in ready:
+        for user_id, (previous, version) in versions.items():
+            cache.push(user_id, entry, names, previous, version)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _drop_staged(session):
+    session.info.pop('recent_history', None)
+    session.info.pop('recent_history_ready', None)
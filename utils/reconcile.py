@@ -0,0 +1,282 @@
+"""
+Wallet reconciliation
+
+Recomputes every wallet's expected balance from the transaction history and
+reports wallets whose stored balance has drifted from it. Transactions are
+streamed in chunks through a server-side cursor and folded into a dense
+per-user int64 array of minor units with NumPy, so memory is bounded by the
+number of users, not the number of transactions, and sums are exact.
+
+The expected balances and a watermark are saved after each run, so the next
+run only reads rows past it. Ids are allocated before commit, so on
+PostgreSQL a row can become visible after rows with higher ids. The
+watermark therefore stays behind the newest rows by RECONCILE_COMMIT_LAG_SECONDS:
+every row past it is read again by the next run, and the ids already folded
+in are saved with the state and skipped, so a late commit is still counted
+exactly once.
+"""
+import gzip
+import json
+import os
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from __init__ import db
+from models import Transaction, Wallet
+from utils.archive import get_archive_dir
+from utils.money import from_minor, to_minor
+
+STATE_FILE = 'reconcile_state.npz'
+
+# Transaction kinds by how they move money
+TRANSFER, CREDIT, DEBIT = 0, 1, 2
+CREDIT_TYPES = ('add_funds', 'adjustment_credit')
+DEBIT_TYPES = ('adjustment_debit',)
+
+
+def _kind(transaction_type):
+    if transaction_type in CREDIT_TYPES:
+        return CREDIT
+    if transaction_type in DEBIT_TYPES:
+        return DEBIT
+    return TRANSFER
+
+
+def _state_path():
+    path = current_app.config.get('RECONCILE_STATE_PATH', STATE_FILE)
+    if not os.path.isabs(path):
+        path = os.path.join(current_app.instance_path, path)
+    return path
+
+
+def load_state():
+    """
+    Load the last saved reconciliation state
+
+    Returns:
+        tuple: (expected balances array, watermark transaction id, ids past
+            the watermark already folded in)
+    """
+    path = _state_path()
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=np.int64), 0, np.zeros(0, dtype=np.int64)
+    with np.load(path) as state:
+        expected = state['expected']
+        if expected.dtype.kind == 'f':
+            # Saved before balances moved to minor units
+            expected = np.rint(expected * 100)
+        folded = state['folded'] if 'folded' in state.files else np.zeros(0, dtype=np.int64)
+        return expected.astype(np.int64), int(state['watermark']), folded.astype(np.int64)
+
+
+def save_state(expected, watermark, folded):
+    """Atomically persist expected balances, the watermark and the ids folded in past it"""
+    path = _state_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        np.savez(fh, expected=expected, watermark=np.int64(watermark), folded=np.asarray(folded, dtype=np.int64))
+    os.replace(tmp_path, path)
+
+
+def apply_chunk(expected, chunk):
+    """
+    Fold a chunk of transactions into the expected balances
+
+    Transfers credit `amount` to the receiver and debit `total_amount`
+    (amount + fee) from the sender; for a cross-currency transfer `amount`
+    is the converted amount the receiver was credited. add_funds and adjustment_credit rows
+    only credit; adjustment_debit rows only debit.
+
+    Args:
+        expected (ndarray): Expected balance per user id, in minor units
+        chunk (ndarray): int64 rows of (id, sender_id, receiver_id, amount,
+            total_amount, kind) where kind is TRANSFER, CREDIT or DEBIT
+
+    Returns:
+        ndarray: Updated expected balances (may be a larger array)
+    """
+    sender = chunk[:, 1]
+    receiver = chunk[:, 2]
+    amount = chunk[:, 3]
+    total = chunk[:, 4]
+    credit = chunk[:, 5] != DEBIT
+    debit = chunk[:, 5] != CREDIT
+
+    size = int(max(sender.max(), receiver.max())) + 1
+    if size > expected.shape[0]:
+        expected = np.concatenate([expected, np.zeros(size - expected.shape[0], dtype=np.int64)])
+
+    # bincount weights are summed as float64; add.at keeps the sums exact
+    np.add.at(expected, receiver[credit], amount[credit])
+    np.subtract.at(expected, sender[debit], total[debit])
+    return expected
+
+
+def _iter_archived_chunks(chunk_size):
+    archive_dir = get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return
+
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.endswith('.jsonl.gz'):
+            continue
+        # Retried archive batches may append a row twice to the same segment
+        seen = set()
+        rows = []
+        with gzip.open(os.path.join(archive_dir, name), 'rt', encoding='utf-8') as fh:
+            for line in fh:
+                t = json.loads(line)
+                if t['id'] in seen or t['status'] != 'completed':
+                    continue
+                seen.add(t['id'])
+                # Archived rows are serialized in major units of their currency
+                currency = t.get('currency')
+                credited = to_minor(t.get('receiver_amount', t['amount']), t.get('receiver_currency') or currency)
+                rows.append((t['id'], t['sender_id'], t['receiver_id'], credited,
+                             to_minor(t['total_amount'], currency), _kind(t['type'])))
+                if len(rows) >= chunk_size:
+                    yield np.asarray(rows, dtype=np.int64)
+                    rows = []
+        if rows:
+            yield np.asarray(rows, dtype=np.int64)
+
+
+def _iter_hot_chunks(watermark, chunk_size):
+    stmt = select(
+        Transaction.id,
+        Transaction.sender_id,
+        Transaction.receiver_id,
+        func.coalesce(Transaction.receiver_amount, Transaction.amount),
+        Transaction.total_amount,
+        case(
+            (Transaction.type.in_(CREDIT_TYPES), CREDIT),
+            (Transaction.type.in_(DEBIT_TYPES), DEBIT),
+            else_=TRANSFER
+        )
+    ).where(
+        Transaction.id > watermark,
+        Transaction.status == 'completed'
+    ).order_by(Transaction.id).execution_options(stream_results=True, yield_per=chunk_size)
+
+    result = db.session.execute(stmt)
+    for partition in result.partitions(chunk_size):
+        yield np.asarray(partition, dtype=np.int64)
+
+
+def _settled_watermark(watermark):
+    """Highest id of the rows past the watermark created before the commit-lag margin"""
+    lag = timedelta(seconds=current_app.config.get('RECONCILE_COMMIT_LAG_SECONDS', 300))
+    settled = db.session.query(func.max(Transaction.id)).filter(
+        Transaction.id > watermark,
+        Transaction.created_at <= datetime.utcnow() - lag
+    ).scalar()
+    return max(watermark, settled or 0)
+
+
+def find_drift(expected, tolerance=0, chunk_size=50000):
+    """
+    Compare stored wallet balances against expected balances
+
+    Args:
+        expected (ndarray): Expected balance per user id, in minor units
+        tolerance (float): Differences at or below this amount, in each
+            wallet's own currency, are ignored
+        chunk_size (int): Wallets read per chunk
+
+    Returns:
+        list: Drifted wallets as dicts, largest absolute drift first
+    """
+    max_user_id = db.session.query(db.func.max(Wallet.user_id)).scalar() or 0
+    if expected.shape[0] <= max_user_id:
+        expected = np.concatenate([expected, np.zeros(max_user_id + 1 - expected.shape[0], dtype=np.int64)])
+
+    stmt = select(Wallet.id, Wallet.user_id, Wallet.balance, Wallet.currency) \
+        .order_by(Wallet.id) \
+        .execution_options(stream_results=True, yield_per=chunk_size)
+
+    # The tolerance in each currency's minor units (100 KSh cents, 1 UGX shilling)
+    limits = {}
+
+    drifted = []
+    result = db.session.execute(stmt)
+    for partition in result.partitions(chunk_size):
+        rows = np.asarray([row[:3] for row in partition], dtype=np.int64)
+        currencies = [row[3] for row in partition]
+        user_ids = rows[:, 1]
+        balances = rows[:, 2]
+        for currency in set(currencies) - limits.keys():
+            limits[currency] = to_minor(tolerance, currency)
+        tolerances = np.fromiter((limits[c] for c in currencies), dtype=np.int64, count=len(currencies))
+
+        drift = balances - expected[user_ids]
+        for i in np.flatnonzero(np.abs(drift) > tolerances):
+            currency = currencies[i]
+            drifted.append({
+                'wallet_id': int(rows[i, 0]),
+                'user_id': int(user_ids[i]),
+                'currency': currency,
+                'balance': from_minor(int(balances[i]), currency),
+                'expected_balance': from_minor(int(expected[user_ids[i]]), currency),
+                'drift': from_minor(int(drift[i]), currency)
+            })
+
+    drifted.sort(key=lambda d: abs(d['drift']), reverse=True)
+    return drifted
+
+
+def reconcile(full=False, chunk_size=100000, tolerance=0):
+    """
+    Recompute expected wallet balances and report drift
+
+    Incremental runs only read hot rows past the watermark, skipping the
+    ones an earlier run already folded in; rows archived before any run
+    folded them in are picked up by a full run.
+
+    Args:
+        full (bool): Ignore the saved watermark and rebuild from the whole
+            history, including the transaction archive
+        chunk_size (int): Transactions folded in per chunk
+        tolerance (float): Drift at or below this amount, in the wallet's
+            currency, is ignored
+
+    Returns:
+        dict: Rows processed, the new watermark and the drifted wallets
+    """
+    if full:
+        expected, watermark, folded = np.zeros(0, dtype=np.int64), 0, np.zeros(0, dtype=np.int64)
+        archived = _iter_archived_chunks(chunk_size)
+    else:
+        expected, watermark, folded = load_state()
+        archived = ()
+
+    # Read before the rows, so the new watermark never passes a row the run missed
+    settled = _settled_watermark(watermark)
+
+    processed = 0
+    for chunk in archived:
+        expected = apply_chunk(expected, chunk)
+        processed += chunk.shape[0]
+
+    seen = [folded]
+    for chunk in _iter_hot_chunks(watermark, chunk_size):
+        new = chunk[~np.isin(chunk[:, 0], folded)]
+        if new.shape[0]:
+            expected = apply_chunk(expected, new)
+            processed += new.shape[0]
+        seen.append(chunk[:, 0])
+
+    # Rows past the new watermark are read again next run; remember them
+    seen = np.concatenate(seen)
+    watermark = settled
+    save_state(expected, watermark, np.unique(seen[seen > watermark]))
+
+    return {
+        'processed': processed,
+        'watermark': watermark,
+        'drift': find_drift(expected, tolerance=tolerance)
+    }
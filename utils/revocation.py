@@ -0,0 +1,221 @@
+"""
+JWT revocation
+
+Revoked tokens are written to the revoked_tokens table. Each worker keeps an
+in-memory copy: a Bloom filter and an exact set of revoked JTIs, plus a
+per-user cutoff for "revoke everything issued before" rows. The blocklist
+check only touches memory; the copy is refreshed from the table at most
+every JWT_REVOCATION_SYNC_SECONDS, so a revocation made by another worker
+takes effect within that interval (and immediately in the worker that made
+it). Each refresh reads the rows revoked since the previous one, less
+JWT_REVOCATION_COMMIT_LAG_SECONDS, so a row that commits late is still
+seen; applying a revocation twice is harmless. A full reload every
+JWT_REVOCATION_RELOAD_SECONDS drops expired entries, which a Bloom filter
+cannot remove on its own; the new copy is built to the side and swapped
+in whole, so checks keep using the old one meanwhile.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+from __init__ import db
+from models import RevokedToken
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class Revocations:
+    """One consistent copy of the revocations"""
+
+    def __init__(self, capacity):
+        self.bloom = BloomFilter(capacity)
+        self.jtis = {}  # jti -> expiry (unix seconds)
+        self.cutoffs = {}  # user_id -> tokens issued before this (unix seconds) are revoked
+
+    def apply(self, jti, user_id, revoked_at, expires_at):
+        if jti:
+            self.bloom.add(jti)
+            self.jtis[jti] = expires_at
+        else:
+            self.cutoffs[user_id] = max(self.cutoffs.get(user_id, 0), revoked_at)
+
+
+class RevocationCache:
+    """Per-worker view of the revoked_tokens table"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.state = Revocations(capacity)
+        self._local = []  # revocations made here since the last reload began
+        self.synced_at = 0.0
+        self.loaded_at = 0.0
+        self.window_start = None  # revoked_at the next sync reads from
+
+    def add(self, jti, user_id, revoked_at, expires_at):
+        """Apply a revocation made by this worker without waiting for a sync"""
+        with self._lock:
+            self.state.apply(jti, user_id, revoked_at, expires_at)
+            self._local.append((jti, user_id, revoked_at, expires_at))
+
+    def _fetch(self, since):
+        now = datetime.utcnow()
+        query = select(RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_at, RevokedToken.expires_at)
+        if since is None:
+            query = query.where(RevokedToken.expires_at > now)
+        else:
+            # By revoked_at alone, so the index on it serves the query; an
+            # expired row in the window is harmless, its tokens fail on exp
+            query = query.where(RevokedToken.revoked_at >= since)
+        return now, db.session.execute(query).all()
+
+    def sync(self, config):
+        """Fetch revocations made since the last sync, reloading periodically"""
+        now = time.monotonic()
+        if now - self.synced_at < config.get('JWT_REVOCATION_SYNC_SECONDS', 10):
+            return
+        with self._lock:
+            if now - self.synced_at < config.get('JWT_REVOCATION_SYNC_SECONDS', 10):
+                return
+            lag = timedelta(seconds=config.get('JWT_REVOCATION_COMMIT_LAG_SECONDS', 60))
+
+            if now - self.loaded_at >= config.get('JWT_REVOCATION_RELOAD_SECONDS', 3600):
+                # Checks keep using the current copy until the new one is complete
+                local, self._local = self._local, []
+                fetched_at, rows = self._fetch(None)
+                state = Revocations(self.capacity)
+                for row in rows:
+                    state.apply(row.jti, row.user_id, _timestamp(row.revoked_at), _timestamp(row.expires_at))
+                # This worker's own revocations may not be committed yet
+                for jti, user_id, revoked_at, expires_at in local:
+                    if expires_at > _timestamp(fetched_at):
+                        state.apply(jti, user_id, revoked_at, expires_at)
+                self.state = state
+                self.loaded_at = now
+            else:
+                fetched_at, rows = self._fetch(self.window_start)
+                for row in rows:
+                    self.state.apply(row.jti, row.user_id, _timestamp(row.revoked_at), _timestamp(row.expires_at))
+
+            self.window_start = fetched_at - lag
+            self.synced_at = now
+
+    def is_revoked(self, payload):
+        """Check a decoded token against the in-memory state"""
+        state = self.state
+        jti = payload.get('jti')
+        if jti and jti in state.bloom and jti in state.jtis:
+            return True
+        cutoff = state.cutoffs.get(_user_id(payload.get('sub')))
+        return cutoff is not None and payload.get('iat', 0) < cutoff
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _timestamp(value):
+    """Unix seconds of a naive UTC datetime"""
+    return int((value - datetime(1970, 1, 1)).total_seconds())
+
+
+def _user_id(identity):
+    try:
+        return int(identity)
+    except (TypeError, ValueError):
+        return identity
+
+
+def get_revocation_cache():
+    """Get this worker's revocation cache, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RevocationCache(current_app.config.get('JWT_REVOCATION_BLOOM_CAPACITY', 100000))
+    return _cache
+
+
+def revoke_token(payload):
+    """
+    Revoke one token until it expires
+
+    The caller commits.
+
+    Args:
+        payload (dict): Decoded JWT
+    """
+    user_id = _user_id(payload['sub'])
+    now = datetime.utcnow()
+    expires_at = datetime.utcfromtimestamp(payload['exp']) if payload.get('exp') else now + timedelta(days=365)
+    if RevokedToken.query.filter_by(jti=payload['jti']).first() is None:
+        db.session.add(RevokedToken(
+            jti=payload['jti'], user_id=user_id, token_type=payload.get('type'),
+            revoked_at=now, expires_at=expires_at
+        ))
+    get_revocation_cache().add(payload['jti'], user_id, _timestamp(now), _timestamp(expires_at))
+
+
+def revoke_all_tokens(user_id):
+    """
+    Revoke every token issued to a user so far
+
+    Tokens issued during the same second stay valid, so fresh tokens can be
+    handed out straight away. The caller commits.
+
+    Args:
+        user_id (int): User whose tokens are revoked
+    """
+    now = datetime.utcnow().replace(microsecond=0)
+    # Nothing issued before now outlives the longest token lifetime
+    lifetime = max(current_app.config['JWT_ACCESS_TOKEN_EXPIRES'], current_app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+    expires_at = now + lifetime
+    db.session.add(RevokedToken(user_id=user_id, revoked_at=now, expires_at=expires_at))
+    get_revocation_cache().add(None, user_id, _timestamp(now), _timestamp(expires_at))
+
+
+def purge_expired_revocations():
+    """
+    Delete revocation rows for tokens that have expired anyway
+
+    Returns:
+        int: Rows deleted
+    """
+    deleted = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete()
+    db.session.commit()
+    return deleted
+
+
+def init_revocation(jwt):
+    """Register the blocklist check on a JWTManager"""
+
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        cache = get_revocation_cache()
+        cache.sync(current_app.config)
+        return cache.is_revoked(jwt_payload)
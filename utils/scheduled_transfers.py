@@ -0,0 +1,288 @@
+"""
+Scheduled and recurring transfers
+
+A schedule pays one of the user's beneficiaries once, daily, weekly or
+monthly from start_at. Occurrences are counted from start_at (monthly ones
+keep its day of month, clamped to shorter months), so they never drift.
+
+`run_due_transfers` claims due schedules in batches with
+SELECT ... FOR UPDATE SKIP LOCKED, so several runners can share the work,
+and executes a whole batch in one database transaction. A schedule's
+transfer and the advance of its next occurrence commit together, so an
+occurrence runs exactly once even if a runner dies mid-batch.
+
+Each schedule becomes due at its nominal time plus a fixed offset within
+SCHEDULED_TRANSFER_SPREAD_SECONDS, derived from its id, so everything set
+for midnight is spread over the window instead of firing at once. After
+downtime, missed occurrences are run one after another; ones older than
+SCHEDULED_TRANSFER_CATCH_UP_HOURS are skipped rather than paid late.
+"""
+import calendar
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from __init__ import db
+from models import Beneficiary, ScheduledTransfer, User, Wallet
+from utils.helpers import InsufficientFundsError, NotFoundError
+from utils.money import Money
+from utils.transfers import execute_transfer
+
+FREQUENCIES = ('once', 'daily', 'weekly', 'monthly')
+
+
+def _add_months(when, months):
+    month = when.month - 1 + months
+    year, month = when.year + month // 12, month % 12 + 1
+    day = min(when.day, calendar.monthrange(year, month)[1])
+    return when.replace(year=year, month=month, day=day)
+
+
+def occurrence_at(start_at, frequency, n):
+    """
+    Nominal time of the n-th occurrence (0-based) of a schedule
+
+    Returns:
+        datetime: Occurrence time, or None if a one-off has no n-th run
+    """
+    if frequency == 'daily':
+        return start_at + timedelta(days=n)
+    if frequency == 'weekly':
+        return start_at + timedelta(weeks=n)
+    if frequency == 'monthly':
+        return _add_months(start_at, n)
+    return start_at if n == 0 else None
+
+
+def spread_offset(schedule_id, window):
+    """Fixed offset of a schedule within the spread window"""
+    if window <= 0:
+        return timedelta(0)
+    # Multiplicative hash: consecutive ids land far apart in the window
+    return timedelta(seconds=(schedule_id * 2654435761) % 2 ** 32 * window // 2 ** 32)
+
+
+def plan_next(schedule):
+    """Set next_run_at/due_at from the occurrence counter, completing the schedule when done"""
+    next_run_at = occurrence_at(schedule.start_at, schedule.frequency, schedule.occurrence)
+    if next_run_at is None or (schedule.end_at is not None and next_run_at > schedule.end_at):
+        schedule.status = 'completed'
+        schedule.next_run_at = schedule.due_at = None
+        return
+    schedule.next_run_at = next_run_at
+    schedule.due_at = next_run_at + spread_offset(
+        schedule.id, current_app.config.get('SCHEDULED_TRANSFER_SPREAD_SECONDS', 1800)
+    )
+
+
+def create_scheduled_transfer(user_id, data):
+    """
+    Create a schedule from a request body
+
+    The body's types have already been checked (see
+    routes.scheduled_transfer_routes.SCHEDULE_SCHEMA); this checks the
+    values against the user's wallet and the clock. The caller commits.
+
+    Args:
+        user_id (int): Owner of the schedule
+        data (dict): beneficiary_id, amount, frequency, and optional
+            start_at (datetime, default: now), end_at and note
+
+    Returns:
+        ScheduledTransfer: The new schedule
+
+    Raises:
+        ValueError: If a field is invalid
+        NotFoundError: If the user has no wallet or the beneficiary is not
+            one of theirs
+    """
+    wallet = Wallet.query.filter_by(user_id=user_id).first()
+    if wallet is None:
+        raise NotFoundError('Wallet not found')
+    amount = Money.parse(data['amount'], wallet.currency)
+    if amount.units <= 0:
+        raise ValueError('Invalid amount')
+
+    now = datetime.utcnow()
+    start_at = data.get('start_at') or now
+    if start_at < now - timedelta(minutes=1):
+        raise ValueError('start_at must not be in the past')
+    end_at = data.get('end_at')
+    if end_at is not None and end_at < start_at:
+        raise ValueError('end_at must be after start_at')
+
+    beneficiary = Beneficiary.query.filter_by(id=data.get('beneficiary_id'), user_id=user_id).first()
+    if beneficiary is None:
+        raise NotFoundError('Beneficiary not found')
+
+    schedule = ScheduledTransfer(
+        user_id=user_id,
+        beneficiary_id=beneficiary.id,
+        amount=amount.units,
+        currency=amount.currency,
+        note=data.get('note'),
+        frequency=data['frequency'],
+        start_at=start_at,
+        end_at=end_at,
+        occurrence=0,
+        status='active'
+    )
+    db.session.add(schedule)
+    db.session.flush()  # the spread offset needs the id
+    plan_next(schedule)
+    return schedule
+
+
+def cancel_scheduled_transfer(schedule):
+    """Stop a schedule; past runs are kept. The caller commits."""
+    schedule.status = 'cancelled'
+    schedule.next_run_at = schedule.due_at = None
+
+
+def _claim(now, batch_size):
+    return ScheduledTransfer.query \
+        .filter(ScheduledTransfer.status == 'active', ScheduledTransfer.due_at <= now) \
+        .order_by(ScheduledTransfer.due_at, ScheduledTransfer.id) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True) \
+        .all()
+
+
+def _receivers(schedules):
+    """Receiving user of each claimed schedule's beneficiary, in one query"""
+    ids = {s.beneficiary_id for s in schedules}
+    rows = db.session.query(Beneficiary.id, User) \
+        .join(User, func.lower(User.email) == func.lower(Beneficiary.email)) \
+        .filter(Beneficiary.id.in_(ids), User.deleted_at.is_(None)) \
+        .all()
+    return {beneficiary_id: user for beneficiary_id, user in rows}
+
+
+def _run_one(schedule, receiver, now, catch_up, counts):
+    """Execute a schedule's current occurrence and advance it"""
+    schedule.last_run_at = now
+    schedule.last_error = schedule.last_transaction_id = None
+
+    # Fast-forward past occurrences too old to catch up on
+    while schedule.status == 'active' and schedule.next_run_at < now - catch_up:
+        schedule.skipped_count += 1
+        counts['skipped'] += 1
+        schedule.last_status = 'skipped'
+        schedule.occurrence += 1
+        plan_next(schedule)
+    if schedule.status != 'active' or schedule.due_at > now:
+        return
+
+    if receiver is None:
+        schedule.last_status = 'failed'
+        schedule.last_error = 'Receiver not found'
+        schedule.failure_count += 1
+    else:
+        try:
+            # Raises before touching any balance, so nothing needs undoing
+            transaction, _, _ = execute_transfer(
+                schedule.user_id, receiver, Money(schedule.amount, schedule.currency),
+                note=schedule.note or f'Scheduled transfer #{schedule.id}'
+            )
+            schedule.last_status = 'completed'
+            schedule.last_transaction_id = transaction.transaction_id
+            schedule.run_count += 1
+        except (InsufficientFundsError, NotFoundError, ValueError) as e:
+            schedule.last_status = 'failed'
+            schedule.last_error = str(e)
+            schedule.failure_count += 1
+
+    counts[schedule.last_status] += 1
+    schedule.occurrence += 1
+    plan_next(schedule)
+
+
+def _run_batch(schedules, now, catch_up, counts):
+    receivers = _receivers(schedules)
+    for schedule in schedules:
+        _run_one(schedule, receivers.get(schedule.beneficiary_id), now, catch_up, counts)
+
+
+def run_due_transfers(now=None, batch_size=None, max_batches=None):
+    """
+    Execute every scheduled transfer that is due
+
+    A batch that fails unexpectedly (e.g. a deadlock) is rolled back and its
+    schedules are retried one per transaction; one that still fails is
+    retried after SCHEDULED_TRANSFER_RETRY_SECONDS without advancing.
+
+    Args:
+        now (datetime): Run as of this time (default: now)
+        batch_size (int): Schedules claimed per transaction
+            (default: SCHEDULED_TRANSFER_BATCH_SIZE)
+        max_batches (int): Stop after this many batches (default: until
+            nothing is due)
+
+    Returns:
+        dict: Occurrences completed, failed, skipped and errored, and the
+            number of batches
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('SCHEDULED_TRANSFER_BATCH_SIZE', 100)
+    catch_up = timedelta(hours=config.get('SCHEDULED_TRANSFER_CATCH_UP_HOURS', 72))
+    retry = timedelta(seconds=config.get('SCHEDULED_TRANSFER_RETRY_SECONDS', 300))
+    counts = {'completed': 0, 'failed': 0, 'skipped': 0, 'errors': 0, 'batches': 0}
+
+    while max_batches is None or counts['batches'] < max_batches:
+        run_at = now or datetime.utcnow()
+        schedules = _claim(run_at, batch_size)
+        if not schedules:
+            break
+        counts['batches'] += 1
+
+        batch_counts = dict.fromkeys(('completed', 'failed', 'skipped'), 0)
+        try:
+            _run_batch(schedules, run_at, catch_up, batch_counts)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning('Scheduled transfer batch failed, retrying one by one: %s', e)
+            batch_counts = dict.fromkeys(batch_counts, 0)
+            for schedule_id in [s.id for s in schedules]:
+                _run_alone(schedule_id, run_at, catch_up, retry, batch_counts, counts)
+        for key, value in batch_counts.items():
+            counts[key] += value
+
+    return counts
+
+
+def _run_alone(schedule_id, now, catch_up, retry, batch_counts, counts):
+    """Run one schedule in its own transaction after its batch failed"""
+    schedule = ScheduledTransfer.query.filter_by(id=schedule_id, status='active') \
+        .filter(ScheduledTransfer.due_at <= now) \
+        .with_for_update(skip_locked=True).first()
+    if schedule is None:
+        return  # taken by another runner, or already advanced
+    try:
+        _run_batch([schedule], now, catch_up, batch_counts)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        counts['errors'] += 1
+        schedule = ScheduledTransfer.query.get(schedule_id)
+        schedule.last_error = str(e)[:255]
+        schedule.due_at = now + retry
+        db.session.commit()
+
+
+def run_scheduler(poll_seconds=None, batch_size=None):
+    """
+    Run due transfers forever, polling every SCHEDULED_TRANSFER_POLL_SECONDS
+
+    Yields:
+        dict: The counts of each pass that did some work
+    """
+    poll_seconds = poll_seconds or current_app.config.get('SCHEDULED_TRANSFER_POLL_SECONDS', 30)
+    while True:
+        counts = run_due_transfers(batch_size=batch_size)
+        db.session.remove()
+        if counts['batches']:
+            yield counts
+        time.sleep(poll_seconds)
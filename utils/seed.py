@@ -4,6 +4,7 @@ Database seeding utilities
 from __init__ import db
 from models import User, Wallet
 from utils.helpers import generate_unique_id
+from utils.money import to_minor
 
 
 def create_default_admin():
@@ -28,7 +29,7 @@ def create_default_admin():
         admin_wallet = Wallet(
             user_id=admin.id,
             wallet_id=generate_unique_id('QP'),
-            balance=10000.0
+            balance=to_minor(10000)
         )
         db.session.add(admin_wallet)
         
@@ -0,0 +1,207 @@
+"""
+Admin transaction search
+
+Filters map onto the composite indexes declared on Transaction, and pages
+are fetched by keyset on (created_at, id) rather than OFFSET, so every page
+costs the same however deep it is. `check_search_plans()` runs EXPLAIN
+QUERY PLAN for every filter combination and reports any that would scan
+the whole transactions table.
+"""
+import base64
+import json
+from datetime import datetime
+from itertools import combinations
+
+from sqlalchemy import and_, or_
+
+from __init__ import db
+from models import Transaction
+from utils.money import to_minor
+
+FILTERS = ('type', 'status', 'sender_id', 'receiver_id', 'amount', 'created_at', 'transaction_id')
+MAX_LIMIT = 500
+# Sorts after every character a transaction_id can contain
+PREFIX_END = '\uffff'
+
+
+def encode_cursor(transaction):
+    """Opaque cursor pointing just past a transaction"""
+    raw = json.dumps([transaction.created_at.isoformat(), transaction.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor()
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(id_)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_search_args(args):
+    """
+    Read search filters from query parameters
+
+    Supported: type, status, sender_id, receiver_id, min_amount, max_amount,
+    start, end (ISO datetimes, end exclusive), transaction_id (prefix),
+    cursor and limit.
+
+    Args:
+        args: request.args
+
+    Returns:
+        dict: Parsed filters, plus 'cursor' and 'limit'
+
+    Raises:
+        ValueError: If a parameter is invalid
+    """
+    filters = {}
+    for key in ('type', 'status', 'transaction_id'):
+        if args.get(key):
+            filters[key] = args[key]
+    for key in ('sender_id', 'receiver_id'):
+        if args.get(key):
+            filters[key] = int(args[key])
+    for key in ('min_amount', 'max_amount'):
+        if args.get(key):
+            filters[key] = to_minor(args[key])
+    for key in ('start', 'end'):
+        if args.get(key):
+            filters[key] = datetime.fromisoformat(args[key])
+
+    filters['limit'] = min(int(args.get('limit', 100)), MAX_LIMIT)
+    if filters['limit'] < 1:
+        raise ValueError('limit must be positive')
+    if args.get('cursor'):
+        filters['cursor'] = decode_cursor(args['cursor'])
+    return filters
+
+
+def build_search_query(filters, query=None):
+    """
+    Apply search filters and keyset ordering to a transaction query
+
+    Args:
+        filters (dict): Output of parse_search_args()
+        query: Base query (default: Transaction.query)
+
+    Returns:
+        Query: Filtered query, newest first, without a limit
+    """
+    query = query if query is not None else Transaction.query
+
+    for key in ('type', 'status', 'sender_id', 'receiver_id'):
+        if key in filters:
+            query = query.filter(getattr(Transaction, key) == filters[key])
+    if 'min_amount' in filters:
+        query = query.filter(Transaction.amount >= filters['min_amount'])
+    if 'max_amount' in filters:
+        query = query.filter(Transaction.amount <= filters['max_amount'])
+    if 'start' in filters:
+        query = query.filter(Transaction.created_at >= filters['start'])
+    if 'end' in filters:
+        query = query.filter(Transaction.created_at < filters['end'])
+    if 'transaction_id' in filters:
+        # A range rather than LIKE so the unique index is usable
+        prefix = filters['transaction_id']
+        query = query.filter(Transaction.transaction_id >= prefix,
+                             Transaction.transaction_id < prefix + PREFIX_END)
+
+    if 'cursor' in filters:
+        created_at, id_ = filters['cursor']
+        query = query.filter(or_(
+            Transaction.created_at < created_at,
+            and_(Transaction.created_at == created_at, Transaction.id < id_)
+        ))
+
+    return query.order_by(Transaction.created_at.desc(), Transaction.id.desc())
+
+
+def search_transactions(filters, query=None):
+    """
+    Fetch one page of search results
+
+    Args:
+        filters (dict): Output of parse_search_args()
+        query: Base query (default: Transaction.query)
+
+    Returns:
+        tuple: (transactions, next cursor or None)
+    """
+    limit = filters['limit']
+    rows = build_search_query(filters, query).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+def _sample_filters(keys):
+    """Representative filter values for a combination of FILTERS"""
+    now = datetime.utcnow()
+    filters = {'limit': 100}
+    for key in keys:
+        if key == 'type':
+            filters['type'] = 'transfer'
+        elif key == 'status':
+            filters['status'] = 'completed'
+        elif key in ('sender_id', 'receiver_id'):
+            filters[key] = 1
+        elif key == 'amount':
+            filters.update(min_amount=to_minor(10), max_amount=to_minor(100))
+        elif key == 'created_at':
+            filters.update(start=now.replace(year=now.year - 1), end=now)
+        elif key == 'transaction_id':
+            filters['transaction_id'] = 'TXN12'
+    return filters
+
+
+def explain_query_plan(query):
+    """
+    Run EXPLAIN QUERY PLAN for a query on SQLite
+
+    Returns:
+        list: Plan detail strings
+    """
+    compiled = query.statement.compile(dialect=db.session.get_bind().dialect,
+                                       compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {compiled}')).all()
+    return [row[-1] for row in rows]
+
+
+def is_full_scan(plan, table='transactions'):
+    """True if a plan reads every row of `table` instead of using an index"""
+    return any(
+        step.startswith(f'SCAN {table}') and 'USING' not in step
+        for step in plan
+    )
+
+
+def check_search_plans():
+    """
+    Explain every supported filter combination, with and without a cursor
+
+    Only meaningful on SQLite.
+
+    Returns:
+        list: Dicts with 'filters', 'plan' and 'full_scan' for each combination
+    """
+    results = []
+    for size in range(len(FILTERS) + 1):
+        for keys in combinations(FILTERS, size):
+            for paged in (False, True):
+                filters = _sample_filters(keys)
+                if paged:
+                    filters['cursor'] = (datetime.utcnow(), 1)
+                plan = explain_query_plan(build_search_query(filters).limit(filters['limit']))
+                results.append({
+                    'filters': list(keys) + (['cursor'] if paged else []),
+                    'plan': plan,
+                    'full_scan': is_full_scan(plan)
+                })
+    return results
@@ -0,0 +1,122 @@
+"""
+Wallet-to-wallet transfers
+
+Shared by POST /api/transactions/send and the scheduled-transfer runner.
+"""
+from datetime import datetime
+
+from sqlalchemy.orm import joinedload
+
+from __init__ import db
+from models import Wallet, Transaction
+from utils.helpers import generate_unique_id, calculate_fee, InsufficientFundsError, NotFoundError
+from utils.fees import corridor_for
+from utils.fx import get_fx_snapshot, rate_to_scaled, same_currency
+from utils.money import Money
+from utils.counterparties import record_transfer
+from utils.recent_history import stage_transaction, wallet_version
+
+
+def execute_transfer(sender_id, receiver, amount, note='', when=None):
+    """
+    Move money from the sender's wallet to the receiver's
+
+    Both wallets are locked in id order, so concurrent transfers and admin
+    adjustments cannot interleave with this one; their owners are loaded in
+    the same query. The amount and fee are in
+    the sender's currency; a receiver holding another currency is credited
+    the amount converted at the current FX snapshot's rate. Runs inside the
+    caller's transaction; the caller commits.
+
+    Args:
+        sender_id (int): Sending user
+        receiver (User): Receiving user
+        amount: Money in the sender's currency, or a major-unit value
+            (e.g. 12.5 or "12.50") read in it; the fee is added on top
+        note (str): Transaction note
+        when (datetime): Transaction time (default: now)
+
+    Returns:
+        tuple: (Transaction, sender User, sender Wallet)
+
+    Raises:
+        ValueError: If the amount is invalid or no exchange rate is known
+        NotFoundError: If either party has been deleted or a wallet is missing
+        InsufficientFundsError: If the sender cannot cover amount + fee
+    """
+    if receiver.deleted_at is not None:
+        raise NotFoundError('Receiver not found')
+
+    wallets = {
+        w.user_id: w for w in
+        Wallet.query.options(joinedload(Wallet.user, innerjoin=True))
+        .filter(Wallet.user_id.in_({sender_id, receiver.id}))
+        .order_by(Wallet.id).with_for_update(of=Wallet).populate_existing().all()
+    }
+
+    sender_wallet = wallets.get(sender_id)
+    if not sender_wallet:
+        raise NotFoundError('Sender wallet not found')
+
+    receiver_wallet = wallets.get(receiver.id)
+    if not receiver_wallet:
+        raise NotFoundError('Receiver wallet not found')
+
+    if not isinstance(amount, Money):
+        amount = Money.parse(amount, sender_wallet.currency)
+    elif not same_currency(amount.currency, sender_wallet.currency):
+        raise ValueError(f'Amount must be in {sender_wallet.currency}')
+    if amount.units <= 0:
+        raise ValueError('Invalid amount')
+
+    credit, rate = amount, None
+    if not same_currency(sender_wallet.currency, receiver_wallet.currency):
+        credit, rate = get_fx_snapshot().convert(amount, receiver_wallet.currency)
+
+    sender = sender_wallet.user
+    if sender.deleted_at is not None:
+        raise NotFoundError('Sender not found')
+
+    fee = calculate_fee(
+        amount,
+        segment=sender.segment,
+        corridor=corridor_for(sender.country, receiver.country)
+    )
+    total_amount = amount + fee
+
+    if sender_wallet.balance < total_amount.units:
+        raise InsufficientFundsError('Insufficient balance')
+
+    previous = {user_id: wallet_version(w) for user_id, w in wallets.items()}
+    now = when or datetime.utcnow()
+    sender_wallet.balance -= total_amount.units
+    receiver_wallet.balance += credit.units
+    sender_wallet.updated_at = now
+    receiver_wallet.updated_at = now
+
+    transaction = Transaction(
+        transaction_id=generate_unique_id('TXN', 7),
+        sender_id=sender_id,
+        receiver_id=receiver.id,
+        amount=amount.units,
+        fee=fee.units,
+        total_amount=total_amount.units,
+        currency=sender_wallet.currency,
+        receiver_amount=credit.units if rate is not None else None,
+        receiver_currency=receiver_wallet.currency if rate is not None else None,
+        fx_rate=rate_to_scaled(rate) if rate is not None else None,
+        type='transfer',
+        status='completed',
+        note=note,
+        created_at=now
+    )
+
+    db.session.add(transaction)
+    stage_transaction(
+        transaction,
+        {user_id: (previous[user_id], wallet_version(w)) for user_id, w in wallets.items()},
+        {sender_id: f"{sender.first_name} {sender.last_name}",
+         receiver.id: f"{receiver.first_name} {receiver.last_name}"}
+    )
+    record_transfer(sender_id, receiver.id, when=now)
+    return transaction, sender, sender_wallet
@@ -0,0 +1,271 @@
+"""
+User deletion
+
+Deleting a user through the admin API only tombstones the row: deleted_at
+is set, the account is made inactive, its email address is released, its
+wallet is closed and its tokens are revoked, all in one short transaction.
+From then on the user is gone to every read (login, transfers, quotes,
+counterparty suggestions and the admin user endpoints).
+
+A user_deletions row tracks the background purge of everything else, which
+`run_user_purges` works through in STAGES, USER_PURGE_CHUNK_SIZE rows per
+committed transaction, so no lock is held for long however much history the
+user has. Progress (stage, rows, keyset position) is saved with each chunk,
+so a purge that dies resumes where it stopped once its USER_PURGE_LEASE_SECONDS
+lease lapses. Transactions are kept for the other party's history and the
+ledger: they still point at the tombstoned row, whose name and contact
+details are anonymized last, and the notes the user wrote are cleared. Once
+the notes are gone, the user's cached statements are deleted, and so are the
+months of their receivers' cached statements that showed those notes.
+Transactions already moved to the archive are left as they are.
+"""
+import secrets
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from __init__ import db
+from models import Beneficiary, CounterpartyStat, ScheduledTransfer, Transaction, User, UserDeletion, Wallet
+from utils.export import drop_cached_statements
+from utils.recent_history import forget_user
+from utils.revocation import revoke_all_tokens
+
+
+def tombstone_email(user_id):
+    """Placeholder email of a deleted user, freeing their address"""
+    return f'deleted-{user_id}@deleted.invalid'
+
+
+def delete_user(user, requested_by=None):
+    """
+    Tombstone a user and queue the purge of their data
+
+    The caller commits, then calls forget_user().
+
+    Args:
+        user (User): User to delete
+        requested_by (int): Admin who asked for it
+
+    Returns:
+        UserDeletion: The queued purge
+    """
+    now = datetime.utcnow()
+    user.deleted_at = now
+    user.status = 'inactive'
+    user.email = tombstone_email(user.id)
+    user.updated_at = now
+    Wallet.query.filter_by(user_id=user.id).update(
+        {'status': 'closed', 'updated_at': now}, synchronize_session=False
+    )
+    revoke_all_tokens(user.id)
+
+    deletion = UserDeletion(
+        user_id=user.id,
+        requested_by=requested_by,
+        status='pending',
+        stage=STAGES[0][0],
+        requested_at=now
+    )
+    db.session.add(deletion)
+    return deletion
+
+
+def _delete_chunk(model, key, criteria, chunk_size):
+    """Delete up to chunk_size rows matching criteria, picked by key"""
+    keys = [row[0] for row in db.session.query(key).filter(*criteria).limit(chunk_size).all()]
+    if keys:
+        model.query.filter(key.in_(keys), *criteria).delete(synchronize_session=False)
+    return len(keys), len(keys) == chunk_size
+
+
+def _purge_scheduled_transfers(deletion, chunk_size):
+    # Before beneficiaries, which the schedules reference
+    return _delete_chunk(ScheduledTransfer, ScheduledTransfer.id,
+                         (ScheduledTransfer.user_id == deletion.user_id,), chunk_size)
+
+
+def _purge_beneficiaries(deletion, chunk_size):
+    return _delete_chunk(Beneficiary, Beneficiary.id, (Beneficiary.user_id == deletion.user_id,), chunk_size)
+
+
+def _purge_counterparties(deletion, chunk_size):
+    return _delete_chunk(CounterpartyStat, CounterpartyStat.counterparty_id,
+                         (CounterpartyStat.user_id == deletion.user_id,), chunk_size)
+
+
+def _purge_counterparty_links(deletion, chunk_size):
+    # Other users' suggestions of this one, by the counterparty_id index
+    return _delete_chunk(CounterpartyStat, CounterpartyStat.user_id,
+                         (CounterpartyStat.counterparty_id == deletion.user_id,), chunk_size)
+
+
+def _sent_transactions(deletion, chunk_size, *columns):
+    """Next chunk of the user's sent transactions after the saved position"""
+    # Walks the (sender_id, created_at, id) index
+    query = db.session.query(Transaction.id, Transaction.created_at, *columns) \
+        .filter(Transaction.sender_id == deletion.user_id)
+    if deletion.cursor_id is not None:
+        query = query.filter(or_(
+            Transaction.created_at > deletion.cursor_at,
+            and_(Transaction.created_at == deletion.cursor_at, Transaction.id > deletion.cursor_id)
+        ))
+    rows = query.order_by(Transaction.created_at, Transaction.id).limit(chunk_size).all()
+    if rows:
+        deletion.cursor_id, deletion.cursor_at = rows[-1].id, rows[-1].created_at
+    return rows
+
+
+def _clear_transaction_notes(deletion, chunk_size):
+    rows = _sent_transactions(deletion, chunk_size)
+    if not rows:
+        return 0, False
+
+    Transaction.query.filter(Transaction.id.in_([r.id for r in rows]), Transaction.note.isnot(None)) \
+        .update({'note': None}, synchronize_session=False)
+    return len(rows), len(rows) == chunk_size
+
+
+def _drop_statement_caches(deletion, chunk_size):
+    # After the notes are committed cleared, so a statement rebuilt meanwhile is clean
+    if deletion.cursor_id is None:
+        drop_cached_statements(deletion.user_id)
+
+    rows = _sent_transactions(deletion, chunk_size, Transaction.receiver_id)
+    months = {(r.receiver_id, r.created_at.strftime('%Y-%m')) for r in rows if r.receiver_id != deletion.user_id}
+    for receiver_id, month in months:
+        drop_cached_statements(receiver_id, month)
+    return len(rows), len(rows) == chunk_size
+
+
+def _anonymize_profile(deletion, chunk_size):
+    user = User.query.get(deletion.user_id)
+    user.first_name = 'Deleted'
+    user.last_name = 'User'
+    user.phone = None
+    user.set_password(secrets.token_urlsafe(32))
+    user.updated_at = datetime.utcnow()
+    return 1, False
+
+
+# Purge stages in order; each takes (deletion, chunk_size) and returns
+# (rows processed, whether more remain). A stage must be safe to repeat.
+STAGES = (
+    ('scheduled_transfers', _purge_scheduled_transfers),
+    ('beneficiaries', _purge_beneficiaries),
+    ('counterparties', _purge_counterparties),
+    ('counterparty_links', _purge_counterparty_links),
+    ('transaction_notes', _clear_transaction_notes),
+    ('statement_caches', _drop_statement_caches),
+    ('profile', _anonymize_profile),
+)
+
+
+def _claim(now, lease):
+    """Next purge that is pending, or whose runner stopped renewing its lease"""
+    return UserDeletion.query \
+        .filter(or_(
+            UserDeletion.status == 'pending',
+            and_(UserDeletion.status.in_(('running', 'failed')), UserDeletion.updated_at <= now - lease)
+        )) \
+        .order_by(UserDeletion.id) \
+        .with_for_update(skip_locked=True) \
+        .first()
+
+
+def purge_user(deletion, chunk_size, pause=0):
+    """
+    Run a claimed purge to the end, committing after every chunk
+
+    Args:
+        deletion (UserDeletion): Purge to run
+        chunk_size (int): Rows per transaction
+        pause (float): Seconds to sleep between chunks
+    """
+    now = datetime.utcnow()
+    deletion.status = 'running'
+    deletion.started_at = deletion.started_at or now
+    deletion.last_error = None
+    deletion.updated_at = now
+    db.session.commit()
+
+    names = [name for name, _ in STAGES]
+    start = names.index(deletion.stage) if deletion.stage in names else 0
+    for name, step in STAGES[start:]:
+        if deletion.stage != name:
+            deletion.stage = name
+            deletion.cursor_at = deletion.cursor_id = None
+        more = True
+        while more:
+            rows, more = step(deletion, chunk_size)
+            deletion.rows_processed += rows
+            deletion.chunks += 1
+            deletion.updated_at = datetime.utcnow()
+            db.session.commit()
+            if more and pause:
+                time.sleep(pause)
+
+    deletion.status = 'completed'
+    deletion.stage = None
+    deletion.completed_at = deletion.updated_at = datetime.utcnow()
+    db.session.commit()
+    forget_user(deletion.user_id)
+
+
+def run_user_purges(chunk_size=None, max_users=None):
+    """
+    Purge deleted users until none is waiting
+
+    A purge that fails is recorded as failed and retried once its lease
+    lapses, from the last committed chunk.
+
+    Args:
+        chunk_size (int): Rows per transaction (default: USER_PURGE_CHUNK_SIZE)
+        max_users (int): Stop after this many purges (default: until none is waiting)
+
+    Returns:
+        dict: Purges completed and failed, and rows processed
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config.get('USER_PURGE_CHUNK_SIZE', 500)
+    pause = config.get('USER_PURGE_CHUNK_PAUSE_SECONDS', 0.05)
+    lease = timedelta(seconds=config.get('USER_PURGE_LEASE_SECONDS', 300))
+    counts = {'completed': 0, 'failed': 0, 'rows': 0}
+
+    while max_users is None or counts['completed'] + counts['failed'] < max_users:
+        deletion = _claim(datetime.utcnow(), lease)
+        if deletion is None:
+            break
+        deletion_id, rows_before = deletion.id, deletion.rows_processed
+        try:
+            purge_user(deletion, chunk_size, pause)
+            counts['completed'] += 1
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning('Purge of deleted user failed: %s', e)
+            counts['failed'] += 1
+            deletion = UserDeletion.query.get(deletion_id)
+            deletion.status = 'failed'
+            deletion.last_error = str(e)[:255]
+            deletion.updated_at = datetime.utcnow()
+            db.session.commit()
+        counts['rows'] += deletion.rows_processed - rows_before
+
+    return counts
+
+
+def run_purger(poll_seconds=None, chunk_size=None):
+    """
+    Purge deleted users forever, polling every USER_PURGE_POLL_SECONDS
+
+    Yields:
+        dict: The counts of each pass that did some work
+    """
+    poll_seconds = poll_seconds or current_app.config.get('USER_PURGE_POLL_SECONDS', 30)
+    while True:
+        counts = run_user_purges(chunk_size=chunk_size)
+        db.session.remove()
+        if counts['completed'] or counts['failed']:
+            yield counts
+        time.sleep(poll_seconds)
@@ -0,0 +1,270 @@
+"""
+Bulk user import
+
+Streams CSV or NDJSON rows, validates them with the same helpers used for
+single registrations, hashes passwords in a process pool and bulk-inserts
+users and wallets one chunk at a time. Only one chunk is held in memory:
+duplicates within a chunk are caught as it is built, and duplicates of rows
+from earlier chunks by the existing-email check, since those are committed.
+
+Each worker process keeps one hashing pool for all imports. Under gevent
+workers, where forking a pool from a monkey-patched process is unsafe,
+passwords are hashed in-process instead, yielding to other greenlets
+between rows.
+"""
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt as bcrypt_lib
+from sqlalchemy import func, insert
+
+from __init__ import db
+from models import User, Wallet
+from utils.helpers import (
+    generate_unique_id,
+    validate_email,
+    validate_phone,
+    validate_password_strength
+)
+
+REQUIRED_FIELDS = ('first_name', 'last_name', 'email', 'password')
+OPTIONAL_FIELDS = ('phone', 'country', 'segment')
+# Column lengths, checked per row so one oversized value cannot fail a whole chunk's INSERT
+MAX_LENGTHS = {
+    field: User.__table__.c[field].type.length
+    for field in ('first_name', 'last_name', 'email') + OPTIONAL_FIELDS
+}
+# Rows per INSERT statement of a bulk insert (SQLAlchemy's insertmanyvalues_page_size)
+INSERT_PAGE_ROWS = 1000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hash_password(password, rounds=12):
+    """
+    Hash a password the same way Flask-Bcrypt does
+
+    Module-level so it can run in a worker process.
+    """
+    salt = bcrypt_lib.gensalt(rounds=rounds, prefix=b'2b')
+    return bcrypt_lib.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def _gevent_patched():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def get_hash_pool(workers=None):
+    """
+    Get this process's password hashing pool, starting it on first use
+
+    Args:
+        workers (int): Pool size when it is started (default: CPU count)
+
+    Returns:
+        ProcessPoolExecutor: Shared pool, or None to hash in-process (gevent)
+    """
+    global _pool
+    if _gevent_patched():
+        return None
+    with _pool_lock:
+        # A pool whose worker died cannot be used again
+        if _pool is None or getattr(_pool, '_broken', False):
+            _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        return _pool
+
+
+def _hash_inline(passwords, rounds):
+    for password in passwords:
+        yield hash_password(password, rounds)
+        time.sleep(0)  # a greenlet switch when gevent has patched time
+
+
+def iter_rows(stream, fmt='csv'):
+    """
+    Lazily parse an uploaded file
+
+    Args:
+        stream: Binary file-like object
+        fmt (str): 'csv' or 'ndjson'
+
+    Yields:
+        tuple: (row number, dict or None, parse error or None)
+    """
+    # utf-8-sig drops the byte order mark spreadsheet exports start with
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'ndjson':
+        for row_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield row_number, None, 'Invalid JSON'
+                continue
+            if not isinstance(row, dict):
+                yield row_number, None, 'Each line must be a JSON object'
+                continue
+            yield row_number, row, None
+    else:
+        # Row 1 is the header
+        for row_number, row in enumerate(csv.DictReader(text), start=2):
+            yield row_number, row, None
+
+
+def validate_row(row):
+    """
+    Validate one import row
+
+    Args:
+        row (dict): Parsed row
+
+    Returns:
+        tuple: (cleaned row or None, error message or None)
+    """
+    for field in REQUIRED_FIELDS:
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, f'{field} is required'
+
+    email = row['email'].strip().lower()
+    if not validate_email(email):
+        return None, 'Invalid email'
+
+    phone = (row.get('phone') or '').strip() or None
+    if phone and not validate_phone(phone):
+        return None, 'Invalid phone number'
+
+    is_valid, error = validate_password_strength(row['password'])
+    if not is_valid:
+        return None, error
+
+    cleaned = {
+        'first_name': row['first_name'].strip(),
+        'last_name': row['last_name'].strip(),
+        'email': email,
+        'password': row['password'],
+        'phone': phone
+    }
+    for field in ('country', 'segment'):
+        value = (row.get(field) or '').strip()
+        if value:
+            cleaned[field] = value
+
+    for field, max_length in MAX_LENGTHS.items():
+        if cleaned.get(field) and len(cleaned[field]) > max_length:
+            return None, f'{field} must have at most {max_length} characters'
+    return cleaned, None
+
+
+def _insert_chunk(chunk, pool, rounds):
+    """Hash passwords and insert one chunk of users and their wallets"""
+    emails = [r['email'] for _, r in chunk]
+    existing = {
+        email for (email,) in
+        db.session.query(func.lower(User.email)).filter(func.lower(User.email).in_(emails)).all()
+    }
+
+    errors = []
+    fresh = []
+    for row_number, row in chunk:
+        if row['email'] in existing:
+            errors.append({'row': row_number, 'error': 'Email already registered'})
+        else:
+            fresh.append((row_number, row))
+
+    if not fresh:
+        return 0, errors
+
+    passwords = [r['password'] for _, r in fresh]
+    if pool is None:
+        hashes = _hash_inline(passwords, rounds)
+    else:
+        hashes = pool.map(hash_password, passwords, [rounds] * len(fresh),
+                          chunksize=max(1, len(fresh) // 16))
+
+    user_rows = []
+    for (_, row), password_hash in zip(fresh, hashes):
+        user_row = {k: v for k, v in row.items() if k != 'password'}
+        user_row.update(password_hash=password_hash, role='user', status='active')
+        user_rows.append(user_row)
+
+    try:
+        # Matched back by email: RETURNING in parameter order costs one
+        # statement per row on SQLite, unordered RETURNING one per page
+        inserted = db.session.execute(insert(User).returning(User.id, User.email), user_rows).all()
+        ids_by_email = {email: user_id for user_id, email in inserted}
+        user_ids = [ids_by_email[row['email']] for row in user_rows]
+        db.session.execute(insert(Wallet), [
+            {'user_id': user_id, 'wallet_id': generate_unique_id('QP'), 'balance': 0}
+            for user_id in user_ids
+        ])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        errors.extend({'row': row_number, 'error': f'Insert failed: {e}'} for row_number, _ in fresh)
+        return 0, errors
+
+    return len(user_ids), errors
+
+
+def import_users(stream, fmt='csv', chunk_size=500, workers=None, rounds=12):
+    """
+    Import users from a stream, yielding progress as it goes
+
+    Args:
+        stream: Binary file-like object
+        fmt (str): 'csv' or 'ndjson'
+        chunk_size (int): Rows hashed and inserted per commit
+        workers (int): Password hashing processes (default: CPU count)
+        rounds (int): bcrypt log rounds
+
+    Yields:
+        dict: 'error' events for rejected rows, a 'progress' event per
+            chunk and a final 'done' event
+    """
+    processed = created = failed = 0
+    chunk = []
+    chunk_emails = set()
+    pool = get_hash_pool(workers)
+
+    def flush():
+        nonlocal created, failed
+        inserted, errors = _insert_chunk(chunk, pool, rounds)
+        created += inserted
+        failed += len(errors)
+        chunk.clear()
+        chunk_emails.clear()
+        for error in errors:
+            yield {'event': 'error', **error}
+        yield {'event': 'progress', 'processed': processed, 'created': created, 'failed': failed}
+
+    for row_number, row, error in iter_rows(stream, fmt):
+        processed += 1
+        if error is None:
+            row, error = validate_row(row)
+        if error is None and row['email'] in chunk_emails:
+            error = 'Duplicate email in file'
+        if error is not None:
+            failed += 1
+            yield {'event': 'error', 'row': row_number, 'error': error}
+            continue
+
+        chunk_emails.add(row['email'])
+        chunk.append((row_number, row))
+        if len(chunk) >= chunk_size:
+            yield from flush()
+
+    if chunk:
+        yield from flush()
+
+    yield {'event': 'done', 'processed': processed, 'created': created, 'failed': failed}
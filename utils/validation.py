@@ -0,0 +1,407 @@
+"""
+Declarative request validation
+
+Each endpoint declares a Schema of Fields at import time. A schema compiles
+every field into a short chain of checks once, so validating a request is
+one pass over the body with no per-request setup. `validate_json` runs the
+schema before the handler: below the authentication decorators, but ahead
+of any database query or password hashing in the handler itself. A bad body
+gets a 400 listing every invalid field:
+
+    {"error": "amount must be a positive number",
+     "errors": {"amount": "amount must be a positive number"}}
+
+The handler reads the cleaned body, with values coerced to their declared
+types and unknown keys dropped, from `g.body`.
+"""
+import re
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+from utils.helpers import validate_email, validate_phone, validate_password_strength
+
+# Methods whose body is validated; others pass straight through
+BODY_METHODS = ('POST', 'PUT', 'PATCH')
+
+_MISSING = object()
+
+# ASCII digits only: str.isdigit() also accepts '²' and other digits int() rejects
+_INT_RE = re.compile(r'-?[0-9]+')
+
+
+class Invalid(Exception):
+    """
+    A value failed a check
+
+    The message completes '<field> ...' ('must be a string'); one starting
+    with a capital letter is a whole sentence and is reported as is.
+    """
+    pass
+
+
+class NestedInvalid(Exception):
+    """Errors for several fields, keyed by field path"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _coerce_str(value):
+    if not isinstance(value, str):
+        raise Invalid('must be a string')
+    return value.strip()
+
+
+def _coerce_secret(value):
+    # Passwords and tokens are compared as sent, never stripped
+    if not isinstance(value, str):
+        raise Invalid('must be a string')
+    return value
+
+
+def _coerce_int(value):
+    # bool is an int subclass, but never a valid id or count
+    if isinstance(value, bool):
+        raise Invalid('must be an integer')
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and _INT_RE.fullmatch(value.strip()):
+        return int(value)
+    raise Invalid('must be an integer')
+
+
+def _coerce_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str, Decimal)):
+        raise Invalid('must be a number')
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise Invalid('must be a number')
+    if not number.is_finite():
+        raise Invalid('must be a number')
+    return number
+
+
+def _coerce_amount(value):
+    amount = _coerce_number(value)
+    if amount <= 0:
+        raise Invalid('must be a positive number')
+    return amount
+
+
+def _coerce_bool(value):
+    if not isinstance(value, bool):
+        raise Invalid('must be true or false')
+    return value
+
+
+def _coerce_datetime(value):
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.strip())
+        except ValueError:
+            pass
+        else:
+            # Stored datetimes are naive UTC
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+    raise Invalid('must be an ISO 8601 datetime')
+
+
+def _coerce_email(value):
+    # Addresses are stored lowercased and looked up by lower(email)
+    value = _coerce_str(value).lower()
+    if not validate_email(value):
+        raise Invalid('must be a valid email address')
+    return value
+
+
+def _coerce_phone(value):
+    value = _coerce_str(value)
+    if not validate_phone(value):
+        raise Invalid('must be a valid phone number')
+    return value
+
+
+def _coerce_password(value):
+    value = _coerce_secret(value)
+    is_valid, error = validate_password_strength(value)
+    if not is_valid:
+        raise Invalid(error)
+    return value
+
+
+def _coerce_list(value):
+    if not isinstance(value, list):
+        raise Invalid('must be a list')
+    return value
+
+
+def _coerce_dict(value):
+    if not isinstance(value, dict):
+        raise Invalid('must be an object')
+    return value
+
+
+KINDS = {
+    'str': _coerce_str,
+    'secret': _coerce_secret,
+    'int': _coerce_int,
+    'number': _coerce_number,
+    'amount': _coerce_amount,
+    'bool': _coerce_bool,
+    'datetime': _coerce_datetime,
+    'email': _coerce_email,
+    'phone': _coerce_phone,
+    'password': _coerce_password,
+    'list': _coerce_list,
+    'dict': _coerce_dict,
+}
+
+
+def setting(name):
+    """Bound read from the app config when a value is checked, e.g. max=setting('MAX_TRANSACTION_AMOUNT')"""
+    def bound():
+        value = current_app.config.get(name)
+        return None if value is None else Decimal(str(value))
+    return bound
+
+
+def _bound(value):
+    # 10000.0 reads as 10000 in messages
+    return int(value) if value == int(value) else value
+
+
+class Field:
+    """
+    One field of a schema
+
+    Args:
+        kind (str): One of KINDS; strings are stripped (secrets are not),
+            ints accept digit strings, numbers and amounts become Decimals,
+            datetimes are parsed from ISO 8601 (as naive UTC), passwords must pass
+            validate_password_strength
+        required (bool): Reject the body if the field is missing or null
+        default: Value used when the field is missing (default: omit it)
+        min, max: Inclusive bounds for ints and numbers, or callables
+            returning them when a value is checked (see `setting`)
+        min_length, max_length: Bounds on the length of strings, lists and
+            dicts
+        pattern (str): Regex a string must fully match
+        choices (tuple): Allowed values
+        check (callable): Extra check returning an error message or None
+        items (Field or Schema): Validates each element of a list
+        values (Field or Schema): Validates each value of a dict
+        keys (Field): Validates each key of a dict
+    """
+
+    def __init__(self, kind='str', required=False, default=_MISSING, min=None, max=None,
+                 min_length=None, max_length=None, pattern=None, choices=None, check=None,
+                 items=None, values=None, keys=None):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown field kind: {kind}')
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.validate = self._compile(min, max, min_length, max_length, pattern, choices,
+                                      check, items, values, keys)
+
+    def _compile(self, min, max, min_length, max_length, pattern, choices, check, items, values, keys):
+        """Build the field's checks once; returns value -> cleaned value"""
+        steps = []
+        if min is not None:
+            lower = min if callable(min) else lambda: min
+            def check_min(value):
+                bound = lower()
+                if bound is not None and value < bound:
+                    raise Invalid(f'must be at least {_bound(bound)}')
+            steps.append(check_min)
+        if max is not None:
+            upper = max if callable(max) else lambda: max
+            def check_max(value):
+                bound = upper()
+                if bound is not None and value > bound:
+                    raise Invalid(f'must be at most {_bound(bound)}')
+            steps.append(check_max)
+        if min_length is not None:
+            noun = 'character' if self.kind in ('str', 'secret') else 'item'
+            def check_min_length(value):
+                if len(value) < min_length:
+                    raise Invalid(f'must have at least {min_length} {noun}{"s" if min_length != 1 else ""}')
+            steps.append(check_min_length)
+        if max_length is not None:
+            noun = 'character' if self.kind in ('str', 'secret') else 'item'
+            def check_max_length(value):
+                if len(value) > max_length:
+                    raise Invalid(f'must have at most {max_length} {noun}{"s" if max_length != 1 else ""}')
+            steps.append(check_max_length)
+        if pattern is not None:
+            regex = re.compile(pattern)
+            def check_pattern(value):
+                if not regex.fullmatch(value):
+                    raise Invalid('has an invalid format')
+            steps.append(check_pattern)
+        if choices is not None:
+            allowed = frozenset(choices)
+            message = f"must be one of {', '.join(map(str, choices))}"
+            def check_choices(value):
+                if value not in allowed:
+                    raise Invalid(message)
+            steps.append(check_choices)
+        if check is not None:
+            def check_custom(value):
+                error = check(value)
+                if error:
+                    raise Invalid(error)
+            steps.append(check_custom)
+
+        coerce = KINDS[self.kind]
+        steps = tuple(steps)
+
+        def validate(value):
+            value = coerce(value)
+            for step in steps:
+                step(value)
+            return value
+
+        if items is not None:
+            return _nested(validate, lambda value: enumerate(value), items, '[{}]', list)
+        if values is not None or keys is not None:
+            return _nested(validate, lambda value: value.items(), values, '.{}', dict, keys)
+        return validate
+
+
+def _join(path, sub):
+    return path + sub if sub[:1] in '[.' else f'{path}.{sub}'
+
+
+def _nested(validate, pairs, inner, suffix, build, keys=None):
+    """Wrap a list/dict field so its elements are validated too"""
+    def validate_nested(value):
+        value = validate(value)
+        cleaned, errors = [] if build is list else {}, {}
+        for key, element in pairs(value):
+            path = suffix.format(key)
+            try:
+                if keys is not None:
+                    key = keys.validate(key)
+                element = inner.validate(element) if inner is not None else element
+            except Invalid as e:
+                errors[path] = str(e)
+                continue
+            except NestedInvalid as e:
+                errors.update({_join(path, sub): message for sub, message in e.errors.items()})
+                continue
+            if build is list:
+                cleaned.append(element)
+            else:
+                cleaned[key] = element
+        if errors:
+            raise NestedInvalid(errors)
+        return cleaned
+    return validate_nested
+
+
+class Schema:
+    """
+    Compiled validator for a JSON object
+
+    Args:
+        fields (dict): Field name -> Field
+        require_any (tuple): At least one of these fields must be present
+    """
+
+    def __init__(self, fields, require_any=None):
+        self.fields = dict(fields)
+        self.require_any = tuple(require_any or ())
+        self._compiled = tuple(
+            (name, field.required, field.default, field.validate)
+            for name, field in self.fields.items()
+        )
+
+    def validate(self, data):
+        """
+        Validate and clean a parsed body
+
+        Args:
+            data (dict): Parsed JSON object
+
+        Returns:
+            dict: Cleaned values of the declared fields
+
+        Raises:
+            NestedInvalid: With a message per invalid field (path)
+        """
+        if not isinstance(data, dict):
+            raise Invalid('must be a JSON object')
+
+        cleaned, errors = {}, {}
+        for name, required, default, validate in self._compiled:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    errors[name] = 'is required'
+                elif default is not _MISSING:
+                    cleaned[name] = default
+                continue
+            try:
+                cleaned[name] = validate(value)
+            except Invalid as e:
+                errors[name] = str(e)
+            except NestedInvalid as e:
+                errors.update({_join(name, path): message for path, message in e.errors.items()})
+
+        if self.require_any and not any(name in cleaned for name in self.require_any):
+            errors.setdefault(self.require_any[0], f"One of {', '.join(self.require_any)} is required")
+
+        if errors:
+            raise NestedInvalid(errors)
+        return cleaned
+
+
+def _message(path, message):
+    # Password strength messages are already complete sentences
+    return message if message[:1].isupper() else f'{path} {message}'
+
+
+def validation_errors(errors):
+    """Field errors as complete messages, keyed by field path"""
+    return {path: _message(path, message) for path, message in errors.items()}
+
+
+def error_message(error, subject='Request body'):
+    """First message of a failed validation, as a complete sentence"""
+    if isinstance(error, NestedInvalid):
+        return next(iter(validation_errors(error.errors).values()))
+    return _message(subject, str(error))
+
+
+def validate_json(schema):
+    """
+    Decorator validating the JSON body of POST/PUT/PATCH requests
+
+    Place it below @jwt_required()/@admin_required so unauthenticated
+    requests still get a 401. A missing body is validated as {}.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if request.method not in BODY_METHODS:
+                return fn(*args, **kwargs)
+
+            data = request.get_json(silent=True)
+            try:
+                g.body = schema.validate({} if data is None else data)
+            except Invalid as e:
+                return jsonify({'error': error_message(e)}), 400
+            except NestedInvalid as e:
+                errors = validation_errors(e.errors)
+                return jsonify({'error': next(iter(errors.values())), 'errors': errors}), 400
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers
+
+    gunicorn wsgi:app
+
+`run.py` starts Flask's development server instead.
+"""
+import os
+
+from __init__ import create_app
+
+app = create_app(os.environ.get('FLASK_CONFIG', 'production'))